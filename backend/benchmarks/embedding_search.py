@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Search latency benchmark for services/embedding_store.py
+
+Builds brute-force and IVF indexes over synthetic clustered unit vectors
+(10k and 100k by default), saves and memory-maps them like per-source
+indexes, and reports per-query latency and IVF recall@k against exact search.
+
+    cd backend && python benchmarks/embedding_search.py --dim 1536
+"""
+
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services.embedding_store import VectorIndex, EMBEDDING_IVF_NPROBE
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, rng: np.random.RandomState) -> np.ndarray:
+    """Vectors around `clusters` random topics, like chunks of many documents."""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.randint(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def time_queries(index: VectorIndex, queries: np.ndarray, top_k: int, n_probe: int):
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(index.search(query, top_k, n_probe=n_probe)[0])
+        latencies.append((time.perf_counter() - started) * 1000)
+    return np.array(latencies), results
+
+
+def recall(exact, approximate) -> float:
+    hits = sum(len({i for i, _ in e} & {i for i, _ in a}) for e, a in zip(exact, approximate))
+    return hits / max(1, sum(len(e) for e in exact))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--n-probe", type=int, default=EMBEDDING_IVF_NPROBE)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    print(f"dim={args.dim} queries={args.queries} top_k={args.top_k} n_probe={args.n_probe}")
+    for n in args.sizes:
+        vectors = synthetic_vectors(n, args.dim, clusters=max(8, n // 500), rng=rng)
+        queries = vectors[rng.choice(n, args.queries, replace=False)] + 0.05 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for label, ivf in (("brute", False), ("ivf", True)):
+                started = time.perf_counter()
+                built = VectorIndex.build(vectors, ivf=ivf)
+                build_s = time.perf_counter() - started
+                path = Path(tmp) / label
+                built.save(path)
+                started = time.perf_counter()
+                index = VectorIndex.load(path)
+                load_ms = (time.perf_counter() - started) * 1000
+
+                latencies, results = time_queries(index, queries, args.top_k, args.n_probe)
+                if label == "brute":
+                    exact = results
+                line = (
+                    f"n={n:>7} {label:>5}: build {build_s:6.2f}s  mmap load {load_ms:5.1f}ms  "
+                    f"p50 {np.percentile(latencies, 50):6.2f}ms  p95 {np.percentile(latencies, 95):6.2f}ms"
+                )
+                if label == "ivf":
+                    line += f"  recall@{args.top_k} {recall(exact, results):.3f}"
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
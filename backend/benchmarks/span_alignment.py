@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Span alignment benchmark for services/span_align.py
+
+Times the previous word-by-word `find_span_in_chunk` against
+`span_align.find_span` on long synthetic chunks, for a verbatim sentence near
+the end of the chunk, a lightly edited one and one that does not occur
+(checking whether each returned span actually covers the sentence), with
+the chunk tokenized once for many sentences, and on a chunk where the
+sentence's opening words repeat throughout.
+
+    cd backend && python benchmarks/span_alignment.py
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services import span_align
+
+
+def legacy_find_span(sentence: str, chunk_text: str) -> Tuple[int, int]:
+    """The alignment summary_builder (and the old Celery task) used before span_align."""
+    start_idx = chunk_text.lower().find(sentence.lower())
+    if start_idx != -1:
+        return start_idx, start_idx + len(sentence)
+    sentence_words = sentence.lower().split()
+    chunk_words = chunk_text.lower().split()
+    best_match_start = None
+    best_match_length = 0
+    for i in range(len(chunk_words)):
+        match_length = 0
+        for j in range(len(sentence_words)):
+            if i + j < len(chunk_words) and chunk_words[i + j] == sentence_words[j]:
+                match_length += 1
+            else:
+                break
+        if match_length > best_match_length and match_length >= 3:
+            best_match_length = match_length
+            word_start_idx = chunk_text.lower().find(chunk_words[i])
+            word_end_idx = word_start_idx
+            for k in range(best_match_length):
+                if i + k < len(chunk_words):
+                    word_end_idx += len(chunk_words[i + k]) + 1
+            best_match_start = word_start_idx
+            best_match_end = word_end_idx - 1
+    if best_match_start is not None:
+        return best_match_start, best_match_end
+    return 0, min(240, len(chunk_text))
+
+
+def synthetic_chunk(words: int, rng: np.random.RandomState) -> str:
+    vocabulary = [f"term{i}" for i in range(2000)] + ["the", "of", "and", "a", "in", "is"] * 200
+    tokens = list(rng.choice(vocabulary, words))
+    return " ".join(tokens)
+
+
+def best_ms(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    for words in args.sizes:
+        chunk = synthetic_chunk(words, rng)
+        tokens = chunk.split()
+        at = int(words * 0.9)
+        verbatim = " ".join(tokens[at:at + 15])
+        # Same sentence with two words changed: no exact substring, no 3-word prefix
+        edited_tokens = tokens[at:at + 15]
+        edited_tokens[1] = "changed"
+        edited_tokens[7] = "words"
+        edited = " ".join(edited_tokens)
+        expected_start = len(" ".join(tokens[:at])) + 1
+
+        print(f"chunk of {words} words:")
+        for label, sentence in (("verbatim", verbatim), ("edited", edited), ("absent", "nothing like this occurs anywhere here")):
+            for name, fn in (("legacy", legacy_find_span), ("span_align", span_align.find_span)):
+                start, end = fn(sentence, chunk)
+                ms = best_ms(lambda: fn(sentence, chunk), args.repeats)
+                located = label != "absent" and abs(start - expected_start) <= 30
+                print(f"  {label:>8} {name:>10}: {ms:9.2f}ms  span=({start}, {end})  located={located}")
+
+        # Several sentences against one chunk (e.g. card evidence against a
+        # transcript window): tokenize once, align each sentence
+        tokenized = span_align.TokenizedText(chunk)
+        ms = best_ms(lambda: [span_align.align(edited, tokenized) for _ in range(20)], args.repeats) / 20
+        print(f"  {'reused':>8} {'span_align':>10}: {ms:9.2f}ms per edited sentence (20 on one TokenizedText)")
+
+        # Transcript-like repetition: the sentence's prefix recurs all over the
+        # chunk, so the old scan compares many words at almost every position
+        phrase = "so the cell divides and then the cell grows again"
+        repetitive = " ".join([phrase] * (words // 10))
+        sentence = " ".join([phrase] * 3) + " until it stops"
+        for name, fn in (("legacy", legacy_find_span), ("span_align", span_align.find_span)):
+            start, end = fn(sentence, repetitive)
+            ms = best_ms(lambda: fn(sentence, repetitive), args.repeats)
+            print(f"  {'repeats':>8} {name:>10}: {ms:9.2f}ms  span=({start}, {end})")
+
+
+if __name__ == "__main__":
+    main()
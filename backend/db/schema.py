@@ -0,0 +1,30 @@
+"""
+Schema Initialization
+
+Creates every table the backend owns, once per process at startup (the API's
+startup event, job_worker.py's main), instead of as a side effect of
+importing the module that uses it. Importing a service from a script or a
+test no longer creates a database in the current directory.
+
+Each module keeps its own DDL in an idempotent `init_db()`; this calls them
+in one place.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def init_db() -> None:
+    """Create all tables (IF NOT EXISTS); safe to call more than once."""
+    from services import batch_lane, content_index, dedup_index, job_queue, llm_cache, summary_builder
+
+    content_index.init_db()
+    dedup_index.init_db()
+    llm_cache.init_db()
+    job_queue.init_db()
+    batch_lane.init_db()
+    try:
+        summary_builder.init_db()
+    except Exception as e:
+        logger.warning(f"Could not initialize summary tables: {e}")
@@ -0,0 +1,193 @@
+"""
+Shared SQLite access layer.
+
+Every SQLite user in the backend (dual_repo's pdfs table, the content index,
+health checks) goes through this module instead of opening a new connection
+per call:
+
+- Reads use one long-lived connection per thread
+- Writes are serialized through a single writer thread, so concurrent
+  background tasks never race each other for the write lock
+- Connections run in WAL mode with a busy_timeout, so readers are not
+  blocked by the writer and short lock waits retry instead of failing with
+  "database is locked"
+- sqlite3's per-connection statement cache keeps hot queries prepared
+
+The writer thread serializes writes within one process. Other processes
+using the same file (the API and a standalone job_worker) are serialized by
+SQLite's own file lock, waiting up to busy_timeout. WAL needs every process
+to see the same -wal/-shm files next to the database, i.e. the same
+directory on one host (docker-compose mounts the data directory, not the
+file). Set SQLITE_JOURNAL_MODE=DELETE where that does not hold, e.g. on a
+network filesystem.
+
+The database path comes from DATABASE_URL when it is a sqlite:/// URL.
+When the app runs on Postgres, the SQLite-only tables (pdfs, content index)
+live in SQLITE_DB_PATH.
+"""
+
+import os
+import queue
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Sequence, TypeVar
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Configuration
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///pdf_flashcards.db")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_STATEMENT_CACHE_SIZE = int(os.getenv("SQLITE_STATEMENT_CACHE_SIZE", "128"))
+SQLITE_WRITE_TIMEOUT_SECONDS = float(os.getenv("SQLITE_WRITE_TIMEOUT_SECONDS", "30"))
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+
+
+def _resolve_db_path() -> str:
+    if DATABASE_URL.startswith("sqlite:///"):
+        return DATABASE_URL.replace("sqlite:///", "", 1)
+    return os.getenv("SQLITE_DB_PATH", "pdf_flashcards.db")
+
+
+SQLITE_DB_PATH = _resolve_db_path()
+
+
+def _apply_pragmas(conn) -> None:
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        if SQLITE_JOURNAL_MODE not in ("WAL", "DELETE", "TRUNCATE", "PERSIST"):
+            raise ValueError(f"Unsupported SQLITE_JOURNAL_MODE: {SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+        if SQLITE_JOURNAL_MODE == "WAL":
+            # WAL + NORMAL is durable across application crashes; only an OS crash
+            # can lose the last transactions
+            cursor.execute("PRAGMA synchronous = NORMAL")
+    finally:
+        cursor.close()
+
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Open a new connection with the shared settings (caller owns and closes it)."""
+    conn = sqlite3.connect(
+        db_path or SQLITE_DB_PATH,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=SQLITE_STATEMENT_CACHE_SIZE,
+    )
+    _apply_pragmas(conn)
+    return conn
+
+
+def configure_sqlalchemy_engine(engine) -> None:
+    """Apply the same WAL/busy_timeout settings to a SQLAlchemy engine on SQLite."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        _apply_pragmas(dbapi_connection)
+
+
+# ============================================================================
+# Reads: one connection per thread
+# ============================================================================
+
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """The calling thread's read connection (do not close it)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = connect()
+        # Autocommit: reads never hold a transaction open between calls
+        conn.isolation_level = None
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def read_connection() -> Iterator[sqlite3.Connection]:
+    """Context-manager form of get_connection(), for drop-in use in `with` blocks."""
+    yield get_connection()
+
+
+def fetch_one(sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+    return get_connection().execute(sql, params).fetchone()
+
+
+def fetch_all(sql: str, params: Sequence[Any] = ()) -> list:
+    return get_connection().execute(sql, params).fetchall()
+
+
+# ============================================================================
+# Writes: one dedicated writer thread
+# ============================================================================
+
+class SQLiteWriter:
+    """
+    Runs write transactions one at a time on a dedicated thread.
+
+    Callers block until their transaction committed (or raised), so writes
+    keep their synchronous semantics.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        self._conn = connect()
+        while True:
+            fn, future = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with self._conn:  # commits, or rolls back on exception
+                    result = fn(self._conn)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run `fn(conn)` in a write transaction on the writer thread and return its result."""
+        if threading.current_thread() is self._thread:
+            # Nested write from inside a transaction: already serialized
+            return fn(self._conn)
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((fn, future))
+        return future.result(timeout=SQLITE_WRITE_TIMEOUT_SECONDS)
+
+
+# Global writer instance
+_writer = SQLiteWriter()
+
+
+def run_write(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Run a write transaction (a callable taking the connection) on the writer thread."""
+    return _writer.submit(fn)
+
+
+def execute_write(sql: str, params: Sequence[Any] = ()) -> int:
+    """Execute one write statement; returns the affected row count."""
+    return run_write(lambda conn: conn.execute(sql, params).rowcount)
+
+
+def execute_write_many(sql: str, rows: Sequence[Sequence[Any]]) -> int:
+    """Execute one statement for many parameter rows in a single transaction."""
+    return run_write(lambda conn: conn.executemany(sql, rows).rowcount)
@@ -2,7 +2,8 @@
 -- Supabase Quota System Schema
 -- 
 -- This schema provides atomic quota enforcement for OpenAI API usage.
--- It includes the user_quotas table and the consume_quota RPC function.
+-- It includes the user_quotas table, the consume_quota RPC function and the
+-- reconcile_quota_usage RPC that settles reservations against actual usage.
 -- 
 -- IMPORTANT: Run this in the Supabase SQL Editor to set up the quota system.
 -- ============================================================================
@@ -214,6 +215,61 @@ BEGIN
 END;
 $$;
 
+-- ============================================================================
+-- Usage Reconciliation Function (reconcile_quota_usage)
+-- 
+-- consume_quota charges a flat reservation (QUOTA_RESERVED_TOKENS) before
+-- the LLM runs. Once the actual usage is known, the backend sends one batch
+-- of adjustments (actual - reserved per user) through this function:
+-- positive deltas charge the extra tokens, negative deltas refund unused
+-- reservations. Counters never go below zero.
+-- 
+-- p_adjustments: [{"user_id": "<uuid>", "tokens_delta": <int>}, ...]
+-- Returns the number of users adjusted.
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION public.reconcile_quota_usage(
+    p_adjustments JSONB
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_today DATE := CURRENT_DATE;
+    v_this_month DATE := DATE_TRUNC('month', CURRENT_DATE)::DATE;
+    v_adjusted INTEGER := 0;
+    v_rows INTEGER;
+    v_adj RECORD;
+BEGIN
+    FOR v_adj IN
+        SELECT a.user_id, SUM(a.tokens_delta)::INTEGER AS tokens_delta
+        FROM jsonb_to_recordset(p_adjustments) AS a(user_id UUID, tokens_delta INTEGER)
+        WHERE a.user_id IS NOT NULL AND a.tokens_delta IS NOT NULL
+        GROUP BY a.user_id
+    LOOP
+        -- Counters from a previous day/month were already reset (or will be):
+        -- only the current period is adjusted
+        UPDATE public.user_quotas
+        SET
+            daily_tokens = CASE
+                WHEN last_reset_day = v_today THEN GREATEST(0, daily_tokens + v_adj.tokens_delta)
+                ELSE daily_tokens
+            END,
+            monthly_tokens = CASE
+                WHEN last_reset_month = v_this_month THEN GREATEST(0, monthly_tokens + v_adj.tokens_delta)
+                ELSE monthly_tokens
+            END
+        WHERE user_id = v_adj.user_id;
+        
+        GET DIAGNOSTICS v_rows = ROW_COUNT;
+        v_adjusted := v_adjusted + v_rows;
+    END LOOP;
+    
+    RETURN v_adjusted;
+END;
+$$;
+
 -- ============================================================================
 -- Grant Permissions
 -- 
@@ -225,6 +281,7 @@ $$;
 -- Grant execute to authenticated role (if using RLS)
 -- GRANT EXECUTE ON FUNCTION public.consume_quota TO authenticated;
 -- GRANT EXECUTE ON FUNCTION public.get_quota_status TO authenticated;
+-- (reconcile_quota_usage is backend-only: do not grant it to authenticated)
 
 -- For service role access (recommended for backend):
 -- No additional grants needed - service role has full access
@@ -236,6 +293,9 @@ $$;
 -- Test the consume_quota function:
 -- SELECT public.consume_quota('00000000-0000-0000-0000-000000000001'::uuid);
 
+-- Refund 500 reserved tokens:
+-- SELECT public.reconcile_quota_usage('[{"user_id": "00000000-0000-0000-0000-000000000001", "tokens_delta": -500}]'::jsonb);
+
 -- Check quota status:
 -- SELECT public.get_quota_status('00000000-0000-0000-0000-000000000001'::uuid);
 
@@ -1,12 +1,17 @@
 import os
 import json
 import re
-from typing import List, Dict
-import httpx
-from openai import OpenAI
+import time
+import contextvars
+from threading import Lock
+from typing import Any, Callable, List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from openai import RateLimitError, OpenAIError, APIError, APITimeoutError, AuthenticationError
 from fastapi import HTTPException
 import logging
+from services import llm_gateway, token_budget
+from services.json_stream import JsonArrayStream, salvage_array
+from services.job_queue import JobLeaseLost
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -14,7 +19,23 @@ logger = logging.getLogger(__name__)
 
 # SECURITY: OpenAI timeout configuration
 OPENAI_TIMEOUT_SECONDS = int(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
-MAX_INPUT_CHARS = int(os.getenv("MAX_INPUT_CHARS", "8000"))
+# SECURITY: Token budget for the whole flashcard prompt (instructions + source text), prevents cost attacks
+FLASHCARD_PROMPT_TOKENS = int(os.getenv("FLASHCARD_PROMPT_TOKENS", "4000"))
+FLASHCARD_COMPLETION_TOKENS = 2000
+# Context window of the flashcard model (gpt-4o-mini); caps long-source section prompts
+FLASHCARD_MODEL_CONTEXT_TOKENS = int(os.getenv("FLASHCARD_MODEL_CONTEXT_TOKENS", "128000"))
+
+# on_card(card, card_number) callback for cards as they become available
+CardCallback = Callable[[Dict[str, str], int], None]
+
+# Long-source mode: map over sections that together hold the whole text, then reduce to one deck
+FLASHCARD_LONG_SOURCE_MODE = os.getenv("FLASHCARD_LONG_SOURCE_MODE", "true").lower() == "true"
+FLASHCARD_MAX_SECTIONS = int(os.getenv("FLASHCARD_MAX_SECTIONS", "8"))  # SECURITY: bounds calls per source
+FLASHCARD_MAP_CONCURRENCY = int(os.getenv("FLASHCARD_MAP_CONCURRENCY", "4"))
+FLASHCARD_DECK_SIZE = int(os.getenv("FLASHCARD_DECK_SIZE", "10"))
+FLASHCARD_DEDUPE_THRESHOLD = float(os.getenv("FLASHCARD_DEDUPE_THRESHOLD", "0.6"))  # question token Jaccard
+
+FLASHCARD_SYSTEM_PROMPT = "You are a helpful assistant that creates educational flashcards from text content. You MUST respond with ONLY a valid JSON object of the form {\"flashcards\": [{\"question\": \"...\", \"answer\": \"...\"}]}. Do NOT use markdown code fences (```), do NOT add explanations, do NOT add any text before or after the JSON. Your response must start with { and end with }."
 
 def clean_json_response(response_text: str) -> str:
     """
@@ -69,18 +90,42 @@ def clean_json_response(response_text: str) -> str:
     # Final strip
     return text.strip()
 
-def generate_flashcards(text_content: str) -> List[Dict[str, str]]:
+def generate_flashcards(
+    text_content: str,
+    use_cache: bool = True,
+    on_card: Optional[CardCallback] = None,
+    coverage: Optional[Dict[str, Any]] = None,
+    on_draft: Optional[CardCallback] = None,
+) -> List[Dict[str, str]]:
     """
     Generate flashcards from PDF text content using OpenAI API
+
+    Text that does not fit in one prompt (FLASHCARD_PROMPT_TOKENS) is
+    handled in long-source mode: it is split into at most
+    FLASHCARD_MAX_SECTIONS sections, sized from the text's length (at least
+    one standard prompt, at most the model context), each section gets its
+    own deck concurrently, and the section decks are reduced to the best
+    FLASHCARD_DECK_SIZE cards. Only text too long for FLASHCARD_MAX_SECTIONS
+    full-context prompts has sections skipped; they are logged and reported
+    in `coverage`.
     
     Args:
         text_content: Extracted text from PDF
+        use_cache: Reuse a cached completion for identical input (False forces a fresh call)
+        on_card: Called as `on_card(card, card_number)` for each card; single-prompt
+            sources stream the completion, so this fires as soon as each card is parsed
+        coverage: Optional dict filled with how much of the text was used
+            (sections, sections_used, skipped_sections, chars_used, chars_total)
+        on_draft: Long-source mode only: called as `on_draft(card, draft_number)` for
+            each section card as it streams in, before the reduce step picks the final
+            cards (which then go to `on_card`)
         
     Returns:
         List of flashcards with question and answer fields
         
     Raises:
         Exception: If OpenAI API call fails or invalid response
+        JobLeaseLost: Raised by a callback (the job was reclaimed); passed through as is
     """
     
     # Check API key first
@@ -92,40 +137,41 @@ def generate_flashcards(text_content: str) -> List[Dict[str, str]]:
             detail="AI service configuration error, please contact support"
         )
     
-    logger.info(f"Initializing OpenAI client with API key length: {len(api_key)}")
-    
     try:
-        # Initialize OpenAI client with custom HTTP client to avoid proxies issue
-        # SECURITY: Add timeout to prevent hanging requests
-        http_client = httpx.Client(timeout=OPENAI_TIMEOUT_SECONDS)
-        
-        client = OpenAI(api_key=api_key, http_client=http_client)
-        logger.info("✅ OpenAI client initialized successfully")
+        # Shared process-wide client (keep-alive pool, timeouts) from the LLM gateway
+        client = llm_gateway.get_client()
     except Exception as e:
         logger.error(f"❌ OpenAI client initialization failed: {str(e)}")
-        logger.error(f"Exception type: {type(e)}")
-        import traceback
-        traceback.print_exc()
         raise HTTPException(
             status_code=500, 
             detail="Failed to initialize AI service, please try again later"
         )
     
-    # SECURITY: Truncate text if too long (OpenAI has token limits, prevents cost attacks)
-    if len(text_content) > MAX_INPUT_CHARS:
-        logger.warning(f"Truncating input from {len(text_content)} to {MAX_INPUT_CHARS} chars")
-        text_content = text_content[:MAX_INPUT_CHARS] + "..."
-    
-    prompt = f"""You are an expert instructional designer and subject-matter tutor. Create EXACTLY 10 high-impact flashcards from the PDF content below.
+    # Long sources are split into sections and reduced instead of truncated
+    if FLASHCARD_LONG_SOURCE_MODE and token_budget.count_tokens(text_content) > input_token_budget():
+        return _generate_long_source(text_content, use_cache, on_card, coverage, on_draft)
+
+    if coverage is not None:
+        # Single prompt: whatever does not fit the budget is truncated
+        fitted, _ = token_budget.fit_text(
+            text_content, FLASHCARD_PROMPT_TOKENS, fixed=[FLASHCARD_SYSTEM_PROMPT, _flashcard_prompt("")]
+        )
+        coverage.update(sections=1, sections_used=1, skipped_sections=[],
+                        chars_used=len(fitted), chars_total=len(text_content))
+    return _generate_single(text_content, use_cache, on_card)
+
+
+def _flashcard_prompt(text_content: str) -> str:
+    return f"""You are an expert instructional designer and subject-matter tutor. Create EXACTLY 10 high-impact flashcards from the PDF content below.
 
 OUTPUT FORMAT (STRICT):
-- Output ONLY a valid JSON array (no markdown fences, no extra text, no preamble).
+- Output ONLY a valid JSON object with a single key "flashcards" whose value is the array of cards (no markdown fences, no extra text, no preamble).
 - The array must contain exactly 10 objects.
 - Each object must have exactly two keys:
   - "question": string
   - "answer": string
 - No additional keys. No nested objects. No trailing commentary.
-- Your entire response begins with [ and ends with ].
+- Your entire response begins with {{ and ends with }}.
 
 CONTENT GROUNDING (NO INVENTION):
 - Use ONLY information that is explicitly or implicitly supported by the provided PDF content.
@@ -200,83 +246,156 @@ Before outputting your JSON, verify the following:
 7. Coherence: terminology is consistent across cards; concepts build on each other where appropriate.
 8. Conciseness: every answer is under 50 words and directly answers the question.
 9. JSON validity: your response is valid JSON that parses cleanly.
-10. Format: your output begins with [ and ends with ]; no extra text before or after.
+10. Format: your output begins with {{ and ends with }}; no extra text before or after.
 
 PDF CONTENT:
 {text_content}
 
-Return only the JSON array now:"""
+Return only the JSON object now:"""
+
+
+def _prompt_overhead_tokens() -> int:
+    """Tokens of a flashcard prompt without its source text."""
+    return token_budget.count_message_tokens([
+        {"role": "system", "content": FLASHCARD_SYSTEM_PROMPT},
+        {"role": "user", "content": _flashcard_prompt("")},
+    ])
+
+
+def input_token_budget() -> int:
+    """Tokens of source text that fit in one flashcard prompt next to the instructions."""
+    return max(0, FLASHCARD_PROMPT_TOKENS - _prompt_overhead_tokens())
+
+
+def context_token_budget() -> int:
+    """Tokens of source text the model context holds next to the instructions and the completion."""
+    return max(1, FLASHCARD_MODEL_CONTEXT_TOKENS - FLASHCARD_COMPLETION_TOKENS - _prompt_overhead_tokens())
+
+
+def section_token_budget(text_tokens: int) -> int:
+    """
+    Tokens of source text per long-source section.
+
+    Just enough for the whole text to fit in FLASHCARD_MAX_SECTIONS sections,
+    never less than one standard prompt and never more than the model context.
+    """
+    per_section = -(-text_tokens // max(1, FLASHCARD_MAX_SECTIONS))
+    return max(1, min(max(input_token_budget(), per_section), context_token_budget()))
+
+
+def _generate_single(
+    text_content: str,
+    use_cache: bool = True,
+    on_card: Optional[CardCallback] = None,
+    prompt_tokens: int = FLASHCARD_PROMPT_TOKENS,
+) -> List[Dict[str, str]]:
+    """One prompt filled up to `prompt_tokens`; OpenAI errors are mapped to HTTPException."""
+    # SECURITY: Truncate text that does not fit the token budget (OpenAI has token limits, prevents cost attacks)
+    max_prompt_tokens = prompt_tokens
+    original_length = len(text_content)
+    text_content, prompt_tokens = token_budget.fit_text(
+        text_content, max_prompt_tokens, fixed=[FLASHCARD_SYSTEM_PROMPT, _flashcard_prompt("")]
+    )
+    if len(text_content) < original_length:
+        logger.warning(f"Truncating input from {original_length} to {len(text_content)} chars to fit {max_prompt_tokens} tokens")
+    token_budget.record("flashcards", prompt_tokens, truncated=len(text_content) < original_length)
+
+    request = dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": FLASHCARD_SYSTEM_PROMPT},
+            {"role": "user", "content": _flashcard_prompt(text_content)}
+        ],
+        temperature=0.7,
+        max_tokens=FLASHCARD_COMPLETION_TOKENS,
+        response_format={"type": "json_object"},
+        timeout=OPENAI_TIMEOUT_SECONDS,  # SECURITY: Prevent hanging requests
+    )
 
     try:
-        logger.info("Making OpenAI API call...")
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a helpful assistant that creates educational flashcards from text content. You MUST respond with ONLY a valid JSON array. Do NOT use markdown code fences (```), do NOT add explanations, do NOT add any text before or after the JSON. Your response must start with [ and end with ]."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=2000,
-            timeout=OPENAI_TIMEOUT_SECONDS,  # SECURITY: Prevent hanging requests
-        )
-        logger.info("✅ OpenAI API call successful")
-        
-        response_text = response.choices[0].message.content.strip()
+        if on_card is not None:
+            logger.info("Making streaming OpenAI API call...")
+            response_text, streamed_cards, complete = _stream_cards(request, use_cache, on_card)
+            if streamed_cards:
+                logger.info(f"✅ Streamed {len(streamed_cards)} flashcards")
+                if not complete and len(streamed_cards) < 10:
+                    # Cut off mid-array: only ask for the cards that never arrived
+                    for card in _generate_remaining(
+                        text_content, streamed_cards, 10 - len(streamed_cards), use_cache, max_prompt_tokens
+                    ):
+                        streamed_cards.append(card)
+                        on_card(card, len(streamed_cards))
+                return streamed_cards
+            # Nothing parsed incrementally: fall back to the full-response parser below
+        else:
+            logger.info("Making OpenAI API call...")
+            response = llm_gateway.chat_completion(use_cache=use_cache, **request)
+            logger.info("✅ OpenAI API call successful")
+            response_text = response.choices[0].message.content.strip()
+
         logger.info(f"Raw response length: {len(response_text)} characters")
         logger.debug(f"Raw response preview: {response_text[:500]}...")
         
         # Clean and parse JSON response
+        salvaged = False
         try:
             # First, try direct parsing
-            flashcards = json.loads(response_text)
+            flashcards = _cards_from_json(json.loads(response_text))
             logger.info(f"✅ JSON parsed directly, got {len(flashcards)} flashcards")
-        except json.JSONDecodeError as e:
+        except (json.JSONDecodeError, ValueError) as e:
             logger.warning(f"Direct JSON parse failed: {str(e)}, attempting to clean response...")
             logger.debug(f"Full response text: {response_text}")
             
             try:
                 # Clean the response (remove markdown fences, etc.)
                 cleaned_text = clean_json_response(response_text)
-                flashcards = json.loads(cleaned_text)
+                flashcards = _cards_from_json(json.loads(cleaned_text))
                 logger.info(f"✅ JSON parsed after cleaning, got {len(flashcards)} flashcards")
             except (json.JSONDecodeError, ValueError) as clean_error:
-                # Log the full response for debugging
-                logger.error(f"❌ JSON decode error after cleaning: {str(clean_error)}")
-                logger.error(f"Original response (first 1000 chars): {response_text[:1000]}")
-                logger.error(f"Cleaned response (first 1000 chars): {cleaned_text[:1000] if 'cleaned_text' in locals() else 'N/A'}")
-                
-                # Raise a clear error with the problematic text
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Failed to parse flashcard response from AI. The AI returned invalid JSON. Please try again."
-                )
+                # Truncated (max_tokens hit mid-array) or slightly malformed: keep every complete card
+                flashcards, _ = salvage_array(response_text, key="flashcards")
+                salvaged = True
+                if not flashcards:
+                    # Log the full response for debugging
+                    logger.error(f"❌ JSON decode error after cleaning: {str(clean_error)}")
+                    logger.error(f"Original response (first 1000 chars): {response_text[:1000]}")
+                    logger.error(f"Cleaned response (first 1000 chars): {cleaned_text[:1000] if 'cleaned_text' in locals() else 'N/A'}")
+                    
+                    # Raise a clear error with the problematic text
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"Failed to parse flashcard response from AI. The AI returned invalid JSON. Please try again."
+                    )
+                logger.warning(f"Salvaged {len(flashcards)} complete flashcards from a malformed response")
         
-        # Validate response format
-        if not isinstance(flashcards, list):
-            raise Exception("OpenAI response is not a list")
-        
-        if len(flashcards) != 10:
-            logger.warning(f"Expected 10 flashcards, got {len(flashcards)}")
-        
-        # Validate each flashcard
+        # Validate each flashcard, dropping malformed ones
         validated_flashcards = []
         for i, card in enumerate(flashcards):
-            if not isinstance(card, dict):
-                raise Exception(f"Flashcard {i+1} is not a dictionary")
-            
-            if "question" not in card or "answer" not in card:
-                raise Exception(f"Flashcard {i+1} missing question or answer field")
-            
-            validated_flashcards.append({
-                "question": str(card["question"]).strip(),
-                "answer": str(card["answer"]).strip()
-            })
+            validated = _validate_card(card)
+            if validated is None:
+                logger.warning(f"Flashcard {i+1} is not an object with question and answer fields, skipping")
+                continue
+            validated_flashcards.append(validated)
+        
+        if not validated_flashcards:
+            raise Exception("OpenAI response contained no valid flashcards")
+        
+        if salvaged and len(validated_flashcards) < 10:
+            validated_flashcards += _generate_remaining(
+                text_content, validated_flashcards, 10 - len(validated_flashcards), use_cache, max_prompt_tokens
+            )
         
+        if len(validated_flashcards) != 10:
+            logger.warning(f"Expected 10 flashcards, got {len(validated_flashcards)}")
+        
+        if on_card is not None:
+            for i, card in enumerate(validated_flashcards):
+                on_card(card, i + 1)
         return validated_flashcards
         
+    except JobLeaseLost:
+        # From a callback: the job runs on another worker now, not a generation failure
+        raise
     except RateLimitError as e:
         logger.error(f"OpenAI rate limit exceeded: {str(e)}")
         raise HTTPException(
@@ -321,6 +440,329 @@ Return only the JSON array now:"""
             detail="Failed to generate flashcards, please try again later"
         )
 
+
+# ============================================================================
+# Parsing and salvage
+# ============================================================================
+
+def _cards_from_json(parsed) -> list:
+    """The card list from a parsed response: {"flashcards": [...]} or a bare array."""
+    if isinstance(parsed, dict):
+        parsed = parsed.get("flashcards", next((v for v in parsed.values() if isinstance(v, list)), None))
+    if not isinstance(parsed, list):
+        raise ValueError("OpenAI response is not a list")
+    return parsed
+
+
+def _validate_card(item) -> Optional[Dict[str, str]]:
+    if not isinstance(item, dict) or "question" not in item or "answer" not in item:
+        return None
+    return {"question": str(item["question"]).strip(), "answer": str(item["answer"]).strip()}
+
+
+def _remaining_prompt(text_content: str, existing_questions: str, missing: int) -> str:
+    return f"""Create EXACTLY {missing} more high-impact flashcards from the PDF content below. The deck already contains these questions:
+{existing_questions}
+
+RULES:
+- Do not repeat or overlap with the existing questions; cover other important topics.
+- Test understanding (why/how, compare/contrast, what-if, common mistakes), not recall.
+- Answers are 1–3 sentences, under 50 words, and use ONLY information supported by the content.
+- Output ONLY a valid JSON object: {{"flashcards": [{{"question": "...", "answer": "..."}}]}}
+
+PDF CONTENT:
+{text_content}
+
+Return only the JSON object now:"""
+
+
+def _generate_remaining(
+    text_content: str,
+    existing: List[Dict[str, str]],
+    missing: int,
+    use_cache: bool = True,
+    prompt_tokens: int = FLASHCARD_PROMPT_TOKENS,
+) -> List[Dict[str, str]]:
+    """
+    Ask only for the cards a truncated response is missing.
+
+    Best effort: a deck short of a few cards beats failing the whole
+    generation, so errors are logged and an empty list is returned.
+    """
+    existing_questions = "\n".join(f"- {card['question']}" for card in existing)
+    system_prompt = "You are a helpful assistant that creates educational flashcards from text content. You MUST respond with ONLY a valid JSON object."
+    text_content, prompt_tokens = token_budget.fit_text(
+        text_content,
+        prompt_tokens,
+        fixed=[system_prompt, _remaining_prompt("", existing_questions, missing)],
+    )
+    token_budget.record("flashcards_remaining", prompt_tokens)
+    prompt = _remaining_prompt(text_content, existing_questions, missing)
+
+    logger.info(f"Requesting {missing} missing flashcards after a truncated response")
+    try:
+        response = llm_gateway.chat_completion(
+            use_cache=use_cache,
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=min(2000, 200 * missing + 100),
+            response_format={"type": "json_object"},
+            timeout=OPENAI_TIMEOUT_SECONDS,  # SECURITY: Prevent hanging requests
+        )
+        content = response.choices[0].message.content or ""
+        try:
+            items = _cards_from_json(json.loads(content))
+        except (json.JSONDecodeError, ValueError):
+            items, _ = salvage_array(content, key="flashcards")
+    except Exception as e:
+        logger.warning(f"Could not generate the {missing} missing flashcards: {e}")
+        return []
+
+    cards = [card for card in (_validate_card(item) for item in items) if card]
+    return cards[:missing]
+
+
+# ============================================================================
+# Streaming
+# ============================================================================
+
+def _stream_cards(
+    request: dict, use_cache: bool, on_card: CardCallback
+) -> Tuple[str, List[Dict[str, str]], bool]:
+    """
+    Stream a completion and hand each card to `on_card` as soon as its object closes.
+
+    Returns the full response text, the cards parsed along the way and
+    whether the array was closed (False when the completion was cut off).
+    OpenAI errors propagate to the caller's error mapping.
+    """
+    parser = JsonArrayStream(key="flashcards")
+    parts = []
+    cards: List[Dict[str, str]] = []
+    started = time.monotonic()
+    for delta in llm_gateway.stream_chat_completion(use_cache=use_cache, **request):
+        parts.append(delta)
+        for item in parser.feed(delta):
+            card = _validate_card(item)
+            if card is None:
+                logger.warning(f"Skipping streamed flashcard without question/answer: {str(item)[:200]}")
+                continue
+            cards.append(card)
+            if len(cards) == 1:
+                logger.info(f"First flashcard streamed after {time.monotonic() - started:.2f}s")
+            on_card(card, len(cards))
+
+    if parser.invalid:
+        logger.warning(f"Skipped {parser.invalid} malformed flashcard objects in streamed response")
+    return "".join(parts).strip(), cards, parser.done
+
+
+# ============================================================================
+# Long-source mode (map-reduce)
+# ============================================================================
+
+_QUESTION_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "to", "for", "and", "or", "is", "are", "was", "were",
+    "be", "it", "its", "this", "that", "with", "as", "by", "at", "from", "what", "which", "when",
+}
+_DEEP_QUESTION_PREFIXES = ("why", "how", "compare", "what would happen", "what is a common", "when would")
+
+
+def split_into_sections(text: str, max_tokens: Optional[int] = None) -> List[str]:
+    """Split text into sections of at most `max_tokens` (default: one prompt's worth), preferring paragraph, then sentence, breaks."""
+    max_tokens = input_token_budget() if max_tokens is None else max_tokens
+    sections = []
+    start = 0
+    while start < len(text):
+        # No token is longer than ~8 characters of text, so this window always holds the budget
+        window = token_budget.truncate_to_tokens(text[start:start + max_tokens * 8], max_tokens)
+        end = start + max(1, len(window))
+        if end < len(text):
+            # Don't cut mid-thought: back up to a paragraph or sentence end in the second half
+            floor = start + len(window) // 2
+            for separator in ("\n\n", ". ", "\n", " "):
+                cut = text.rfind(separator, floor, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        section = text[start:end].strip()
+        if section:
+            sections.append(section)
+        start = end
+    return sections
+
+
+def _select_sections(sections: List[str], max_sections: int) -> List[int]:
+    """Indices of at most `max_sections` sections, spread evenly over the document."""
+    if len(sections) <= max_sections:
+        return list(range(len(sections)))
+    step = len(sections) / max_sections
+    return [int(i * step) for i in range(max_sections)]
+
+
+def _question_tokens(question: str) -> set:
+    words = re.findall(r"[a-z0-9]+", question.lower())
+    return {w for w in words if w not in _QUESTION_STOPWORDS}
+
+
+def _card_score(card: Dict[str, str]) -> float:
+    """Heuristic quality score matching the prompt's rubric (deep questions, short answers)."""
+    question = card["question"].strip().lower()
+    answer_words = len(card["answer"].split())
+    score = 0.0
+    if question.startswith(_DEEP_QUESTION_PREFIXES):
+        score += 2.0
+    if answer_words == 0 or answer_words > 50:
+        score -= 2.0
+    elif answer_words >= 8:
+        score += 1.0
+    if len(question.split()) < 5:
+        score -= 1.0
+    return score
+
+
+def reduce_flashcards(
+    section_cards: List[List[Dict[str, str]]],
+    n_cards: int = FLASHCARD_DECK_SIZE,
+    dedupe_threshold: float = FLASHCARD_DEDUPE_THRESHOLD,
+) -> List[Dict[str, str]]:
+    """
+    Merge per-section decks into one deck of `n_cards`.
+
+    Near-duplicate questions (token Jaccard >= dedupe_threshold) are dropped,
+    keeping the better-scored card. Sections then take turns contributing their
+    best remaining card, so the deck covers the whole document, and the result
+    is returned in document order.
+    """
+    ranked = []
+    for section_index, cards in enumerate(section_cards):
+        for position, card in enumerate(cards):
+            ranked.append((_card_score(card), section_index, position, card))
+    ranked.sort(key=lambda item: (-item[0], item[1], item[2]))
+
+    kept = []
+    kept_tokens = []
+    for item in ranked:
+        tokens = _question_tokens(item[3]["question"])
+        duplicate = False
+        for other in kept_tokens:
+            union = tokens | other
+            if union and len(tokens & other) / len(union) >= dedupe_threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(item)
+            kept_tokens.append(tokens)
+
+    # Round-robin over sections, best card first within each section
+    queues: Dict[int, list] = {}
+    for item in kept:
+        queues.setdefault(item[1], []).append(item)
+    selected = []
+    while len(selected) < n_cards and any(queues.values()):
+        for section_index in sorted(queues):
+            if queues[section_index] and len(selected) < n_cards:
+                selected.append(queues[section_index].pop(0))
+
+    selected.sort(key=lambda item: (item[1], item[2]))
+    return [item[3] for item in selected]
+
+
+def _generate_long_source(
+    text_content: str,
+    use_cache: bool = True,
+    on_card: Optional[CardCallback] = None,
+    coverage: Optional[Dict[str, Any]] = None,
+    on_draft: Optional[CardCallback] = None,
+) -> List[Dict[str, str]]:
+    """Map: one deck per section (concurrently, capped). Reduce: dedupe and pick the best cards."""
+    section_tokens = section_token_budget(token_budget.count_tokens(text_content))
+    sections = split_into_sections(text_content, section_tokens)
+    # Cutting at paragraph/sentence ends leaves sections short of the budget: grow
+    # them until the whole text fits (or they are as large as the context allows)
+    while len(sections) > FLASHCARD_MAX_SECTIONS and section_tokens < context_token_budget():
+        section_tokens = min(
+            context_token_budget(), -(-section_tokens * len(sections) // FLASHCARD_MAX_SECTIONS) + 1
+        )
+        sections = split_into_sections(text_content, section_tokens)
+    # Each section's prompt is sized for its section, not the single-prompt budget
+    prompt_tokens = section_tokens + _prompt_overhead_tokens()
+    indices = _select_sections(sections, FLASHCARD_MAX_SECTIONS)
+    selected = [sections[i] for i in indices]
+    skipped = sorted(set(range(len(sections))) - set(indices))
+    chars_used = sum(len(section) for section in selected)
+    if skipped:
+        logger.warning(
+            f"Long source has {len(sections)} full-context sections, FLASHCARD_MAX_SECTIONS={FLASHCARD_MAX_SECTIONS}: "
+            f"using sections {indices}, skipping {skipped} "
+            f"({chars_used}/{sum(len(section) for section in sections)} chars used)"
+        )
+    if coverage is not None:
+        coverage.update(sections=len(sections), sections_used=len(selected), skipped_sections=skipped,
+                        chars_used=chars_used, chars_total=len(text_content))
+    if len(selected) == 1:
+        return _generate_single(selected[0], use_cache, on_card, prompt_tokens)
+
+    logger.info(
+        f"Long-source mode: {len(text_content)} chars in {len(selected)} sections of up to "
+        f"{section_tokens} tokens (concurrency={FLASHCARD_MAP_CONCURRENCY})"
+    )
+    section_cards: List[List[Dict[str, str]]] = [[] for _ in selected]
+    errors: List[HTTPException] = []
+
+    # Section completions are streamed so drafts show up while the map step runs;
+    # numbering is shared across the concurrent sections
+    draft_lock = Lock()
+    drafts = 0
+
+    def draft(card: Dict[str, str], _: int) -> None:
+        nonlocal drafts
+        with draft_lock:
+            drafts += 1
+            on_draft(card, drafts)
+
+    section_callback = draft if on_draft is not None else None
+    with ThreadPoolExecutor(max_workers=max(1, FLASHCARD_MAP_CONCURRENCY)) as executor:
+        # Each section runs in a copy of this context, so its LLM usage is still
+        # attributed to the caller's usage scope
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run, _generate_single, section, use_cache, section_callback, prompt_tokens
+            ): index
+            for index, section in enumerate(selected)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                section_cards[index] = future.result()
+            except HTTPException as e:
+                logger.warning(f"Section {index + 1}/{len(selected)} failed: {e.detail}")
+                errors.append(e)
+            except JobLeaseLost:
+                # Don't start the remaining sections for a job that moved to another worker
+                for pending in futures:
+                    pending.cancel()
+                raise
+
+    # A deck from the sections that worked beats failing the whole source;
+    # auth errors are fatal either way
+    if errors and (len(errors) == len(selected) or any(e.status_code == 401 for e in errors)):
+        raise errors[0]
+
+    flashcards = reduce_flashcards(section_cards)
+    logger.info(
+        f"✅ Reduced {sum(len(cards) for cards in section_cards)} section cards to {len(flashcards)} flashcards"
+    )
+    # The final deck only exists after the reduce step, so cards are reported here
+    if on_card is not None:
+        for i, card in enumerate(flashcards):
+            on_card(card, i + 1)
+    return flashcards
+
 def test_flashcard_generation():
     """Test function to verify flashcard generation works"""
     test_text = """
@@ -0,0 +1,288 @@
+"""
+Job Worker
+
+Runs jobs from the durable queue (services/job_queue.py). PDF flashcards,
+YouTube/transcript flashcards and summaries all go through the same queue.
+
+Run standalone (scale the count independently of the API processes):
+
+    python job_worker.py --concurrency 4
+    python job_worker.py --kinds summary
+
+The API also starts embedded worker threads unless JOB_WORKER_EMBEDDED=false,
+so local development keeps working without a separate process.
+
+With BATCH_LANE_ENABLED, every worker process also runs the batch lane
+runner (services/batch_lane.py) that submits and collects bulk LLM requests.
+"""
+
+import os
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+import uuid
+from typing import Callable, Dict, Any, Optional, List
+
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+from db import schema
+from services import job_queue, usage_meter, batch_lane
+from services.job_queue import JobError, JobDeferred, JobLeaseLost
+from services.progress import publish_stage, STAGE_COMPLETED, STAGE_ERROR, STAGE_RETRYING
+
+load_dotenv()
+
+logger = logging.getLogger("job_worker")
+
+# Configuration
+JOB_WORKER_EMBEDDED = os.getenv("JOB_WORKER_EMBEDDED", "true").lower() == "true"
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", str(job_queue.JOB_LEASE_SECONDS / 3)))
+
+# Summary configuration (same env vars as the API)
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+TOP_K = int(os.getenv("SUMMARY_EVIDENCE_TOPK", "6"))
+THRESH = float(os.getenv("SUMMARY_SUPPORT_THRESHOLD", "0.74"))
+
+
+# ============================================================================
+# Handlers
+# ============================================================================
+
+def handle_pdf_flashcards(job: Dict[str, Any]) -> Dict[str, Any]:
+    from services.pdf_pipeline import run_pdf_flashcards
+    payload = job["payload"]
+    return run_pdf_flashcards(
+        job["source_id"],
+        job["user_id"],
+        force_regenerate=payload.get("force", False),
+        final_attempt=job["attempts"] >= job["max_attempts"],
+        job_id=job["id"],
+    )
+
+
+def _run_youtube_pipeline(build: Callable) -> Dict[str, Any]:
+    """Run a YouTube route pipeline, turning HTTP errors into job errors the route can re-raise."""
+    try:
+        return build().model_dump()
+    except HTTPException as e:
+        raise JobError(
+            str(e.detail),
+            retryable=e.status_code >= 500,
+            result={"status_code": e.status_code, "detail": e.detail},
+        )
+
+
+def handle_youtube_flashcards(job: Dict[str, Any]) -> Dict[str, Any]:
+    from routes.youtube_cards import YouTubeFlashcardsRequest, build_youtube_flashcards
+    request = YouTubeFlashcardsRequest(**job["payload"]["request"])
+    return _run_youtube_pipeline(lambda: build_youtube_flashcards(request, job["user_id"]))
+
+
+def handle_transcript_flashcards(job: Dict[str, Any]) -> Dict[str, Any]:
+    from routes.youtube_cards import ManualTranscriptRequest, build_manual_transcript_flashcards
+    request = ManualTranscriptRequest(**job["payload"]["request"])
+    return _run_youtube_pipeline(lambda: build_manual_transcript_flashcards(request, job["user_id"]))
+
+
+def handle_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    from services import llm_gateway
+    from services.summary_builder import build_summary_inline, build_summary_batched
+    payload = job["payload"]
+
+    if payload.get("lane") == "batch" and batch_lane.BATCH_LANE_ENABLED:
+        # Defers the job until the batch lane has the completion; None if the batch request failed
+        result = build_summary_batched(
+            job["id"],
+            job["source_id"],
+            payload.get("top_k", TOP_K),
+            payload.get("thresh", THRESH),
+            payload.get("model", SUMMARY_MODEL),
+        )
+        if result is not None:
+            return {"summary_id": result.summary_id}
+        logger.warning(f"Batch lane failed for job {job['id']}, building summary interactively")
+
+    async def run():
+        try:
+            return await build_summary_inline(
+                job["source_id"],
+                payload.get("top_k", TOP_K),
+                payload.get("thresh", THRESH),
+                payload.get("model", SUMMARY_MODEL),
+            )
+        finally:
+            # The job's event loop ends here, and its async OpenAI client with it
+            await llm_gateway.aclose()
+
+    result = asyncio.run(run())
+    return {"summary_id": result.summary_id}
+
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]] = {
+    job_queue.KIND_PDF_FLASHCARDS: handle_pdf_flashcards,
+    job_queue.KIND_YOUTUBE_FLASHCARDS: handle_youtube_flashcards,
+    job_queue.KIND_TRANSCRIPT_FLASHCARDS: handle_transcript_flashcards,
+    job_queue.KIND_SUMMARY: handle_summary,
+}
+
+
+# ============================================================================
+# Worker Loop
+# ============================================================================
+
+class JobWorker:
+    """
+    Claims and runs jobs in a loop.
+
+    While a handler runs, a heartbeat thread extends the job's lease. If this
+    process dies the lease expires and another worker picks the job up. If
+    the heartbeat finds the lease lost, the handler's next `ensure_lease()`
+    raises JobLeaseLost and the job is left to its new owner.
+    """
+
+    def __init__(self, kinds: Optional[List[str]] = None, worker_id: Optional[str] = None):
+        self.kinds = kinds or list(HANDLERS)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run_forever(self) -> None:
+        logger.info(f"Worker {self.worker_id} started for kinds={self.kinds}")
+        while not self._stop.is_set():
+            try:
+                ran = self.run_once()
+            except Exception as e:
+                logger.exception(f"Worker {self.worker_id} loop error: {e}")
+                ran = False
+            if not ran:
+                self._stop.wait(JOB_POLL_INTERVAL_SECONDS)
+        logger.info(f"Worker {self.worker_id} stopped")
+
+    def run_once(self) -> bool:
+        """Claim and run a single job. Returns False if the queue was empty."""
+        job = job_queue.claim(self.worker_id, self.kinds)
+        if job is None:
+            return False
+
+        handler = HANDLERS.get(job["kind"])
+        if handler is None:
+            job_queue.fail(job["id"], self.worker_id, f"No handler for job kind {job['kind']}", retryable=False)
+            return True
+
+        logger.info(f"Worker {self.worker_id} running job {job['id']} kind={job['kind']} attempt={job['attempts']}")
+        done = threading.Event()
+        lease_lost = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(job["id"], done, lease_lost), daemon=True)
+        beat.start()
+        started = time.monotonic()
+        # Quota was reserved once at enqueue time: only the first attempt settles it
+        reserved_tokens = job["payload"].get("reserved_tokens", 0) if job["attempts"] <= 1 else 0
+        try:
+            with usage_meter.usage_scope(
+                job["user_id"],
+                deck_id=job["source_id"],
+                feature=job["kind"],
+                job_id=job["id"],
+                reserved_tokens=reserved_tokens,
+            ) as scope, job_queue.lease_scope(lease_lost):
+                try:
+                    result = handler(job)
+                except JobDeferred:
+                    scope.deferred = True
+                    raise
+            if lease_lost.is_set():
+                raise JobLeaseLost(f"Lease on job {job['id']} lost")
+            job_queue.complete(job["id"], self.worker_id, result)
+            publish_stage(job["id"], job["source_id"], STAGE_COMPLETED)
+            logger.info(f"Job {job['id']} succeeded in {time.monotonic() - started:.1f}s")
+        except JobLeaseLost:
+            # The reclaiming worker runs the job; leave it (and its status) alone
+            logger.warning(f"Worker {self.worker_id} abandoned job {job['id']} after losing its lease")
+        except JobDeferred as e:
+            job_queue.defer(job["id"], self.worker_id, e.delay, stage=e.stage)
+            if e.stage:
+                publish_stage(job["id"], job["source_id"], e.stage)
+        except JobError as e:
+            will_retry = job_queue.fail(job["id"], self.worker_id, str(e), retryable=e.retryable, result=e.result)
+            self._publish_failure(job, will_retry, e.result)
+        except Exception as e:
+            logger.exception(f"Job {job['id']} raised: {e}")
+            will_retry = job_queue.fail(job["id"], self.worker_id, str(e), retryable=True)
+            self._publish_failure(job, will_retry)
+        finally:
+            done.set()
+            beat.join(timeout=5)
+        return True
+
+    def _publish_failure(self, job: Dict[str, Any], will_retry: bool, result: Optional[Dict[str, Any]] = None) -> None:
+        stage = STAGE_RETRYING if will_retry else STAGE_ERROR
+        publish_stage(job["id"], job["source_id"], stage, **(result or {}))
+
+    def _heartbeat(self, job_id: str, done: threading.Event, lease_lost: threading.Event) -> None:
+        last_renewed = time.monotonic()
+        while not done.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                if not job_queue.heartbeat(job_id, self.worker_id):
+                    logger.warning(f"Worker {self.worker_id} lost the lease on job {job_id}, stopping its handler")
+                    lease_lost.set()
+                    return
+                last_renewed = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Heartbeat failed for job {job_id}: {e}")
+                if time.monotonic() - last_renewed >= job_queue.JOB_LEASE_SECONDS:
+                    # The lease has run out by now; another worker may already own the job
+                    logger.warning(f"Worker {self.worker_id} could not renew the lease on job {job_id}, stopping its handler")
+                    lease_lost.set()
+                    return
+
+
+def start_embedded_workers(concurrency: int = JOB_WORKER_CONCURRENCY) -> List[JobWorker]:
+    """Start worker threads inside the API process (daemon threads)."""
+    workers = []
+    for _ in range(concurrency):
+        worker = JobWorker()
+        threading.Thread(target=worker.run_forever, name=f"job-worker-{worker.worker_id}", daemon=True).start()
+        workers.append(worker)
+    logger.info(f"Started {concurrency} embedded job worker(s)")
+    batch_lane.start_runner()
+    return workers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run queue workers for flashcard and summary jobs")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY, help="Number of worker threads")
+    parser.add_argument("--kinds", nargs="*", choices=list(HANDLERS), help="Only run these job kinds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    schema.init_db()
+
+    workers = [JobWorker(kinds=args.kinds) for _ in range(args.concurrency)]
+    threads = [threading.Thread(target=w.run_forever, daemon=True) for w in workers]
+    for thread in threads:
+        thread.start()
+    batch_lane.start_runner()
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Shutting down workers (in-flight jobs finish, or are reclaimed after their lease expires)")
+        for worker in workers:
+            worker.stop()
+        for thread in threads:
+            thread.join(timeout=30)
+        batch_lane.stop_runner()
+        # Write out buffered LLM usage and quota adjustments
+        usage_meter.flush()
+
+
+if __name__ == "__main__":
+    main()
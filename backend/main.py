@@ -1,33 +1,34 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from typing import List, Optional, Literal, Tuple
 import os
 import uuid
 import logging
 from pathlib import Path
-import sqlite3
 import json
 from models import PDF, Flashcard, Base, Summary, SummarySentence, SummarySentenceCitation
 from pdf_processor import extract_text_from_pdf
 from flashcard_generator import generate_flashcards
-from worker_tasks import build_summary_task
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 import asyncio
 from dotenv import load_dotenv
 from repo.dual_repo import (
     upsert_pdf, upsert_flashcard, get_pdf_status, get_flashcards, 
-    delete_flashcards, execute_dual_write_sql, create_deck_in_supabase, get_pdf_filename,
-    update_pdf_status
+    delete_flashcards, execute_dual_write_sql, create_deck_in_supabase, delete_deck_in_supabase,
+    get_pdf_filename, update_pdf_status, get_pdf_record
 )
 from middleware.security import RateLimitMiddleware, RequestSizeLimitMiddleware
 from security.auth import get_current_user, get_optional_user, require_auth
 from security.quotas import check_quota, increment_quota, QuotaExceededError
-from security.quota_rpc import enforce_quota, QuotaExceededError as RPCQuotaExceededError, QuotaCheckError
-from security.ownership import assert_deck_owner, assert_source_owner
+from security.quota_rpc import enforce_quota, enforce_quota_rpc, reserved_tokens_for, QuotaExceededError as RPCQuotaExceededError, QuotaCheckError
+from security.ownership import assert_deck_owner, assert_source_owner, assert_job_owner
+from services.upload_storage import save_upload_stream, UploadTooLargeError, EmptyUploadError
+from services import content_index, text_cache, job_queue, progress, llm_cache, token_budget, usage_meter, dedup_index, summary_store, summary_cache
+from db import sqlite_engine, schema
 
 # Load environment variables
 load_dotenv()
@@ -173,12 +174,12 @@ FEATURE_SUMMARY_CITATIONS = os.getenv('FEATURE_SUMMARY_CITATIONS', 'true').lower
 SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
 TOP_K = int(os.getenv("SUMMARY_EVIDENCE_TOPK", "6"))
 THRESH = float(os.getenv("SUMMARY_SUPPORT_THRESHOLD", "0.74"))
-USE_CELERY = os.getenv("USE_CELERY", "false").lower() == "true"
+EMBEDDING_THRESH = float(os.getenv("SUMMARY_EMBEDDING_SUPPORT_THRESHOLD", "0.5"))
 
 # SQLAlchemy database setup
 # Use DATABASE_URL from environment, fallback to SQLite for local development
 engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-Base.metadata.create_all(bind=engine)
+sqlite_engine.configure_sqlalchemy_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
@@ -248,34 +249,33 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 # Database initialization
 def init_db():
     """Initialize database tables. Works with both SQLite and Postgres."""
+    # SQLAlchemy models and the tables owned by services (jobs, content index, caches, ...)
+    schema.init_db()
     # Only initialize SQLite-specific tables if using SQLite
     if DATABASE_URL.startswith("sqlite"):
-        conn = sqlite3.connect("pdf_flashcards.db")
-        cursor = conn.cursor()
-        
-        # Create tables
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS pdfs (
-                id TEXT PRIMARY KEY,
-                filename TEXT NOT NULL,
-                upload_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'uploaded'
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS flashcards (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pdf_id TEXT,
-                question TEXT NOT NULL,
-                answer TEXT NOT NULL,
-                card_number INTEGER,
-                FOREIGN KEY (pdf_id) REFERENCES pdfs(id)
-            )
-        """)
+        def create_tables(conn):
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pdfs (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    upload_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    status TEXT DEFAULT 'uploaded'
+                )
+            """)
+            
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS flashcards (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    pdf_id TEXT,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    card_number INTEGER,
+                    FOREIGN KEY (pdf_id) REFERENCES pdfs(id)
+                )
+            """)
         
-        conn.commit()
-        conn.close()
+        # Runs on the shared SQLite writer (WAL mode, busy_timeout)
+        sqlite_engine.run_write(create_tables)
     # For Postgres, tables are managed via migrations or Supabase schema
 
 # -------- YouTube flashcards save endpoint --------
@@ -339,13 +339,21 @@ async def save_youtube_deck(
         except Exception as deck_error:
             logging.warning(f"Failed to create deck in Supabase: {deck_error}")
 
+        # Drop near-duplicates; the auto-saved deck of the same video holds these very cards
+        dedup = dedup_index.DedupSession(
+            user_id, pdf_id, exclude_decks=[payload.video_id] if payload.video_id else ()
+        )
+        cards = dedup_index.filter_cards(
+            dedup, [{"question": (c.front or "").strip(), "answer": (c.back or "").strip()} for c in payload.cards]
+        )
+
         # Insert cards using dual-write
-        for idx, c in enumerate(payload.cards, start=1):
-            question = c.front.strip() if c.front else ""
-            answer = c.back.strip() if c.back else ""
-            upsert_flashcard(pdf_id, question, answer, idx)
+        for idx, card in enumerate(cards, start=1):
+            upsert_flashcard(pdf_id, card["question"], card["answer"], idx)
+        # Index the cards only once they are saved
+        dedup.commit()
 
-        return {"pdf_id": pdf_id, "count": len(payload.cards)}
+        return {"pdf_id": pdf_id, "count": len(cards)}
     except Exception as e:
         logging.exception(f"Failed to save YouTube deck: {e}")
         raise HTTPException(status_code=500, detail=f"Save failed: {str(e)}")
@@ -353,14 +361,31 @@ async def save_youtube_deck(
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    # Run queue workers inside the API unless they are deployed separately (job_worker.py)
+    from job_worker import JOB_WORKER_EMBEDDED, start_embedded_workers
+    if JOB_WORKER_EMBEDDED:
+        start_embedded_workers()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Release the pooled OpenAI connections held by the LLM gateway
+    from services import llm_gateway
+    llm_gateway.close()
+    await llm_gateway.aclose()
+    # Write out buffered LLM usage and quota adjustments
+    await asyncio.to_thread(usage_meter.flush)
 
 @app.post("/upload-pdf")
 async def upload_pdf(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user_id: str = Depends(get_current_user)
 ):
     """Upload a PDF file and return its ID
     
+    Text extraction and chunking are started in the background as soon as the
+    file lands, so /generate-flashcards can go straight to the LLM call.
+    
     SECURITY: Requires authentication via Authorization header.
     """
     
@@ -372,9 +397,6 @@ async def upload_pdf(
             print(f"Invalid content type: {file.content_type}")
             raise HTTPException(status_code=400, detail=f"Only PDF files are allowed. Received: {file.content_type}")
         
-        # Validate file size (10MB limit)
-        content = await file.read()
-        file_size = len(content)
         # Generate unique ID for the PDF
         pdf_id = str(uuid.uuid4())
         print(f"Generated PDF ID: {pdf_id}")
@@ -382,32 +404,36 @@ async def upload_pdf(
         # Ensure uploads directory exists
         UPLOAD_DIR.mkdir(exist_ok=True)
         
-        # Save file to uploads directory
+        # Stream file to uploads directory (size limit enforced while copying)
         file_path = UPLOAD_DIR / f"{pdf_id}.pdf"
         print(f"Saving file to: {file_path}")
         
-        with open(file_path, "wb") as f:
-            f.write(content)
-
-        if file_size > 10 * 1024 * 1024:
+        try:
+            file_size, content_hash = await save_upload_stream(file, file_path)
+        except UploadTooLargeError:
             raise HTTPException(status_code=400, detail="File size must be less than 10MB")
-        if file_size == 0:
+        except EmptyUploadError:
             raise HTTPException(status_code=400, detail="File is empty")
         
-        print(f"File saved successfully: {file_path.exists()}")
+        print(f"File saved successfully: {file_path.exists()} ({file_size} bytes)")
         
         # Save to database using dual-write
         upsert_pdf(pdf_id, file.filename, "uploaded")
+        content_index.record_pdf_hash(pdf_id, content_hash)
         
         print(f"Database record created for PDF ID: {pdf_id}")
         
+        # Take extraction off the critical path of flashcard generation
+        background_tasks.add_task(prepare_source_text, pdf_id)
+        
         # Store user_id for later use in deck creation
         # User is now authenticated, always include user_id
         response_data = {
             "pdf_id": pdf_id, 
             "filename": file.filename, 
             "status": "uploaded",
-            "user_id": user_id
+            "user_id": user_id,
+            "sha256": content_hash
         }
         
         return response_data
@@ -418,14 +444,26 @@ async def upload_pdf(
         print(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+def prepare_source_text(pdf_id: str) -> None:
+    """Background stage run after upload: extract and chunk the PDF"""
+    from services.summary_builder import prepare_source
+    prepare_source(pdf_id)
+
 @app.post("/generate-flashcards/{pdf_id}")
 async def generate_flashcards_endpoint(
     pdf_id: str, 
-    background_tasks: BackgroundTasks,
+    force: bool = False,
     user_id: str = Depends(enforce_quota)  # SECURITY: Auth + quota in one dependency
 ):
     """Start flashcard generation process
     
+    The work is put on the durable job queue and picked up by a worker
+    (see job_worker.py), so it survives API restarts and is retried on
+    transient OpenAI failures.
+    
+    Pass `?force=true` to bypass the content-hash index and regenerate with the LLM
+    even if an identical PDF was processed before.
+    
     SECURITY: Requires authentication (X-User-Id header)
     SECURITY: Uses Supabase RPC for atomic quota check (runs BEFORE OpenAI)
     """
@@ -437,121 +475,37 @@ async def generate_flashcards_endpoint(
     # Update status to processing using Supabase REST (authoritative)
     update_pdf_status(pdf_id, "processing")
     
-    # Start background task with user_id
-    background_tasks.add_task(process_pdf_and_generate_flashcards, pdf_id, user_id)
+    job_id = job_queue.enqueue(
+        job_queue.KIND_PDF_FLASHCARDS,
+        {"force": force, "reserved_tokens": reserved_tokens_for(user_id)},
+        source_id=pdf_id,
+        user_id=user_id,
+    )
     
-    return {"message": "Flashcard generation started", "pdf_id": pdf_id}
+    return {"message": "Flashcard generation started", "pdf_id": pdf_id, "job_id": job_id}
 
-async def process_pdf_and_generate_flashcards(pdf_id: str, user_id: str):
-    """
-    Background task to process PDF and generate flashcards.
+def build_status_response(pdf_id: str) -> Optional[dict]:
+    """Status payload shared by /status and the progress stream (None if the PDF is unknown)
     
-    NOTE: This function uses dual_repo functions (upsert_pdf, upsert_flashcard, delete_flashcards)
-    which now write to Supabase REST API as the authoritative source. The local SQLite DB
-    is no longer used for flashcards and can be safely ignored for that purpose.
-    
-    Args:
-        pdf_id: The PDF ID
-        user_id: Supabase auth user ID for deck creation and quota tracking
+    The PDF row comes from the repo's in-process cache; the job table is only
+    read while the PDF is processing.
     """
-    try:
-        # Update status to processing using Supabase REST (authoritative)
-        update_pdf_status(pdf_id, "processing")
-        
-        # Extract text from PDF
-        file_path = UPLOAD_DIR / f"{pdf_id}.pdf"
-        if not file_path.exists():
-            raise Exception("PDF file not found")
-        
-        text_content = extract_text_from_pdf(str(file_path))
-        
-        if not text_content.strip():
-            raise Exception("No text could be extracted from PDF")
-        
-        # Generate flashcards using OpenAI
-        # NOTE: Quota was already consumed atomically by enforce_quota dependency
-        flashcards_data = generate_flashcards(text_content)
-        
-        # Log successful generation (quota already tracked via RPC)
-        logging.info(f"Generated {len(flashcards_data)} flashcards for user {user_id}")
-        
-        # Ensure deck exists in Supabase BEFORE inserting flashcards (required for foreign key constraint)
-        deck_created = False
-        try:
-            filename = get_pdf_filename(pdf_id)
-            if filename:
-                import re
-                title = re.sub(r'\.pdf$', '', filename, flags=re.IGNORECASE).strip() or filename
-                
-                logging.info(f"Ensuring deck exists in Supabase: deck_id={pdf_id}, title={title}, user_id={user_id}")
-                success = create_deck_in_supabase(
-                    deck_id=pdf_id,
-                    title=title,
-                    source_type="pdf",
-                    source_label=filename,
-                    user_id=user_id  # may be None, function handles that gracefully
-                )
-                deck_created = bool(success)
-            else:
-                logging.warning(f"Could not find filename for PDF {pdf_id} when creating deck in Supabase")
-        except Exception as deck_error:
-            logging.error(f"Exception while ensuring deck exists in Supabase for PDF {pdf_id}: {deck_error}", exc_info=True)
-        
-        # Save flashcards to database using Supabase
-        # Clear any existing flashcards for this PDF
-        delete_flashcards(pdf_id)
-        
-        # Insert new flashcards (now safe because deck exists)
-        for i, flashcard in enumerate(flashcards_data):
-            upsert_flashcard(pdf_id, flashcard["question"], flashcard["answer"], i + 1)
-        
-        # Update PDF status to completed using Supabase REST (authoritative)
-        update_pdf_status(pdf_id, "completed")
-        logging.info(f"✅ Successfully processed PDF {pdf_id} and generated {len(flashcards_data)} flashcards")
-        print(f"✅ Successfully processed PDF {pdf_id} and generated {len(flashcards_data)} flashcards")
-        
-        # Log final status
-        if deck_created:
-            logging.info(f"✅ PDF {pdf_id} processing complete: flashcards generated, deck exists in Supabase")
-        else:
-            logging.info(f"✅ PDF {pdf_id} processing complete: flashcards generated, but deck may not exist in Supabase")
-        
-    except HTTPException as e:
-        # Handle specific HTTP errors from OpenAI using dual-write
-        # Set status based on error type
-        if e.status_code == 429:  # Quota exceeded
-            update_pdf_status(pdf_id, "quota_exceeded")
-            print(f"⚠️ Quota exceeded for PDF {pdf_id}: {e.detail}")
-        elif e.status_code == 401:  # Authentication error
-            update_pdf_status(pdf_id, "auth_error")
-            print(f"❌ Authentication error for PDF {pdf_id}: {e.detail}")
-        elif e.status_code == 504:  # Timeout
-            update_pdf_status(pdf_id, "timeout")
-            print(f"⏱️ Timeout error for PDF {pdf_id}: {e.detail}")
-        else:  # Other HTTP errors
-            update_pdf_status(pdf_id, "service_error")
-            print(f"🔧 Service error for PDF {pdf_id}: {e.detail}")
-        
-    except Exception as e:
-        # Handle other errors using dual-write
-        update_pdf_status(pdf_id, "error")
-        print(f"❌ Error processing PDF {pdf_id}: {str(e)}")
-
-@app.get("/status/{pdf_id}")
-async def get_status(pdf_id: str):
-    """Get the processing status of a PDF
+    record = get_pdf_record(pdf_id)
     
-    Returns:
-        - pdf_id: The PDF ID
-        - status: Processing status (uploaded, processing, completed, error, etc.)
-        - deck_id: The deck ID (same as pdf_id) when status is 'completed'
-        - error_message: User-friendly error message if status indicates an error
-    """
+    if not record:
+        return None
     
-    status = get_pdf_status(pdf_id)
+    status = record["status"]
     
-    if not status:
-        raise HTTPException(status_code=404, detail="PDF not found")
+    # The job table is authoritative while a generation is queued, running or
+    # retrying, and for jobs whose worker finished or died in another process
+    job = None
+    if status == "processing":
+        job = job_queue.get_latest_job(pdf_id, job_queue.KIND_PDF_FLASHCARDS)
+        if job and job["status"] == job_queue.STATUS_SUCCEEDED:
+            status = "completed"
+        elif job and job["status"] == job_queue.STATUS_FAILED:
+            status = (job.get("result") or {}).get("status", "error")
     
     # Provide user-friendly error messages based on status
     error_messages = {
@@ -559,26 +513,87 @@ async def get_status(pdf_id: str):
         "auth_error": "AI service authentication failed, please contact support",
         "timeout": "AI service timeout, please try again later",
         "service_error": "AI service temporarily unavailable, please try again later",
+        "duplicate_cards": "Every generated flashcard duplicates one in your other decks",
         "error": "Failed to generate flashcards, please try again later"
     }
     
     response = {"pdf_id": pdf_id, "status": status}
     
-    # When completed, include deck_id (which is the same as pdf_id)
+    # When completed, include deck_id (which is the same as pdf_id) and deck title if available
     if status == "completed":
         response["deck_id"] = pdf_id
-        # Also include deck title if available
-        filename = get_pdf_filename(pdf_id)
-        if filename:
-            import re
-            title = re.sub(r'\.pdf$', '', filename, flags=re.IGNORECASE).strip() or filename
-            response["deck_title"] = title
+        if record["title"]:
+            response["deck_title"] = record["title"]
     
     if status in error_messages:
         response["error_message"] = error_messages[status]
     
+    if job:
+        response["job"] = job_queue.job_summary(job)
+    
+    return response
+
+@app.get("/status/{pdf_id}")
+async def get_status(pdf_id: str):
+    """Get the processing status of a PDF
+    
+    Prefer `/status/{pdf_id}/stream` over polling this endpoint.
+    
+    Returns:
+        - pdf_id: The PDF ID
+        - status: Processing status (uploaded, processing, completed, error, etc.)
+        - deck_id: The deck ID (same as pdf_id) when status is 'completed'
+        - error_message: User-friendly error message if status indicates an error
+        - job: The latest flashcard generation job (status, stage, attempts) while processing
+    """
+    response = build_status_response(pdf_id)
+    if response is None:
+        raise HTTPException(status_code=404, detail="PDF not found")
     return response
 
+@app.get("/status/{pdf_id}/stream")
+async def stream_status(pdf_id: str):
+    """Server-sent events with the flashcard generation stages of a PDF
+    
+    Emits `event: stage` messages whose data is JSON with a `stage` of
+    queued, retrying, running, extracting, generating, persisting, completed
+    or error. The final completed/error event also carries the /status
+    payload (deck_id, deck_title, error_message). The stream closes after it.
+    
+    While generating, `event: card` messages carry each flashcard
+    (card_number, question, answer, draft) as soon as it is generated. Long
+    PDFs first send draft cards from each section (draft=true), then the
+    final deck; the deck is saved when the completed event is sent.
+    """
+    snapshot = await asyncio.to_thread(build_status_response, pdf_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="PDF not found")
+    
+    def sse(event: dict) -> str:
+        kind = "card" if "card" in event else "stage"
+        return f"event: {kind}\ndata: {json.dumps(event)}\n\n"
+    
+    async def events():
+        sent = False
+        async for event in progress.stream_stages(pdf_id, job_queue.KIND_PDF_FLASHCARDS):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            if event["stage"] in progress.TERMINAL_STAGES:
+                final = await asyncio.to_thread(build_status_response, pdf_id)
+                event = {**event, **(final or {})}
+            sent = True
+            yield sse(event)
+        if not sent:
+            # Nothing was ever queued for this PDF: report its current status once
+            yield sse({"stage": snapshot["status"], **snapshot})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/flashcards/{pdf_id}")
 async def get_flashcards_endpoint(pdf_id: str):
     """
@@ -624,10 +639,27 @@ def source_exists(source_id: str) -> bool:
     status = get_pdf_status(source_id)
     return status is not None
 
-def enqueue_build_summary(source_id: str, top_k: int, thresh: float, model: str) -> str:
-    """Enqueue summary build task to Celery"""
-    task = build_summary_task.delay(source_id)
-    return task.id
+def summary_dedupe_key(source_id: str) -> str:
+    """Single-flight key: one summary build per source in flight at a time, whatever its lane"""
+    return f"{job_queue.KIND_SUMMARY}:{source_id}"
+
+def enqueue_build_summary(source_id: str, top_k: int, thresh: float, model: str, user_id: Optional[str] = None,
+                          lane: str = "interactive") -> Tuple[str, bool]:
+    """Enqueue summary build on the shared job queue (lane="batch" defers the LLM call to the batch lane)
+    
+    Returns (job_id, created); created is False if an active build for the same
+    source (in either lane) was found and its job returned instead.
+    """
+    payload = {"top_k": top_k, "thresh": thresh, "model": model, "lane": lane}
+    if user_id:
+        payload["reserved_tokens"] = reserved_tokens_for(user_id)
+    return job_queue.enqueue_or_attach(
+        job_queue.KIND_SUMMARY,
+        payload,
+        summary_dedupe_key(source_id),
+        source_id=source_id,
+        user_id=user_id,
+    )
 
 async def build_summary_inline(source_id: str, top_k: int, thresh: float, model: str):
     """Run summary build inline for development"""
@@ -646,86 +678,91 @@ def slice_preview(text: str, start_char: int, end_char: int) -> str:
 
 # Summary endpoints (feature-flagged)
 @app.get("/summaries/{source_id}")
-async def get_summary(source_id: str, db: Session = Depends(get_db)):
-    """Get summary with citations for a source - never returns 500"""
+def get_summary(source_id: str, request: Request, db: Session = Depends(get_db)):
+    """Get summary with citations for a source - never returns 500
+    
+    Sync (runs in the threadpool, not on the event loop). The serialized response
+    is cached per source with an ETag until the summary is rebuilt (by any
+    process), so a repeat view is one summary id lookup; a matching
+    If-None-Match gets 304 Not Modified.
+    """
     if not FEATURE_SUMMARY_CITATIONS:
         raise HTTPException(status_code=404, detail="Feature not enabled")
     
+    cached = None
     try:
-        # Check if source exists
-        if not source_exists(source_id):
-            summary_logger.warning(f"[get] Source not found: {source_id}")
-            return {"summary_id": None, "source_id": source_id, "sentences": []}
-        
-        # Get summary from SQLAlchemy
-        summary = db.query(Summary).filter(Summary.source_id == source_id).first()
-        
-        if not summary:
-            summary_logger.info(f"[get] No summary found for source: {source_id}")
-            return {"summary_id": None, "source_id": source_id, "sentences": []}
-        
-        # Get sentences with citations
-        sentences = db.query(SummarySentence).filter(
-            SummarySentence.summary_id == summary.id
-        ).order_by(SummarySentence.order_index).all()
-        
-        sentence_data = []
-        for sentence in sentences:
-            citations = db.query(SummarySentenceCitation).filter(
-                SummarySentenceCitation.sentence_id == sentence.id
-            ).all()
+        # The current summary id is the cache version
+        summary_id = summary_store.current_summary_id(db, source_id)
+        if summary_id is not None:
+            cached = summary_cache.cached_response(source_id, summary_id)
+    except Exception as e:
+        summary_logger.warning(f"[get] summary version check failed source={source_id}: {e}")
+    if cached is None:
+        try:
+            generation = summary_cache.cache_generation()
             
-            citation_data = []
-            for c in citations:
-                # Use stored preview_text if available, otherwise generate it
-                preview_text = c.preview_text
-                if not preview_text:
-                    if c.start_char is not None and c.end_char is not None:
-                        chunk_text = get_chunk_text(c.chunk_id)
-                        preview_text = slice_preview(chunk_text, c.start_char, c.end_char)
-                    else:
-                        chunk_text = get_chunk_text(c.chunk_id)
-                        preview_text = chunk_text[:200] + "..." if len(chunk_text) > 200 else chunk_text
-                
-                citation_data.append({
-                    "chunk_id": c.chunk_id,
-                    "start_char": c.start_char,
-                    "end_char": c.end_char,
-                    "score": c.score,
-                    "preview_text": preview_text
-                })
+            # Check if source exists
+            if not source_exists(source_id):
+                summary_logger.warning(f"[get] Source not found: {source_id}")
+                return {"summary_id": None, "source_id": source_id, "sentences": []}
             
-            sentence_data.append({
-                "id": sentence.id,
-                "order_index": sentence.order_index,
-                "sentence_text": sentence.sentence_text,
-                "support_status": sentence.support_status,
-                "citations": citation_data
-            })
-        
-        summary_logger.info(f"[get] Retrieved summary for source: {source_id}, sentences: {len(sentence_data)}")
-        return {
-            "summary_id": summary.id,
-            "source_id": summary.source_id,
-            "sentences": sentence_data
-        }
-        
-    except Exception as e:
-        summary_logger.exception(f"[get] failed source={source_id}: {e}")
-        return {"summary_id": None, "source_id": source_id, "sentences": [], "error": "fetch_failed"}
+            # Summary, sentences and citations in one joined query
+            summary = summary_store.load_summary(db, source_id)
+            if not summary:
+                summary_logger.info(f"[get] No summary found for source: {source_id}")
+                return {"summary_id": None, "source_id": source_id, "sentences": []}
+            
+            # Older rows have no stored preview_text: slice it from the chunk,
+            # loading the source's chunks at most once
+            chunk_texts = None
+            for sentence in summary["sentences"]:
+                for c in sentence["citations"]:
+                    if c["preview_text"]:
+                        continue
+                    if chunk_texts is None:
+                        from services.summary_builder import get_chunks_for_source
+                        chunk_texts = {chunk["id"]: chunk["text"] for chunk in get_chunks_for_source(source_id)}
+                    chunk_text = chunk_texts.get(c["chunk_id"], "")
+                    c["preview_text"] = slice_preview(chunk_text, c["start_char"], c["end_char"])
+            
+            summary_logger.info(f"[get] Retrieved summary for source: {source_id}, sentences: {len(summary['sentences'])}")
+            cached = summary_cache.cache_response(
+                source_id, summary["summary_id"], json.dumps(summary, default=str).encode("utf-8"), generation
+            )
+        except Exception as e:
+            summary_logger.exception(f"[get] failed source={source_id}: {e}")
+            return {"summary_id": None, "source_id": source_id, "sentences": [], "error": "fetch_failed"}
+    
+    etag, body = cached
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 @app.post("/summaries/{source_id}/refresh")
 async def refresh_summary(
     source_id: str,
-    user_id: str = Depends(enforce_quota)  # SECURITY: Auth + quota in one dependency
+    lane: str = "interactive",
+    user_id: str = Depends(require_auth)
 ):
-    """Enqueue or run summary build for a source
+    """Enqueue summary build for a source, or attach to the one already in flight
+    
+    Always 202 with a job id; poll GET /jobs/{job_id} for the result. Concurrent
+    refreshes of the same source (double-click, two tabs) share one build: later
+    callers get the active job's id ("attached": true) and are not charged quota.
+    
+    Pass `?lane=batch` for non-urgent refreshes (backfills, regenerations): the LLM
+    call goes through the batch lane, cheaper but minutes to hours later. Builds
+    are shared across lanes, so "lane" in the response is the lane of the build
+    the caller got.
     
     SECURITY: Requires authentication
-    SECURITY: Uses Supabase RPC for atomic quota check (runs BEFORE OpenAI)
+    SECURITY: Uses Supabase RPC for atomic quota check (runs BEFORE OpenAI), only
+    when a new build is queued
     """
     if not FEATURE_SUMMARY_CITATIONS:
         raise HTTPException(status_code=404, detail="Feature not enabled")
+    if lane not in ("interactive", "batch"):
+        raise HTTPException(status_code=400, detail="lane must be 'interactive' or 'batch'")
     
     try:
         # Verify source exists
@@ -733,24 +770,84 @@ async def refresh_summary(
             summary_logger.warning(f"[refresh] Source not found: {source_id}")
             raise HTTPException(status_code=404, detail="Source not found")
         
-        # Enqueue to Celery/RQ if available, else run inline in DEV
-        # NOTE: Quota was already consumed atomically by enforce_quota dependency
-        if USE_CELERY:
-            task_id = enqueue_build_summary(source_id, TOP_K, THRESH, SUMMARY_MODEL)
-            summary_logger.info(f"[refresh] enqueued source={source_id} task={task_id}")
-            return JSONResponse({"status": "queued", "task_id": task_id}, status_code=202)
+        # A build is already queued or running: attach to it, no second build or charge
+        active = await asyncio.to_thread(job_queue.find_active, summary_dedupe_key(source_id))
+        if active:
+            active_lane = active["payload"].get("lane", "interactive")
+            summary_logger.info(f"[refresh] attached source={source_id} job={active['id']} lane={active_lane}")
+            return JSONResponse({"status": "queued", "task_id": active["id"], "job_id": active["id"],
+                                 "lane": active_lane, "attached": True}, status_code=202)
+        
+        # Atomic check + consume; quota errors are mapped by the exception handlers
+        await enforce_quota_rpc(user_id)
+        
+        # Enqueue on the shared job queue (workers run in-process or via job_worker.py)
+        job_id, created = await asyncio.to_thread(
+            enqueue_build_summary, source_id, TOP_K, THRESH, SUMMARY_MODEL, user_id, lane
+        )
+        if created:
+            summary_logger.info(f"[refresh] enqueued source={source_id} job={job_id} lane={lane}")
         else:
-            summary_logger.info(f"[refresh] running inline source={source_id}")
-            result = await build_summary_inline(source_id, TOP_K, THRESH, SUMMARY_MODEL)
-            return {"status": "ok", "summary_id": result.summary_id}
+            # Lost a race with a concurrent refresh after the quota was consumed:
+            # this request runs nothing, so give its token reservation back
+            usage_meter.release_reservation(user_id, reserved_tokens_for(user_id))
+            summary_logger.info(f"[refresh] attached after quota consumed, reservation released "
+                                f"source={source_id} job={job_id} user={user_id}")
+            job = await asyncio.to_thread(job_queue.get_job, job_id)
+            if job:
+                lane = job["payload"].get("lane", lane)
+        return JSONResponse({"status": "queued", "task_id": job_id, "job_id": job_id,
+                             "lane": lane, "attached": not created}, status_code=202)
             
-    except HTTPException:
+    except (HTTPException, RPCQuotaExceededError, QuotaCheckError):
         raise
     except Exception as e:
         summary_logger.exception(f"[refresh] failed source={source_id}: {e}")
         # Return structured error for UI
         return JSONResponse({"status": "error", "error": "refresh_failed", "detail": str(e)}, status_code=500)
 
+@app.delete("/decks/{deck_id}")
+async def delete_deck(
+    deck_id: str,
+    user_id: str = Depends(require_auth)  # SECURITY: Require auth
+):
+    """Delete a deck and its flashcards
+    
+    Its cards are also dropped from the deduplication index, so they no
+    longer suppress cards generated for the user's other decks.
+    
+    SECURITY: Only the deck owner can delete it
+    """
+    await assert_deck_owner(deck_id, user_id)
+    if not await asyncio.to_thread(delete_deck_in_supabase, deck_id):
+        raise HTTPException(status_code=502, detail="Failed to delete deck, please try again later")
+    try:
+        await asyncio.to_thread(dedup_index.remove_deck, user_id, deck_id)
+    except Exception as e:
+        logger.warning(f"Failed to remove deck {deck_id} from the dedup index: {e}")
+    return {"deck_id": deck_id, "deleted": True}
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    user_id: str = Depends(require_auth)  # SECURITY: Require auth
+):
+    """Status (and result, once finished) of a queued job
+    
+    SECURITY: Only the user who enqueued the job (or owns its source) can read it
+    """
+    job = await asyncio.to_thread(job_queue.get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await assert_job_owner(job, user_id)
+    response = job_queue.job_summary(job)
+    response["source_id"] = job["source_id"]
+    if job["status"] == job_queue.STATUS_SUCCEEDED:
+        response["result"] = job["result"]
+    elif job["status"] == job_queue.STATUS_FAILED:
+        response["error"] = job["last_error"]
+    return response
+
 @app.options("/summaries/{source_id}/refresh")
 async def refresh_summary_options(source_id: str):
     """Handle CORS preflight for refresh endpoint"""
@@ -762,10 +859,7 @@ def health():
     try:
         # Check database connectivity
         if DATABASE_URL.startswith("sqlite"):
-            conn = sqlite3.connect("pdf_flashcards.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
-            conn.close()
+            sqlite_engine.fetch_one("SELECT 1")
             db_type = "sqlite"
         else:
             # For Postgres, use SQLAlchemy engine
@@ -784,10 +878,7 @@ def healthz():
     try:
         # Check database connectivity
         if DATABASE_URL.startswith("sqlite"):
-            conn = sqlite3.connect("pdf_flashcards.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
-            conn.close()
+            sqlite_engine.fetch_one("SELECT 1")
             db_type = "sqlite"
         else:
             # For Postgres, use SQLAlchemy engine
@@ -802,7 +893,7 @@ def healthz():
 
 @app.get("/readyz")
 def readyz():
-    """Readiness check - Celery heartbeat + Redis ping + Supabase ping if enabled"""
+    """Readiness check - database + job queue + Supabase ping if enabled"""
     from db.supabase_engine import SUPABASE_ENABLED, SessionSupabase
     
     status = {"ok": True}
@@ -810,10 +901,7 @@ def readyz():
     # Check primary database
     try:
         if DATABASE_URL.startswith("sqlite"):
-            conn = sqlite3.connect("pdf_flashcards.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
-            conn.close()
+            sqlite_engine.fetch_one("SELECT 1")
             status["database"] = "healthy"
         else:
             from sqlalchemy import text
@@ -837,33 +925,46 @@ def readyz():
     else:
         status["supabase"] = "disabled"
     
-    # Check Redis if using Celery
-    if USE_CELERY:
-        try:
-            import redis
-            redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-            r = redis.from_url(redis_url)
-            r.ping()
-            status["redis"] = "healthy"
-        except Exception as e:
-            status["ok"] = False
-            status["redis"] = f"error: {str(e)}"
-    else:
-        status["redis"] = "disabled"
+    # Check the job queue all background work goes through
+    try:
+        job_queue.find_active("readyz")
+        status["job_queue"] = "healthy"
+    except Exception as e:
+        status["ok"] = False
+        status["job_queue"] = f"error: {str(e)}"
     
     return status
 
+@app.get("/health/cache")
+def cache_health():
+    """Hit/miss counters for the backend's result caches (per process)"""
+    return {
+        "content_index": content_index.get_stats(),
+        "text_cache": text_cache.get_stats(),
+        "llm_cache": llm_cache.get_stats(),
+    }
+
+@app.get("/health/tokens")
+def tokens_health():
+    """Prompt tokens sent per LLM call site and actual LLM usage (per process)"""
+    return {
+        "prompt_budget": token_budget.get_stats(),
+        "usage": usage_meter.get_stats(),
+    }
+
+@app.get("/health/llm")
+def llm_health():
+    """OpenAI client pool, retry/hedge counters, rolling latencies (per process), the batch lane and embeddings"""
+    from services import llm_gateway, batch_lane, embedding_store
+    return {**llm_gateway.get_stats(), "batch_lane": batch_lane.get_stats(), "embeddings": embedding_store.get_stats()}
+
 @app.get("/health/summary")
 async def health_check():
     """Health check for summary functionality"""
     try:
         # Check database connectivity
         if DATABASE_URL.startswith("sqlite"):
-            conn = sqlite3.connect("pdf_flashcards.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM pdfs")
-            pdf_count = cursor.fetchone()[0]
-            conn.close()
+            pdf_count = sqlite_engine.fetch_one("SELECT COUNT(*) FROM pdfs")[0]
         else:
             # For Postgres, use SQLAlchemy
             from sqlalchemy import text
@@ -881,12 +982,13 @@ async def health_check():
             "openai_configured": has_openai,
             # SECURITY: Removed openai_key_masked to prevent partial key exposure
             "feature_enabled": FEATURE_SUMMARY_CITATIONS,
-            "use_celery": USE_CELERY,
             "config": {
                 "model": SUMMARY_MODEL,
                 "top_k": TOP_K,
-                "threshold": THRESH
-            }
+                "threshold": THRESH,
+                "embedding_threshold": EMBEDDING_THRESH,
+            },
+            "response_cache": summary_cache.get_stats()
         }
     except Exception as e:
         summary_logger.exception(f"[health] check failed: {e}")
@@ -1,13 +1,114 @@
 import PyPDF2
 import io
-from typing import Optional
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Optional, List, NamedTuple, Tuple
 
-def extract_text_from_pdf(file_path: str) -> str:
+from PyPDF2.errors import PyPdfError
+
+from services import token_budget
+
+logger = logging.getLogger(__name__)
+
+# Per-job limits so pathological PDFs cannot tie up a worker
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "500"))
+PDF_EXTRACTION_TIMEOUT_SECONDS = float(os.getenv("PDF_EXTRACTION_TIMEOUT_SECONDS", "60"))
+
+# Parallel extraction settings
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_BATCH = int(os.getenv("PDF_PAGES_PER_BATCH", "8"))
+
+
+class PdfExtractionError(Exception):
+    """The PDF itself cannot be used (corrupt, encrypted, no text layer): retrying will not help."""
+    pass
+
+
+class PdfText(NamedTuple):
+    """Extracted text and how much of the document it covers."""
+    text: str
+    pages_read: int
+    total_pages: int
+    timed_out: bool
+
+    @property
+    def complete(self) -> bool:
+        """Every page was read (no page cap, character budget or time limit cut it short)."""
+        return not self.timed_out and self.pages_read == self.total_pages
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Lazily create the shared extraction pool (spawned, so workers never inherit app state)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _reset_process_pool() -> None:
+    """
+    Drop a broken or stuck pool so the next job gets a fresh one.
+
+    shutdown() alone never stops a worker that is stuck on a page, so the
+    pool's processes are terminated as well. Batches other jobs had running
+    on the pool then fail with the retryable "worker crashed" error.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            # The executor keeps no public handle on its workers
+            processes = list((_pool._processes or {}).values())
+            _pool.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            _pool = None
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract pages [start, end) in a worker process."""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [(pdf_reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def extract_text_from_pdf(
+    file_path: str,
+    max_chars: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    time_limit_s: Optional[float] = None,
+    parallel: Optional[bool] = None,
+) -> str:
     """
     Extract text content from a PDF file
     
+    Pages are read in order and extraction stops as soon as the character or
+    token budget is reached, so callers that only send the first few thousand
+    characters to the model do not pay for the whole document. Large PDFs are
+    spread across a process pool in page batches and joined in page order.
+
     Args:
         file_path: Path to the PDF file
+        max_chars: Stop once at least this many characters were extracted
+        max_tokens: Stop once at least this many tokens were extracted (counted by token_budget)
+        max_pages: Maximum pages to read (defaults to MAX_PDF_PAGES)
+        time_limit_s: Wall-clock limit for the job (defaults to PDF_EXTRACTION_TIMEOUT_SECONDS)
+        parallel: Force (True) or disable (False) the process pool; None decides by page count
         
     Returns:
         Extracted text content as string
@@ -15,32 +116,170 @@ def extract_text_from_pdf(file_path: str) -> str:
     Raises:
         Exception: If PDF cannot be read or text extraction fails
     """
+    return extract_pdf_text(file_path, max_chars, max_tokens, max_pages, time_limit_s, parallel).text
+
+
+def extract_pdf_text(
+    file_path: str,
+    max_chars: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    time_limit_s: Optional[float] = None,
+    parallel: Optional[bool] = None,
+) -> PdfText:
+    """
+    Same as extract_text_from_pdf, but also reports how many pages were read
+    and whether the time limit cut extraction short, so callers can tell a
+    partial extraction from the full text.
+    """
+    budget = _ExtractionBudget(max_chars, max_tokens)
+    max_pages = MAX_PDF_PAGES if max_pages is None else max_pages
+    time_limit_s = PDF_EXTRACTION_TIMEOUT_SECONDS if time_limit_s is None else time_limit_s
+    deadline = time.monotonic() + time_limit_s
+
     try:
         with open(file_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
             
             # Check if PDF is encrypted
             if pdf_reader.is_encrypted:
-                raise Exception("PDF is encrypted and cannot be processed")
-            
-            text_content = ""
-            
-            # Extract text from all pages
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text_content += page.extract_text() + "\n"
-            
-            # Clean up the text
-            text_content = text_content.strip()
-            
-            if not text_content:
-                raise Exception("No text content found in PDF")
-            
-            return text_content
-            
+                raise PdfExtractionError("PDF is encrypted and cannot be processed")
+
+            total_pages = len(pdf_reader.pages)
+            page_count = min(total_pages, max_pages)
+            if page_count < total_pages:
+                logger.warning(f"PDF has {total_pages} pages, extracting only the first {page_count}")
+
+            use_pool = parallel if parallel is not None else (
+                page_count >= PDF_PARALLEL_MIN_PAGES and PDF_EXTRACTION_WORKERS > 1
+            )
+
+            if use_pool:
+                pages, timed_out = _extract_parallel(file_path, page_count, budget, deadline)
+            else:
+                pages, timed_out = _extract_serial(pdf_reader, page_count, budget, deadline)
+
+        # Clean up the text
+        text_content = "\n".join(pages).strip()
+
+        if not text_content:
+            raise PdfExtractionError("No text content found in PDF")
+
+        return PdfText(text_content, len(pages), total_pages, timed_out)
+
+    except (PdfExtractionError, PyPdfError) as e:
+        raise PdfExtractionError(f"Failed to extract text from PDF: {str(e)}")
     except Exception as e:
+        # I/O errors, a crashed worker pool: may succeed on another attempt
         raise Exception(f"Failed to extract text from PDF: {str(e)}")
 
+
+class _ExtractionBudget:
+    """Character and token budget of one extraction, filled page by page."""
+
+    def __init__(self, max_chars: Optional[int], max_tokens: Optional[int]):
+        self.max_chars = max_chars
+        self.max_tokens = max_tokens
+        self.chars = 0
+        self.tokens = 0
+
+    def add(self, page_texts: List[str]) -> bool:
+        """Count extracted pages; True once either budget is reached."""
+        for page_text in page_texts:
+            self.chars += len(page_text) + 1
+            if self.max_tokens is not None:
+                # Same counting as the prompt budgets (tokenizer when installed)
+                self.tokens += token_budget.count_tokens(page_text) + 1
+        return (
+            (self.max_chars is not None and self.chars >= self.max_chars)
+            or (self.max_tokens is not None and self.tokens >= self.max_tokens)
+        )
+
+    def describe(self) -> str:
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return f"{self.max_tokens} tokens"
+        return f"{self.max_chars} chars"
+
+
+def _extract_serial(pdf_reader, page_count: int, budget: _ExtractionBudget, deadline: float) -> Tuple[List[str], bool]:
+    """Extract pages one by one in this process until a budget or the deadline is hit; returns (pages, timed_out)."""
+    pages = []
+
+    for page_num in range(page_count):
+        if time.monotonic() > deadline:
+            _on_deadline(pages, page_num, page_count)
+            return pages, True
+
+        page_text = pdf_reader.pages[page_num].extract_text() or ""
+        pages.append(page_text)
+
+        if budget.add([page_text]):
+            logger.info(f"Extraction budget of {budget.describe()} reached after {page_num + 1}/{page_count} pages")
+            break
+
+    return pages, False
+
+
+def _extract_parallel(file_path: str, page_count: int, budget: _ExtractionBudget, deadline: float) -> Tuple[List[str], bool]:
+    """
+    Extract page batches across the process pool, consuming results in page order;
+    returns (pages, timed_out).
+
+    Only a window of batches is in flight at a time, so reaching the budget
+    early leaves the remaining pages untouched.
+    """
+    batches = [
+        (start, min(start + PDF_PAGES_PER_BATCH, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_BATCH)
+    ]
+    window = max(1, PDF_EXTRACTION_WORKERS * 2)
+    pool = _get_process_pool()
+
+    pages: List[str] = []
+    in_flight = []
+    next_batch = 0
+    timed_out = False
+
+    try:
+        while next_batch < len(batches) or in_flight:
+            while next_batch < len(batches) and len(in_flight) < window:
+                start, end = batches[next_batch]
+                in_flight.append(pool.submit(_extract_page_range, file_path, start, end))
+                next_batch += 1
+
+            future = in_flight.pop(0)
+            remaining = deadline - time.monotonic()
+            try:
+                batch_pages = future.result(timeout=max(0.0, remaining))
+            except FutureTimeoutError:
+                _on_deadline(pages, len(pages), page_count)
+                # A worker may still be stuck on a pathological page
+                _reset_process_pool()
+                in_flight = []
+                timed_out = True
+                break
+
+            pages.extend(batch_pages)
+
+            if budget.add(batch_pages):
+                logger.info(f"Extraction budget of {budget.describe()} reached after {len(pages)}/{page_count} pages")
+                break
+    except BrokenProcessPool:
+        _reset_process_pool()
+        raise Exception("PDF extraction worker crashed")
+    finally:
+        for pending in in_flight:
+            pending.cancel()
+
+    return pages, timed_out
+
+
+def _on_deadline(pages: List[str], done: int, page_count: int) -> None:
+    """Handle the per-job time limit: keep partial text, fail if there is none."""
+    if not any(p.strip() for p in pages):
+        raise PdfExtractionError("PDF extraction timed out")
+    logger.warning(f"PDF extraction time limit hit after {done}/{page_count} pages, using partial text")
+
 def validate_pdf(file_path: str) -> bool:
     """
     Validate if a file is a valid PDF
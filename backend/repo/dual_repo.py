@@ -1,10 +1,14 @@
 import os
+import re
+import time
 import logging
 from contextlib import contextmanager
+from threading import Lock
 from typing import List, Any, Optional
 import sqlite3
 from sqlalchemy import text
 from db.supabase_engine import SessionSupabase, SUPABASE_ENABLED
+from db import sqlite_engine
 
 logger = logging.getLogger(__name__)
 
@@ -20,9 +24,65 @@ DB_READ_PRIMARY = os.getenv("DB_READ_PRIMARY", "sqlite").lower()
 WRITE_SUPABASE = os.getenv("DB_WRITE_SUPABASE", "true").lower() == "true" and SUPABASE_ENABLED
 WRITE_SQLITE = os.getenv("DB_WRITE_SQLITE", "true").lower() == "true"
 
+PDF_RECORD_CACHE_TTL_SECONDS = float(os.getenv("PDF_RECORD_CACHE_TTL_SECONDS", "30"))
+PDF_RECORD_CACHE_MAX_ENTRIES = int(os.getenv("PDF_RECORD_CACHE_MAX_ENTRIES", "10000"))
+
 # Log configuration on startup
 logger.info(f"Database configuration: read_primary={DB_READ_PRIMARY}, write_sqlite={WRITE_SQLITE}, write_supabase={WRITE_SUPABASE}, supabase_enabled={SUPABASE_ENABLED}")
 
+
+class PdfRecordCache:
+    """
+    In-process TTL cache of `pdfs` rows, so status polls are served from memory.
+    
+    Writes in this process (upsert_pdf, update_pdf_status) update the cache
+    directly; the TTL bounds staleness for writes made by other processes.
+    """
+    
+    def __init__(self, ttl_seconds: float = PDF_RECORD_CACHE_TTL_SECONDS, max_entries: int = PDF_RECORD_CACHE_MAX_ENTRIES):
+        self._entries = {}
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._lock = Lock()
+    
+    def get(self, pdf_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(pdf_id)
+            if entry is None:
+                return None
+            expires_at, record = entry
+            if expires_at < time.monotonic():
+                del self._entries[pdf_id]
+                return None
+            return dict(record)
+    
+    def put(self, record: dict) -> None:
+        with self._lock:
+            if len(self._entries) >= self._max_entries and record["id"] not in self._entries:
+                # Drop the entry closest to expiry (dicts keep insertion order)
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[record["id"]] = (time.monotonic() + self._ttl, dict(record))
+    
+    def update_status(self, pdf_id: str, status: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(pdf_id, None)
+            if entry is not None:
+                record = dict(entry[1], status=status)
+                self._entries[pdf_id] = (time.monotonic() + self._ttl, record)
+    
+    def invalidate(self, pdf_id: str) -> None:
+        with self._lock:
+            self._entries.pop(pdf_id, None)
+
+
+# Global cache instance
+_pdf_record_cache = PdfRecordCache()
+
+
+def deck_title_from_filename(filename: str) -> str:
+    """Deck title shown for a PDF: the filename without its .pdf extension."""
+    return re.sub(r'\.pdf$', '', filename, flags=re.IGNORECASE).strip() or filename
+
 @contextmanager
 def get_read_session():
     """Get read session based on DB_READ_PRIMARY setting"""
@@ -32,29 +92,21 @@ def get_read_session():
                 yield s
         except Exception as e:
             logger.warning(f"Supabase read failed, falling back to SQLite: {e}")
-            # Fallback to SQLite
-            conn = sqlite3.connect("pdf_flashcards.db")
-            try:
-                yield conn
-            finally:
-                conn.close()
+            # Fallback to SQLite (shared per-thread connection, not closed here)
+            yield sqlite_engine.get_connection()
     else:
-        # Default to SQLite
-        conn = sqlite3.connect("pdf_flashcards.db")
-        try:
-            yield conn
-        finally:
-            conn.close()
+        # Default to SQLite (shared per-thread connection, not closed here)
+        yield sqlite_engine.get_connection()
 
 @contextmanager
 def get_write_sessions():
-    """Get write sessions for dual-write fanout"""
+    """Get Supabase write sessions for dual-write fanout
+    
+    SQLite writes do not get a session here: they go through the shared
+    writer thread (sqlite_engine.run_write), see execute_dual_write_sql.
+    """
     sessions = []
     try:
-        if WRITE_SQLITE:
-            sqlite_conn = sqlite3.connect("pdf_flashcards.db")
-            sessions.append(("sqlite", sqlite_conn))
-        
         if WRITE_SUPABASE and SessionSupabase:
             supabase_session = SessionSupabase()
             sessions.append(("supabase", supabase_session))
@@ -64,10 +116,7 @@ def get_write_sessions():
         # Commit all sessions
         for db_type, session in sessions:
             try:
-                if db_type == "sqlite":
-                    session.commit()
-                else:  # supabase
-                    session.commit()
+                session.commit()
             except Exception as e:
                 logger.error(f"Failed to commit {db_type} session: {e}")
                 raise
@@ -76,10 +125,7 @@ def get_write_sessions():
         # Rollback all sessions on error
         for db_type, session in sessions:
             try:
-                if db_type == "sqlite":
-                    session.rollback()
-                else:  # supabase
-                    session.rollback()
+                session.rollback()
             except Exception as rollback_error:
                 logger.error(f"Failed to rollback {db_type} session: {rollback_error}")
         raise
@@ -87,43 +133,53 @@ def get_write_sessions():
         # Close all sessions
         for db_type, session in sessions:
             try:
-                if db_type == "sqlite":
-                    session.close()
-                else:  # supabase
-                    session.close()
+                session.close()
             except Exception as close_error:
                 logger.error(f"Failed to close {db_type} session: {close_error}")
 
 def execute_dual_write_sql(sql: str, params: tuple = None) -> List[Any]:
-    """Execute SQL on both databases and return results from primary"""
+    """Execute SQL on both databases and return results from primary
+    
+    The Supabase statement runs first and is committed only after the SQLite
+    write (on the shared writer thread) succeeded, so a SQLite failure rolls
+    both back.
+    """
     if params is None:
         params = ()
+    is_select = sql.strip().upper().startswith('SELECT')
+    
+    def sqlite_write(conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall() if is_select else cursor.lastrowid
     
     results = []
     with get_write_sessions() as sessions:
         for db_type, session in sessions:
             try:
-                if db_type == "sqlite":
-                    cursor = session.cursor()
-                    cursor.execute(sql, params)
-                    result = cursor.fetchall() if sql.strip().upper().startswith('SELECT') else cursor.lastrowid
-                    results.append(result)
-                else:  # supabase
-                    # Convert SQLite-style placeholders (?) to PostgreSQL-style named parameters
-                    pg_sql, params_dict = convert_sqlite_to_postgres(sql, params)
-                    if params_dict:
-                        result = session.execute(text(pg_sql), params_dict)
-                    else:
-                        result = session.execute(text(pg_sql))
-                    if sql.strip().upper().startswith('SELECT'):
-                        results.append(result.fetchall())
-                    else:
-                        # SQLAlchemy 2.x Result doesn't have lastrowid
-                        # For INSERT/UPDATE/DELETE, use rowcount or None
-                        results.append(result.rowcount if hasattr(result, 'rowcount') else None)
+                # Convert SQLite-style placeholders (?) to PostgreSQL-style named parameters
+                pg_sql, params_dict = convert_sqlite_to_postgres(sql, params)
+                if params_dict:
+                    result = session.execute(text(pg_sql), params_dict)
+                else:
+                    result = session.execute(text(pg_sql))
+                if is_select:
+                    results.append(result.fetchall())
+                else:
+                    # SQLAlchemy 2.x Result doesn't have lastrowid
+                    # For INSERT/UPDATE/DELETE, use rowcount or None
+                    results.append(result.rowcount if hasattr(result, 'rowcount') else None)
             except Exception as e:
                 logger.error(f"Failed to execute SQL on {db_type}: {e}")
                 raise
+        
+        if WRITE_SQLITE:
+            try:
+                # SQLite first in the results, for compatibility
+                results.insert(0, sqlite_engine.run_write(sqlite_write))
+            except Exception as e:
+                logger.error(f"Failed to execute SQL on sqlite: {e}")
+                raise
     
     # Return result from first session (usually SQLite for compatibility)
     return results[0] if results else None
@@ -161,14 +217,15 @@ def upsert_pdf(pdf_id: str, filename: str, status: str = "uploaded") -> str:
                 VALUES (?, ?, ?, CURRENT_TIMESTAMP)
             """
             params = (pdf_id, filename, status)
-            conn = sqlite3.connect("pdf_flashcards.db")
-            try:
-                cursor = conn.cursor()
-                cursor.execute(sqlite_sql, params)
-                conn.commit()
-            finally:
-                conn.close()
+            sqlite_engine.execute_write(sqlite_sql, params)
+            _pdf_record_cache.put({
+                "id": pdf_id,
+                "filename": filename,
+                "status": status,
+                "title": deck_title_from_filename(filename),
+            })
         except Exception as e:
+            _pdf_record_cache.invalidate(pdf_id)
             logger.warning(f"Failed to upsert PDF in SQLite: {e}")
     
     return pdf_id
@@ -183,13 +240,20 @@ def upsert_flashcard(pdf_id: str, question: str, answer: str, card_number: int)
     insert_flashcard_in_supabase(pdf_id, question, answer, card_number)
     return card_number
 
-def get_pdf_status(pdf_id: str) -> Optional[str]:
+def get_pdf_record(pdf_id: str) -> Optional[dict]:
     """
-    Get PDF status from SQLite (pdfs table not in Supabase).
+    Get a PDF's status and filename in one read (pdfs table not in Supabase).
     
-    NOTE: We only use Supabase for flashcards table, not pdfs table.
+    Served from the in-process TTL cache when possible.
+    
+    Returns:
+        {"id", "filename", "status", "title"} or None if the PDF does not exist
     """
-    sql = "SELECT status FROM pdfs WHERE id = ?"
+    record = _pdf_record_cache.get(pdf_id)
+    if record is not None:
+        return record
+    
+    sql = "SELECT id, filename, status FROM pdfs WHERE id = ?"
     params = (pdf_id,)
     
     with get_read_session() as session:
@@ -204,7 +268,26 @@ def get_pdf_status(pdf_id: str) -> Optional[str]:
             else:
                 result = session.execute(text(pg_sql)).fetchone()
     
-    return result[0] if result else None
+    if not result:
+        return None
+    
+    record = {
+        "id": result[0],
+        "filename": result[1],
+        "status": result[2],
+        "title": deck_title_from_filename(result[1]) if result[1] else None,
+    }
+    _pdf_record_cache.put(record)
+    return record
+
+def get_pdf_status(pdf_id: str) -> Optional[str]:
+    """
+    Get PDF status from SQLite (pdfs table not in Supabase).
+    
+    NOTE: We only use Supabase for flashcards table, not pdfs table.
+    """
+    record = get_pdf_record(pdf_id)
+    return record["status"] if record else None
 
 def get_pdf_filename(pdf_id: str) -> Optional[str]:
     """
@@ -212,22 +295,8 @@ def get_pdf_filename(pdf_id: str) -> Optional[str]:
     
     NOTE: We only use Supabase for flashcards table, not pdfs table.
     """
-    sql = "SELECT filename FROM pdfs WHERE id = ?"
-    params = (pdf_id,)
-    
-    with get_read_session() as session:
-        if isinstance(session, sqlite3.Connection):
-            cursor = session.cursor()
-            cursor.execute(sql, params)
-            result = cursor.fetchone()
-        else:  # supabase session
-            pg_sql, params_dict = convert_sqlite_to_postgres(sql, params)
-            if params_dict:
-                result = session.execute(text(pg_sql), params_dict).fetchone()
-            else:
-                result = session.execute(text(pg_sql)).fetchone()
-    
-    return result[0] if result else None
+    record = get_pdf_record(pdf_id)
+    return record["filename"] if record else None
 
 def get_flashcards(pdf_id: str) -> List[tuple]:
     """
@@ -267,14 +336,10 @@ def update_pdf_status(pdf_id: str, status: str) -> None:
         try:
             sql = "UPDATE pdfs SET status = ? WHERE id = ?"
             params = (status, pdf_id)
-            conn = sqlite3.connect("pdf_flashcards.db")
-            try:
-                cursor = conn.cursor()
-                cursor.execute(sql, params)
-                conn.commit()
-            finally:
-                conn.close()
+            sqlite_engine.execute_write(sql, params)
+            _pdf_record_cache.update_status(pdf_id, status)
         except Exception as e:
+            _pdf_record_cache.invalidate(pdf_id)
             logger.warning(f"Failed to update PDF status in SQLite: {e}")
 
 def create_deck_in_supabase(deck_id: str, title: str, source_type: str, source_label: Optional[str], user_id: Optional[str] = None) -> bool:
@@ -355,3 +420,38 @@ def create_deck_in_supabase(deck_id: str, title: str, source_type: str, source_l
     except Exception as e:
         logger.error("Exception in create_deck_in_supabase for deck_id=%s: %s", deck_id, e, exc_info=True)
         return False
+
+def delete_deck_in_supabase(deck_id: str) -> bool:
+    """
+    Delete a deck from Supabase via REST: its flashcards, user_decks links, then the deck.
+    
+    - Returns True if the deck row was deleted, False otherwise.
+    - Logs errors but does not raise.
+    """
+    import requests
+    from repo.supabase_rest_flashcards import _base_rest_url, _headers
+    
+    try:
+        base_url = _base_rest_url()
+        headers = _headers()
+        headers["Prefer"] = "return=minimal"
+        params = {"deck_id": f"eq.{deck_id}"}
+        
+        for table in ("flashcards", "user_decks", "decks"):
+            resp = requests.delete(f"{base_url}/{table}", headers=headers, params=params, timeout=10)
+            if resp.status_code not in (200, 204):
+                logger.error(
+                    "Supabase delete from %s failed for deck_id=%s: status=%s body=%s",
+                    table,
+                    deck_id,
+                    resp.status_code,
+                    resp.text,
+                )
+                return False
+        
+        logger.info("Supabase deck delete OK: deck_id=%s", deck_id)
+        return True
+        
+    except Exception as e:
+        logger.error("Exception in delete_deck_in_supabase for deck_id=%s: %s", deck_id, e, exc_info=True)
+        return False
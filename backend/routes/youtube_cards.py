@@ -13,6 +13,7 @@ in Supabase for the "My Decks" feature.
     6. Generate flashcards from cleaned transcript (same as PDFs)
     7. Store flashcards in Supabase
 """
+import os
 import logging
 from typing import List, Optional
 from fastapi import APIRouter, HTTPException, Header, Depends
@@ -28,12 +29,17 @@ from flashcard_generator import generate_flashcards  # Same function used for PD
 from repo.dual_repo import create_deck_in_supabase, upsert_flashcard, delete_flashcards
 from repo.supabase_transcripts import save_cleaned_transcript_to_supabase
 from security.auth import require_auth, get_optional_user
-from security.quota_rpc import enforce_quota
+from security.quota_rpc import enforce_quota, reserved_tokens_for
+from services import job_queue, usage_meter, dedup_index
+from services.job_queue import JobLeaseLost, ensure_lease
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/youtube", tags=["youtube"])
 
+# How long a request waits for its queued generation job before returning 504
+YOUTUBE_JOB_WAIT_SECONDS = float(os.getenv("YOUTUBE_JOB_WAIT_SECONDS", "240"))
+
 class YouTubeTrack(BaseModel):
     lang: str = Field(..., description="Language code")
     kind: str = Field(..., description="Type: manual or auto")
@@ -185,8 +191,73 @@ async def generate_youtube_flashcards(
     """
     Generate flashcards from YouTube video transcript.
     
+    The work runs on the shared job queue; this request waits for the result.
+    
     SECURITY: Requires authentication (X-User-Id header)
     SECURITY: Uses Supabase RPC for atomic quota check (runs BEFORE OpenAI)
+    """
+    job_id = job_queue.enqueue(
+        job_queue.KIND_YOUTUBE_FLASHCARDS,
+        {"request": request.model_dump(), "reserved_tokens": reserved_tokens_for(user_id)},
+        user_id=user_id,
+    )
+    return await _wait_for_flashcards_job(job_id)
+
+@router.post("/transcript-flashcards", response_model=YouTubeFlashcardsResponse)
+async def generate_flashcards_from_manual_transcript(
+    request: ManualTranscriptRequest,
+    user_id: str = Depends(enforce_quota)  # SECURITY: Auth + quota in one dependency
+):
+    """
+    Generate flashcards from manually pasted transcript text.
+    This endpoint allows users to paste transcript text when automatic YouTube caption fetching fails.
+    
+    The work runs on the shared job queue; this request waits for the result.
+    
+    SECURITY: Requires authentication (X-User-Id header)
+    SECURITY: Uses Supabase RPC for atomic quota check (runs BEFORE OpenAI)
+    """
+    if not request.transcript.strip():
+        raise HTTPException(status_code=400, detail="Transcript text is empty.")
+    job_id = job_queue.enqueue(
+        job_queue.KIND_TRANSCRIPT_FLASHCARDS,
+        {"request": request.model_dump(), "reserved_tokens": reserved_tokens_for(user_id)},
+        user_id=user_id,
+    )
+    return await _wait_for_flashcards_job(job_id)
+
+async def _wait_for_flashcards_job(job_id: str) -> YouTubeFlashcardsResponse:
+    """Wait for a queued YouTube/transcript job and turn its outcome into a response."""
+    job = await job_queue.wait_for_job(job_id, timeout=YOUTUBE_JOB_WAIT_SECONDS)
+    if job is None:
+        raise HTTPException(status_code=500, detail="Flashcard job disappeared")
+    
+    if job["status"] == job_queue.STATUS_SUCCEEDED:
+        return YouTubeFlashcardsResponse(**job["result"])
+    
+    if job["status"] == job_queue.STATUS_FAILED:
+        result = job.get("result") or {}
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("detail") or {
+                "status": "error",
+                "message": "Failed to process this YouTube video. Please try again later."
+            }
+        )
+    
+    # Still queued/running: the job keeps going, the client can poll /jobs/{job_id}
+    raise HTTPException(
+        status_code=504,
+        detail={
+            "status": "pending",
+            "message": "Flashcard generation is taking longer than expected.",
+            "job_id": job_id
+        }
+    )
+
+def build_youtube_flashcards(request: YouTubeFlashcardsRequest, user_id: Optional[str]) -> YouTubeFlashcardsResponse:
+    """
+    YouTube URL -> flashcards pipeline (run by queue workers).
     
     Pipeline:
     1. Extract video ID + title
@@ -215,6 +286,7 @@ async def generate_youtube_flashcards(
             video_id = metadata["id"]
             video_title = metadata["title"]
             logger.info(f"Got metadata: id={video_id}, title={video_title[:50]}...")
+            usage_meter.set_deck(video_id)  # The deck id is the video id: attribute LLM usage to it
         except YTDlpError as e:
             logger.error(f"Failed to fetch YouTube metadata: {e}")
             # If it's a transcript/subtitle related error, use the standard message
@@ -347,6 +419,19 @@ async def generate_youtube_flashcards(
                 }
             )
         
+        # Drop near-duplicates of each other and of the user's other decks
+        dedup = dedup_index.DedupSession(x_user_id, deck_id)
+        flashcards_data = dedup_index.filter_cards(dedup, flashcards_data)
+        if not flashcards_data:
+            # The existing deck (if any) is left as it is
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    "status": "error",
+                    "message": "Every generated flashcard duplicates one in your other decks."
+                }
+            )
+        
         # Convert to YouTubeCard format for response
         final_cards = []
         for card in flashcards_data:
@@ -356,7 +441,8 @@ async def generate_youtube_flashcards(
                 tags=["youtube"]
             ))
         
-        # Step 7: Store flashcards in Supabase
+        # Step 7: Store flashcards in Supabase (unless another worker reclaimed this job)
+        ensure_lease()
         try:
             # Delete existing flashcards for this deck (in case of regeneration)
             delete_flashcards(deck_id)
@@ -370,6 +456,8 @@ async def generate_youtube_flashcards(
                     card_number=idx
                 )
             
+            # Index the cards only once they are saved
+            dedup.commit()
             logger.info(f"Auto-saved {len(flashcards_data)} YouTube cards to Supabase deck {deck_id}")
         except Exception as persist_err:
             logger.error(f"Failed to auto-save YouTube cards to Supabase deck: {persist_err}", exc_info=True)
@@ -397,7 +485,7 @@ async def generate_youtube_flashcards(
             videoTitle=video_title
         )
         
-    except HTTPException:
+    except (HTTPException, JobLeaseLost):
         raise
     except Exception as e:
         logger.error(f"Unexpected error in YouTube flashcards generation: {e}", exc_info=True)
@@ -409,17 +497,9 @@ async def generate_youtube_flashcards(
             }
         )
 
-@router.post("/transcript-flashcards", response_model=YouTubeFlashcardsResponse)
-async def generate_flashcards_from_manual_transcript(
-    request: ManualTranscriptRequest,
-    user_id: str = Depends(enforce_quota)  # SECURITY: Auth + quota in one dependency
-):
+def build_manual_transcript_flashcards(request: ManualTranscriptRequest, user_id: Optional[str]) -> YouTubeFlashcardsResponse:
     """
-    Generate flashcards from manually pasted transcript text.
-    This endpoint allows users to paste transcript text when automatic YouTube caption fetching fails.
-    
-    SECURITY: Requires authentication (X-User-Id header)
-    SECURITY: Uses Supabase RPC for atomic quota check (runs BEFORE OpenAI)
+    Manual transcript -> flashcards pipeline (run by queue workers).
     """
     # NOTE: Quota was already consumed atomically by enforce_quota dependency
     x_user_id = user_id  # For backward compatibility
@@ -459,6 +539,7 @@ async def generate_flashcards_from_manual_transcript(
             semantic_windows,
             select_key_points,
             prepare_excerpts_for_llm,
+            align_card_evidence,
             deduplicate_cards,
             truncate_answer
         )
@@ -530,6 +611,9 @@ async def generate_flashcards_from_manual_transcript(
             logger.error(f"LLM flashcard generation failed for manual transcript: {e}")
             raise HTTPException(status_code=500, detail="Failed to generate flashcards from transcript.")
         
+        # Pin evidence quotes (and their timestamps) to the transcript text
+        raw_cards = align_card_evidence(raw_cards, key_windows)
+        
         # Post-process cards
         processed_cards = []
         for card in raw_cards:
@@ -551,17 +635,28 @@ async def generate_flashcards_from_manual_transcript(
             
             processed_cards.append(YouTubeCard(**card))
         
-        # Deduplicate cards
-        deduplicated_cards = deduplicate_cards([card.dict() for card in processed_cards])
-        final_cards = [YouTubeCard(**card) for card in deduplicated_cards]
+        # Use video_id if available, otherwise generate a UUID
+        import uuid
+        deck_id = video_id if video_id else str(uuid.uuid4())
+        usage_meter.set_deck(deck_id)
         
+        # Deduplicate cards (within the deck and against the user's other decks)
         # Limit to target count (enforce exactly 10)
-        final_cards = final_cards[:int(target_count)]
+        dedup = dedup_index.DedupSession(x_user_id, deck_id)
+        deduplicated_cards = deduplicate_cards(
+            [card.dict() for card in processed_cards], dedup, limit=int(target_count)
+        )
+        if not deduplicated_cards:
+            # The existing deck (if any) is left as it is
+            raise HTTPException(
+                status_code=422,
+                detail="Every generated flashcard duplicates one in your other decks."
+            )
+        final_cards = [YouTubeCard(**card) for card in deduplicated_cards]
         
         # Automatically save cards to Supabase deck for parity with PDF/YouTube flow
-        # Use video_id if available, otherwise generate a UUID
-        import uuid
-        deck_id = video_id if video_id else str(uuid.uuid4())
+        # (unless another worker reclaimed this job)
+        ensure_lease()
         try:
             # Build deck title
             deck_title = f"YouTube: {video_title}" if video_title else "YouTube: Manual Transcript"
@@ -594,6 +689,8 @@ async def generate_flashcards_from_manual_transcript(
                     card_number=idx
                 )
             
+            # Index the cards only once they are saved
+            dedup.commit()
             logger.info(f"Auto-saved {len(final_cards)} manual transcript cards to Supabase deck {deck_id}")
             
         except Exception as persist_err:
@@ -613,7 +710,7 @@ async def generate_flashcards_from_manual_transcript(
             videoTitle=video_title
         )
         
-    except HTTPException:
+    except (HTTPException, JobLeaseLost):
         raise
     except Exception as e:
         logger.error(f"Unexpected error in manual transcript flashcard generation: {e}", exc_info=True)
@@ -4,6 +4,7 @@ Resource Ownership Verification (IDOR Protection)
 Provides functions to verify user ownership of:
 - Decks (deck_id)
 - Sources/PDFs (source_id / pdf_id)
+- Queue jobs (job_id)
 - Files
 
 Prevents unauthorized access to resources via guessable IDs.
@@ -145,6 +146,46 @@ async def assert_source_owner(source_id: str, user_id: str):
         )
 
 
+async def check_job_owner(job: dict, user_id: str) -> bool:
+    """
+    Check if user may read the specified queue job.
+    
+    The user who enqueued the job may; so may the owner of its source, since
+    a summary refresh can attach to a build another user enqueued.
+    """
+    if not ENFORCE_OWNERSHIP:
+        return True
+    
+    if not user_id or user_id == "anonymous":
+        return False
+    
+    if job.get("user_id") == user_id:
+        return True
+    
+    source_id = job.get("source_id")
+    return bool(source_id) and await check_source_owner(source_id, user_id)
+
+
+async def assert_job_owner(job: dict, user_id: str):
+    """
+    Assert that user may read the job. Raises 403 if not.
+    """
+    if not ENFORCE_OWNERSHIP:
+        return
+    
+    is_owner = await check_job_owner(job, user_id)
+    
+    if not is_owner:
+        logger.warning(f"IDOR attempt: user {user_id} tried to access job {job.get('id')}")
+        raise HTTPException(
+            status_code=403,
+            detail={
+                "error_code": "FORBIDDEN",
+                "message": "You do not have access to this job."
+            }
+        )
+
+
 async def check_resource_access(
     resource_type: str,
     resource_id: str, 
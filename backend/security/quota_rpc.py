@@ -80,6 +80,16 @@ def get_user_limits(user_id: str) -> tuple:
     return (DAILY_REQUEST_LIMIT, MONTHLY_TOKEN_LIMIT, QUOTA_RESERVED_TOKENS)
 
 
+def reserved_tokens_for(user_id: Optional[str]) -> int:
+    """
+    Tokens enforce_quota reserved for one request by this user.
+    
+    Queued jobs carry this so the reservation can be reconciled against the
+    tokens actually used (services/usage_meter.py).
+    """
+    return get_user_limits(user_id)[2]
+
+
 async def enforce_quota_rpc(user_id: str) -> Dict[str, Any]:
     """
     Enforce quota using Supabase RPC (atomic check + increment).
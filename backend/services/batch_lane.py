@@ -0,0 +1,445 @@
+"""
+Batch Lane
+
+A separate path for non-urgent LLM work (summary refreshes, backfills,
+regenerations) so it stops competing with interactive generations for the
+per-request OpenAI concurrency:
+
+1. A job handler `submit`s its chat completion request and defers the job
+   (job_queue.JobDeferred), releasing its worker
+2. A runner thread in each worker process collects pending requests and
+   submits them in bulk once BATCH_LANE_MIN_REQUESTS are waiting or the
+   oldest has waited BATCH_LANE_MAX_WAIT_SECONDS
+3. The runner polls submitted batches and writes each result back to the
+   `llm_batch_requests` table
+4. The deferred job runs again, finds its result with `get`, and finishes
+
+Backends (BATCH_LANE_BACKEND):
+- "openai": the OpenAI Batch API (JSONL upload, /v1/batches, output file),
+  billed at the batch discount. The pinned SDK predates it, so it is called
+  with httpx directly.
+- "local": a stand-in that completes every request through the LLM gateway
+  at submit time, for development and tests.
+
+Requests are keyed by the job id, so a re-run job never submits twice.
+"""
+
+import os
+import io
+import json
+import time
+import uuid
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import MetaData, Table, Column, String, Text, Float, Index, select, update, delete, and_, func
+
+from services.job_queue import engine
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+BATCH_LANE_ENABLED = os.getenv("BATCH_LANE_ENABLED", "false").lower() == "true"
+BATCH_LANE_BACKEND = os.getenv("BATCH_LANE_BACKEND", "openai")
+BATCH_LANE_MIN_REQUESTS = int(os.getenv("BATCH_LANE_MIN_REQUESTS", "20"))
+BATCH_LANE_MAX_REQUESTS = int(os.getenv("BATCH_LANE_MAX_REQUESTS", "1000"))
+BATCH_LANE_MAX_WAIT_SECONDS = float(os.getenv("BATCH_LANE_MAX_WAIT_SECONDS", "300"))
+BATCH_LANE_POLL_SECONDS = float(os.getenv("BATCH_LANE_POLL_SECONDS", "60"))
+BATCH_LANE_JOB_POLL_SECONDS = float(os.getenv("BATCH_LANE_JOB_POLL_SECONDS", "120"))
+BATCH_LANE_COMPLETION_WINDOW = os.getenv("BATCH_LANE_COMPLETION_WINDOW", "24h")
+BATCH_LANE_RETENTION_SECONDS = float(os.getenv("BATCH_LANE_RETENTION_SECONDS", str(7 * 24 * 3600)))
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# Request statuses
+STATUS_PENDING = "pending"
+STATUS_SUBMITTING = "submitting"
+STATUS_SUBMITTED = "submitted"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+# Submissions interrupted by a crash go back to pending after this long
+SUBMIT_TIMEOUT_SECONDS = 300
+
+# Request arguments the Batch API does not accept (client-side options)
+_CLIENT_ONLY_ARGS = ("timeout", "stream")
+
+# A backend poll result: None while running, else {request_id: (response body, error)}
+BatchResults = Optional[Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]]]
+
+
+# ============================================================================
+# Schema
+# ============================================================================
+
+metadata = MetaData()
+
+batch_requests = Table(
+    "llm_batch_requests",
+    metadata,
+    Column("id", String(64), primary_key=True),
+    Column("request", Text, nullable=False),
+    Column("status", String(16), nullable=False),
+    Column("batch_id", String(128), nullable=True),
+    Column("response", Text, nullable=True),
+    Column("error", Text, nullable=True),
+    Column("created_at", Float, nullable=False),
+    Column("updated_at", Float, nullable=False),
+    Index("idx_llm_batch_requests_status", "status", "created_at"),
+    Index("idx_llm_batch_requests_batch_id", "batch_id"),
+)
+
+
+def init_db() -> None:
+    """Create the llm_batch_requests table (called at startup, see db/schema.py)."""
+    try:
+        metadata.create_all(bind=engine)
+    except Exception as e:
+        logger.warning(f"Could not initialize llm_batch_requests table: {e}")
+
+
+# ============================================================================
+# Backends
+# ============================================================================
+
+class OpenAIBatchBackend:
+    """The OpenAI Batch API over raw HTTP."""
+
+    def __init__(self, api_key: Optional[str] = None, base_url: str = OPENAI_BASE_URL):
+        self._api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self._base_url = base_url.rstrip("/")
+
+    def _client(self) -> httpx.Client:
+        if not self._api_key:
+            raise RuntimeError("OPENAI_API_KEY environment variable is required")
+        return httpx.Client(
+            base_url=self._base_url,
+            headers={"Authorization": f"Bearer {self._api_key}"},
+            timeout=httpx.Timeout(120, connect=10),
+        )
+
+    def submit(self, requests: List[Tuple[str, Dict[str, Any]]]) -> str:
+        lines = [
+            json.dumps({"custom_id": request_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+            for request_id, body in requests
+        ]
+        with self._client() as client:
+            upload = client.post(
+                "/files",
+                data={"purpose": "batch"},
+                files={"file": ("batch.jsonl", io.BytesIO("\n".join(lines).encode("utf-8")), "application/jsonl")},
+            )
+            upload.raise_for_status()
+            batch = client.post("/batches", json={
+                "input_file_id": upload.json()["id"],
+                "endpoint": "/v1/chat/completions",
+                "completion_window": BATCH_LANE_COMPLETION_WINDOW,
+            })
+            batch.raise_for_status()
+            return batch.json()["id"]
+
+    def poll(self, batch_id: str) -> BatchResults:
+        with self._client() as client:
+            response = client.get(f"/batches/{batch_id}")
+            response.raise_for_status()
+            batch = response.json()
+            status = batch.get("status")
+            if status not in ("completed", "failed", "expired", "cancelled"):
+                return None
+
+            results: Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]] = {}
+            # Expired and cancelled batches still return the requests that finished
+            for file_key in ("output_file_id", "error_file_id"):
+                file_id = batch.get(file_key)
+                if not file_id:
+                    continue
+                content = client.get(f"/files/{file_id}/content")
+                content.raise_for_status()
+                for line in content.text.splitlines():
+                    if line.strip():
+                        request_id, result = self._parse_line(json.loads(line))
+                        results[request_id] = result
+            if status != "completed" and not results:
+                errors = (batch.get("errors") or {}).get("data") or []
+                message = errors[0].get("message") if errors else f"Batch {status}"
+                # Requests missing from the results are failed by the caller
+                logger.warning(f"Batch {batch_id} ended with status {status}: {message}")
+            return results
+
+    @staticmethod
+    def _parse_line(line: Dict[str, Any]) -> Tuple[str, Tuple[Optional[Dict[str, Any]], Optional[str]]]:
+        request_id = line.get("custom_id")
+        response = line.get("response") or {}
+        if line.get("error"):
+            return request_id, (None, str(line["error"].get("message") or line["error"]))
+        if response.get("status_code") != 200:
+            error = (response.get("body") or {}).get("error") or {}
+            return request_id, (None, error.get("message") or f"HTTP {response.get('status_code')}")
+        return request_id, (response.get("body"), None)
+
+
+class LocalBatchBackend:
+    """
+    Stand-in backend: completes requests at submit time, one by one.
+
+    Args:
+        complete: Runs one request and returns a ChatCompletion
+            (defaults to the LLM gateway)
+    """
+
+    def __init__(self, complete: Optional[Callable[..., Any]] = None):
+        self._complete = complete
+        self._results: Dict[str, Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, requests: List[Tuple[str, Dict[str, Any]]]) -> str:
+        complete = self._complete
+        if complete is None:
+            from services import llm_gateway
+            complete = llm_gateway.chat_completion
+        results = {}
+        for request_id, body in requests:
+            try:
+                results[request_id] = (complete(**body).model_dump(), None)
+            except Exception as e:
+                results[request_id] = (None, str(e))
+        batch_id = f"local_{uuid.uuid4().hex}"
+        with self._lock:
+            self._results[batch_id] = results
+        return batch_id
+
+    def poll(self, batch_id: str) -> BatchResults:
+        with self._lock:
+            # Results live in this process only; an unknown batch finished elsewhere or was lost
+            return self._results.pop(batch_id, {})
+
+
+def make_backend(name: str = BATCH_LANE_BACKEND):
+    if name == "local":
+        return LocalBatchBackend()
+    if name == "openai":
+        return OpenAIBatchBackend()
+    raise ValueError(f"Unknown batch lane backend: {name}")
+
+
+# ============================================================================
+# Producer API (job handlers)
+# ============================================================================
+
+def submit(request_id: str, request: Dict[str, Any]) -> None:
+    """Queue a chat completion request; a request id that already exists is left as is."""
+    body = {key: value for key, value in request.items() if key not in _CLIENT_ONLY_ARGS}
+    now = time.time()
+    with engine.begin() as conn:
+        exists = conn.execute(select(batch_requests.c.id).where(batch_requests.c.id == request_id)).first()
+        if exists:
+            return
+        conn.execute(batch_requests.insert().values(
+            id=request_id,
+            request=json.dumps(body),
+            status=STATUS_PENDING,
+            created_at=now,
+            updated_at=now,
+        ))
+    logger.info(f"[batch] Queued request {request_id} for model={body.get('model')}")
+
+
+def get(request_id: str) -> Optional[Dict[str, Any]]:
+    """A request with its status, and `response` (a chat completion dict) once completed."""
+    with engine.connect() as conn:
+        row = conn.execute(select(batch_requests).where(batch_requests.c.id == request_id)).first()
+    if row is None:
+        return None
+    entry = dict(row._mapping)
+    entry["request"] = json.loads(entry["request"])
+    entry["response"] = json.loads(entry["response"]) if entry.get("response") else None
+    return entry
+
+
+def is_done(entry: Dict[str, Any]) -> bool:
+    return entry["status"] in (STATUS_COMPLETED, STATUS_FAILED)
+
+
+# ============================================================================
+# Runner (worker processes)
+# ============================================================================
+
+class BatchLane:
+    """Submits pending requests in bulk and writes finished batches back."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or make_backend()
+        self._last_poll = 0.0
+        self._counters = {"batches_submitted": 0, "requests_submitted": 0, "completed": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def tick(self, force: bool = False) -> None:
+        """Submit a batch if one is due, and poll submitted batches every BATCH_LANE_POLL_SECONDS."""
+        self._recover_stale()
+        self.submit_pending(force=force)
+        if force or time.monotonic() - self._last_poll >= BATCH_LANE_POLL_SECONDS:
+            self._last_poll = time.monotonic()
+            self.poll_submitted()
+            self._prune()
+
+    def submit_pending(self, force: bool = False) -> Optional[str]:
+        """Submit up to BATCH_LANE_MAX_REQUESTS pending requests once a batch is due."""
+        with engine.connect() as conn:
+            count, oldest = conn.execute(
+                select(func.count(), func.min(batch_requests.c.created_at))
+                .where(batch_requests.c.status == STATUS_PENDING)
+            ).one()
+        if not count:
+            return None
+        if not force and count < BATCH_LANE_MIN_REQUESTS and time.time() - oldest < BATCH_LANE_MAX_WAIT_SECONDS:
+            return None
+
+        # Claim the rows with a token, so concurrent runners never submit the same request
+        token = f"claim_{uuid.uuid4().hex}"
+        now = time.time()
+        with engine.begin() as conn:
+            ids = [row.id for row in conn.execute(
+                select(batch_requests.c.id)
+                .where(batch_requests.c.status == STATUS_PENDING)
+                .order_by(batch_requests.c.created_at)
+                .limit(BATCH_LANE_MAX_REQUESTS)
+            )]
+            conn.execute(
+                update(batch_requests)
+                .where(and_(batch_requests.c.id.in_(ids), batch_requests.c.status == STATUS_PENDING))
+                .values(status=STATUS_SUBMITTING, batch_id=token, updated_at=now)
+            )
+            claimed = conn.execute(
+                select(batch_requests.c.id, batch_requests.c.request).where(batch_requests.c.batch_id == token)
+            ).all()
+        if not claimed:
+            return None
+
+        try:
+            batch_id = self.backend.submit([(row.id, json.loads(row.request)) for row in claimed])
+        except Exception as e:
+            logger.warning(f"[batch] Submitting {len(claimed)} requests failed, will retry: {e}")
+            with engine.begin() as conn:
+                conn.execute(
+                    update(batch_requests).where(batch_requests.c.batch_id == token)
+                    .values(status=STATUS_PENDING, batch_id=None, updated_at=time.time())
+                )
+            return None
+
+        with engine.begin() as conn:
+            conn.execute(
+                update(batch_requests).where(batch_requests.c.batch_id == token)
+                .values(status=STATUS_SUBMITTED, batch_id=batch_id, updated_at=time.time())
+            )
+        with self._lock:
+            self._counters["batches_submitted"] += 1
+            self._counters["requests_submitted"] += len(claimed)
+        logger.info(f"[batch] Submitted batch {batch_id} with {len(claimed)} requests")
+        return batch_id
+
+    def poll_submitted(self) -> None:
+        """Write back the results of every submitted batch that has finished."""
+        with engine.connect() as conn:
+            batch_ids = [row.batch_id for row in conn.execute(
+                select(batch_requests.c.batch_id).where(batch_requests.c.status == STATUS_SUBMITTED).distinct()
+            )]
+        for batch_id in batch_ids:
+            try:
+                results = self.backend.poll(batch_id)
+            except Exception as e:
+                logger.warning(f"[batch] Polling batch {batch_id} failed: {e}")
+                continue
+            if results is not None:
+                self._store_results(batch_id, results)
+
+    def _store_results(self, batch_id: str, results: Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]]) -> None:
+        now = time.time()
+        completed = failed = 0
+        with engine.begin() as conn:
+            ids = [row.id for row in conn.execute(
+                select(batch_requests.c.id).where(and_(
+                    batch_requests.c.batch_id == batch_id, batch_requests.c.status == STATUS_SUBMITTED
+                ))
+            )]
+            for request_id in ids:
+                body, error = results.get(request_id, (None, "Missing from batch results"))
+                if body is not None:
+                    values = {"status": STATUS_COMPLETED, "response": json.dumps(body)}
+                    completed += 1
+                else:
+                    values = {"status": STATUS_FAILED, "error": (error or "")[:2000]}
+                    failed += 1
+                conn.execute(
+                    update(batch_requests).where(batch_requests.c.id == request_id).values(updated_at=now, **values)
+                )
+        with self._lock:
+            self._counters["completed"] += completed
+            self._counters["failed"] += failed
+        logger.info(f"[batch] Batch {batch_id} finished: {completed} completed, {failed} failed")
+
+    def _recover_stale(self) -> None:
+        # A runner that died mid-submit leaves rows claimed; they are submitted again
+        with engine.begin() as conn:
+            conn.execute(
+                update(batch_requests)
+                .where(and_(batch_requests.c.status == STATUS_SUBMITTING,
+                            batch_requests.c.updated_at < time.time() - SUBMIT_TIMEOUT_SECONDS))
+                .values(status=STATUS_PENDING, batch_id=None, updated_at=time.time())
+            )
+
+    def _prune(self) -> None:
+        with engine.begin() as conn:
+            conn.execute(
+                delete(batch_requests).where(and_(
+                    batch_requests.c.status.in_((STATUS_COMPLETED, STATUS_FAILED)),
+                    batch_requests.c.updated_at < time.time() - BATCH_LANE_RETENTION_SECONDS,
+                ))
+            )
+
+    def run_forever(self, stop: threading.Event, interval: float = 5.0) -> None:
+        logger.info(f"[batch] Batch lane runner started (backend={type(self.backend).__name__})")
+        while not stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning(f"[batch] Batch lane tick failed: {e}")
+            stop.wait(interval)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+_lane: Optional[BatchLane] = None
+_lane_stop = threading.Event()
+_lane_lock = threading.Lock()
+
+
+def start_runner() -> Optional[BatchLane]:
+    """Start this process's batch lane runner thread (once), if the lane is enabled."""
+    global _lane
+    if not BATCH_LANE_ENABLED:
+        return None
+    with _lane_lock:
+        if _lane is None:
+            _lane = BatchLane()
+            threading.Thread(target=_lane.run_forever, args=(_lane_stop,), name="batch-lane", daemon=True).start()
+    return _lane
+
+
+def stop_runner() -> None:
+    _lane_stop.set()
+
+
+def get_stats() -> Dict[str, Any]:
+    with engine.connect() as conn:
+        by_status = dict(conn.execute(
+            select(batch_requests.c.status, func.count()).group_by(batch_requests.c.status)
+        ).all())
+    return {
+        "enabled": BATCH_LANE_ENABLED,
+        "backend": BATCH_LANE_BACKEND,
+        "requests": by_status,
+        "runner": _lane.snapshot() if _lane else None,
+    }
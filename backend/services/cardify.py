@@ -4,9 +4,11 @@ and selecting key points for flashcard generation.
 """
 import re
 import json
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 from collections import defaultdict
 
+from services import dedup_index, span_align
+
 def merge_small_segments(segments: List[Dict], max_gap: float = 1.2) -> List[Dict]:
     """
     Merge segments that are close together in time.
@@ -179,52 +181,48 @@ def prepare_excerpts_for_llm(windows: List[Dict]) -> str:
     
     return json.dumps(excerpts, indent=2)
 
-def deduplicate_cards(cards: List[Dict]) -> List[Dict]:
+def deduplicate_cards(cards: List[Dict], session: Optional[dedup_index.DedupSession] = None,
+                      limit: Optional[int] = None) -> List[Dict]:
     """
-    Remove duplicate or very similar cards based on Jaccard similarity of answers.
+    Remove near-duplicate cards (front + back) with the MinHash/LSH dedup index.
+    With a session for a user's deck, cards are also checked against the user's
+    other decks; commit the session once the kept cards (at most `limit`) are saved.
     """
-    if len(cards) <= 1:
-        return cards
-    
-    def jaccard_similarity(text1: str, text2: str) -> float:
-        """Calculate Jaccard similarity between two texts."""
-        words1 = set(text1.lower().split())
-        words2 = set(text2.lower().split())
-        
-        if not words1 and not words2:
-            return 1.0
-        if not words1 or not words2:
-            return 0.0
+    if session is None:
+        session = dedup_index.DedupSession(None, None)
+    return dedup_index.filter_cards(session, cards, question_key='front', answer_key='back', limit=limit)
+
+def align_card_evidence(cards: List[Dict], windows: List[Dict]) -> List[Dict]:
+    """
+    Align each card's evidence quote back to the transcript windows.
+    An aligned quote is replaced by the exact transcript text and the card's
+    timestamps are interpolated from its position in the window; a quote
+    that matches no window is cleared.
+    """
+    tokenized = [span_align.TokenizedText(window['text']) for window in windows]
+    for card in cards:
+        evidence = card.get('evidence')
+        if not evidence:
+            continue
         
-        intersection = len(words1.intersection(words2))
-        union = len(words1.union(words2))
+        best = None
+        for window, text in zip(windows, tokenized):
+            alignment = span_align.align(evidence, text)
+            if alignment and (best is None or alignment.score > best[1].score):
+                best = (window, alignment)
         
-        return intersection / union if union > 0 else 0.0
-    
-    deduplicated = []
-    used_indices = set()
-    
-    for i, card in enumerate(cards):
-        if i in used_indices:
+        if best is None:
+            card['evidence'] = None
             continue
         
-        # Check similarity with remaining cards
-        is_duplicate = False
-        for j, other_card in enumerate(cards[i+1:], i+1):
-            if j in used_indices:
-                continue
-            
-            similarity = jaccard_similarity(card.get('back', ''), other_card.get('back', ''))
-            if similarity > 0.7:  # 70% similarity threshold
-                is_duplicate = True
-                used_indices.add(j)
-                break
-        
-        if not is_duplicate:
-            deduplicated.append(card)
-            used_indices.add(i)
+        window, alignment = best
+        length = max(1, len(window['text']))
+        duration = window['end'] - window['start']
+        card['evidence'] = window['text'][alignment.start:alignment.end]
+        card['start_s'] = round(window['start'] + duration * alignment.start / length, 2)
+        card['end_s'] = round(window['start'] + duration * alignment.end / length, 2)
     
-    return deduplicated
+    return cards
 
 def truncate_answer(answer: str, max_words: int = 45) -> str:
     """Truncate answer to maximum word count."""
@@ -0,0 +1,315 @@
+"""
+Content-Addressed Index for Uploaded PDFs
+
+Maps the SHA-256 of a PDF's bytes to the work already done for it:
+- generated flashcards
+- generated summary (sentences + citations)
+
+The extracted text is not kept here: text_cache stores it as an on-disk
+artifact under the same content hash.
+
+Byte-identical re-uploads can then clone an existing deck instead of running
+PDF extraction and a full OpenAI generation again.
+
+Uses the app's SQLite database (via db/sqlite_engine) for persistence. When
+the app runs on Postgres the index falls back to in-memory storage (per process).
+"""
+
+import os
+import json
+import hashlib
+import logging
+from threading import Lock
+from typing import Optional, Dict, List, Any
+
+from db import sqlite_engine
+
+logger = logging.getLogger(__name__)
+
+# Database path
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///pdf_flashcards.db")
+
+# Placeholder used to store chunk ids independently of the source they came from
+SOURCE_PLACEHOLDER = "{source_id}"
+
+
+# ============================================================================
+# Hit/Miss Counters
+# ============================================================================
+
+class ContentIndexStats:
+    """Process-local hit/miss counters for the content index."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.forced = 0
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record_forced(self):
+        with self._lock:
+            self.forced += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "forced_regenerations": self.forced,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_stats = ContentIndexStats()
+
+# In-memory fallback when SQLite is not the primary database
+_memory_entries: Dict[str, Dict[str, Any]] = {}
+_memory_hashes: Dict[str, str] = {}
+_memory_lock = Lock()
+
+
+# ============================================================================
+# Database Operations
+# ============================================================================
+
+# For Postgres, fall back to in-memory only
+USE_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+def _create_tables(conn) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS content_index (
+            content_hash TEXT PRIMARY KEY,
+            source_pdf_id TEXT,
+            flashcards_json TEXT,
+            summary_json TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_content_hashes (
+            pdf_id TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL
+        )
+    """)
+    # Earlier schemas had a `text` column that was never written
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(content_index)")}
+    if "text" in columns:
+        conn.execute("ALTER TABLE content_index DROP COLUMN text")
+
+
+def init_db() -> None:
+    """Initialize content index tables if using SQLite (called at startup, see db/schema.py)."""
+    try:
+        if USE_SQLITE:
+            sqlite_engine.run_write(_create_tables)
+    except Exception as e:
+        logger.warning(f"Could not initialize content index tables: {e}")
+
+
+# ============================================================================
+# Hashing Helpers
+# ============================================================================
+
+def compute_file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Compute the SHA-256 of a file without loading it into memory."""
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def record_pdf_hash(pdf_id: str, content_hash: str) -> None:
+    """Remember which content hash belongs to an uploaded PDF."""
+    if not USE_SQLITE:
+        with _memory_lock:
+            _memory_hashes[pdf_id] = content_hash
+        return
+    try:
+        sqlite_engine.execute_write(
+            "INSERT OR REPLACE INTO pdf_content_hashes (pdf_id, content_hash) VALUES (?, ?)",
+            (pdf_id, content_hash),
+        )
+    except Exception as e:
+        logger.warning(f"Failed to record content hash for PDF {pdf_id}: {e}")
+
+
+def get_pdf_hash(pdf_id: str, file_path: Optional[str] = None) -> Optional[str]:
+    """
+    Get the content hash of an uploaded PDF.
+
+    Falls back to hashing `file_path` (and recording the result) for PDFs
+    uploaded before the hash was stored at upload time.
+    """
+    content_hash = None
+    if not USE_SQLITE:
+        with _memory_lock:
+            content_hash = _memory_hashes.get(pdf_id)
+    else:
+        try:
+            row = sqlite_engine.fetch_one(
+                "SELECT content_hash FROM pdf_content_hashes WHERE pdf_id = ?", (pdf_id,)
+            )
+            content_hash = row[0] if row else None
+        except Exception as e:
+            logger.warning(f"Failed to read content hash for PDF {pdf_id}: {e}")
+
+    if content_hash is None and file_path and os.path.exists(file_path):
+        content_hash = compute_file_hash(file_path)
+        record_pdf_hash(pdf_id, content_hash)
+
+    return content_hash
+
+
+# ============================================================================
+# Index Lookups and Writes
+# ============================================================================
+
+def _row_to_entry(row) -> Dict[str, Any]:
+    content_hash, source_pdf_id, flashcards_json, summary_json = row
+    return {
+        "content_hash": content_hash,
+        "source_pdf_id": source_pdf_id,
+        "flashcards": json.loads(flashcards_json) if flashcards_json else None,
+        "summary": json.loads(summary_json) if summary_json else None,
+    }
+
+
+def get_entry(content_hash: str) -> Optional[Dict[str, Any]]:
+    """Read an index entry without touching the hit/miss counters."""
+    if not content_hash:
+        return None
+    if not USE_SQLITE:
+        with _memory_lock:
+            entry = _memory_entries.get(content_hash)
+            return dict(entry) if entry else None
+    try:
+        row = sqlite_engine.fetch_one(
+            "SELECT content_hash, source_pdf_id, flashcards_json, summary_json "
+            "FROM content_index WHERE content_hash = ?",
+            (content_hash,),
+        )
+        return _row_to_entry(row) if row else None
+    except Exception as e:
+        logger.warning(f"Content index read failed for {content_hash[:12]}: {e}")
+        return None
+
+
+def lookup_flashcards(content_hash: str, force_regenerate: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Look up a previously generated deck for identical PDF bytes.
+
+    Args:
+        content_hash: SHA-256 of the PDF bytes
+        force_regenerate: Skip the index and count the lookup as forced
+
+    Returns:
+        The index entry if it has flashcards, otherwise None
+    """
+    if force_regenerate:
+        _stats.record_forced()
+        return None
+
+    entry = get_entry(content_hash)
+    hit = bool(entry and entry.get("flashcards"))
+    _stats.record(hit)
+
+    stats = _stats.snapshot()
+    logger.info(
+        f"Content index {'hit' if hit else 'miss'} for {str(content_hash)[:12]} "
+        f"(hit_ratio={stats['hit_ratio']}, hits={stats['hits']}, misses={stats['misses']})"
+    )
+    return entry if hit else None
+
+
+def _upsert(content_hash: str, **fields) -> None:
+    """Insert or update selected columns of an index entry."""
+    if not USE_SQLITE:
+        with _memory_lock:
+            entry = _memory_entries.setdefault(content_hash, {
+                "content_hash": content_hash,
+                "source_pdf_id": None,
+                "flashcards": None,
+                "summary": None,
+            })
+            for key, value in fields.items():
+                entry[key.replace("_json", "")] = json.loads(value) if key.endswith("_json") and value else value
+        return
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+
+    def write(conn):
+        conn.execute(
+            "INSERT OR IGNORE INTO content_index (content_hash) VALUES (?)",
+            (content_hash,),
+        )
+        conn.execute(
+            f"UPDATE content_index SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE content_hash = ?",
+            (*fields.values(), content_hash),
+        )
+
+    try:
+        sqlite_engine.run_write(write)
+    except Exception as e:
+        logger.warning(f"Content index write failed for {content_hash[:12]}: {e}")
+
+
+def store_flashcards(content_hash: str, pdf_id: str, flashcards: List[Dict[str, str]]) -> None:
+    """Store the generated flashcards for a content hash."""
+    if not content_hash:
+        return
+    _upsert(
+        content_hash,
+        source_pdf_id=pdf_id,
+        flashcards_json=json.dumps(flashcards),
+    )
+
+
+def store_summary(content_hash: str, source_id: str, sentences_data: List[Dict[str, Any]]) -> None:
+    """
+    Store a built summary for a content hash.
+
+    Chunk ids embed the source id (`{source_id}_chunk_{i}`); they are stored
+    with a placeholder so the summary can be cloned onto another source.
+    """
+    if not content_hash:
+        return
+    portable = []
+    for sentence in sentences_data:
+        citations = []
+        for citation in sentence.get("citations", []):
+            citation = dict(citation)
+            citation["chunk_id"] = str(citation["chunk_id"]).replace(source_id, SOURCE_PLACEHOLDER, 1)
+            citations.append(citation)
+        portable.append({**sentence, "citations": citations})
+    _upsert(content_hash, summary_json=json.dumps(portable))
+
+
+def summary_for_source(entry: Dict[str, Any], source_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Rebind a stored summary's chunk ids to `source_id`."""
+    summary = entry.get("summary") if entry else None
+    if not summary:
+        return None
+    rebound = []
+    for sentence in summary:
+        citations = []
+        for citation in sentence.get("citations", []):
+            citation = dict(citation)
+            citation["chunk_id"] = citation["chunk_id"].replace(SOURCE_PLACEHOLDER, source_id, 1)
+            citations.append(citation)
+        rebound.append({**sentence, "citations": citations})
+    return rebound
+
+
+def get_stats() -> Dict[str, Any]:
+    """Return hit/miss counters for this process."""
+    return _stats.snapshot()
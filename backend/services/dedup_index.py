@@ -0,0 +1,343 @@
+"""
+Near-Duplicate Card Index (MinHash/LSH)
+
+`cardify.deduplicate_cards` used to compare every pair of cards in one
+generation batch, re-tokenizing both answers per pair (O(n^2)). This index
+finds near-duplicates in roughly constant time per card, within a deck and
+across all of a user's decks:
+
+- Each card (question + answer) becomes a set of word tokens and a MinHash
+  signature of DEDUP_NUM_PERM permutations
+- The signature is split into DEDUP_BANDS bands; cards sharing any band
+  bucket are candidates (locality-sensitive hashing), so a lookup touches a
+  handful of cards instead of the whole library
+- Candidates are confirmed with the exact token Jaccard >= DEDUP_THRESHOLD
+
+A generation path opens a `DedupSession` for the deck it is writing, calls
+`add` for every card (False means drop it) or `filter_cards` for a list of
+cards, and `commit` once the deck is saved, which replaces the deck's
+entries in the index. `deduplicate` does all of it for a list of cards whose
+deck is saved afterwards only on a best-effort basis.
+
+Index entries belong to a (user, deck) pair: a deck id can be shared by
+several users (YouTube decks use the video id), and one user's regeneration
+or deletion must not touch another user's entries.
+
+Uses the app's SQLite database (via db/sqlite_engine) for persistence. When
+the app runs on Postgres the index falls back to in-memory storage (per process).
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from db import sqlite_engine
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///pdf_flashcards.db")
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.7"))
+DEDUP_CROSS_DECK = os.getenv("DEDUP_CROSS_DECK", "true").lower() == "true"
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16  # 4 rows per band: pairs at Jaccard 0.7 collide in some band ~99% of the time
+
+# Signatures from different parameters are not comparable; bump on change
+_SIGNATURE_SEED = 20240601
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+_rng = np.random.RandomState(_SIGNATURE_SEED)
+_PERM_A = _rng.randint(1, 1 << 31, size=DEDUP_NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=DEDUP_NUM_PERM).astype(np.uint64)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# For Postgres, fall back to in-memory only
+USE_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+# ============================================================================
+# MinHash
+# ============================================================================
+
+def tokenize(text: str) -> Set[str]:
+    return set(_TOKEN_RE.findall(text.lower()))
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _token_hashes(tokens: Iterable[str]) -> np.ndarray:
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest(), "little") for token in tokens],
+        dtype=np.uint64,
+    )
+
+
+def signature(tokens: Set[str]) -> np.ndarray:
+    """MinHash signature (DEDUP_NUM_PERM values) of a token set."""
+    if not tokens:
+        return np.full(DEDUP_NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    hashes = _token_hashes(sorted(tokens))
+    # (a*x + b) mod p for every permutation and token at once; min over tokens
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0)
+
+
+def band_keys(sig: np.ndarray) -> List[int]:
+    """One signed 64-bit bucket key per band (band index is part of the key)."""
+    rows = DEDUP_NUM_PERM // DEDUP_BANDS
+    keys = []
+    for band in range(DEDUP_BANDS):
+        digest = hashlib.blake2b(
+            band.to_bytes(2, "little") + sig[band * rows:(band + 1) * rows].tobytes(), digest_size=8
+        ).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+
+def card_text(card: Dict[str, Any], question_key: str = "question", answer_key: str = "answer") -> str:
+    return f"{card.get(question_key) or ''} {card.get(answer_key) or ''}"
+
+
+# ============================================================================
+# Storage
+# ============================================================================
+
+def _create_tables(conn) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dedup_cards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            deck_id TEXT NOT NULL,
+            tokens TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dedup_bands (
+            user_id TEXT NOT NULL,
+            band_key INTEGER NOT NULL,
+            card_id INTEGER NOT NULL
+        )
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_dedup_cards_deck")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dedup_cards_user_deck ON dedup_cards (user_id, deck_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dedup_bands_lookup ON dedup_bands (user_id, band_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dedup_bands_card ON dedup_bands (card_id)")
+
+
+def init_db() -> None:
+    """Initialize dedup index tables if using SQLite (called at startup, see db/schema.py)."""
+    try:
+        if USE_SQLITE:
+            sqlite_engine.run_write(_create_tables)
+    except Exception as e:
+        logger.warning(f"Could not initialize dedup index tables: {e}")
+
+
+# In-memory fallback when SQLite is not the primary database
+_memory_cards: Dict[int, Tuple[str, str, Set[str]]] = {}  # card id -> (user_id, deck_id, tokens)
+_memory_bands: Dict[Tuple[str, int], Set[int]] = {}
+_memory_next_id = 0
+_memory_lock = Lock()
+
+
+def _candidates(user_id: str, keys: Sequence[int], exclude_decks: Set[str]) -> List[Set[str]]:
+    """Token sets of the user's indexed cards sharing a band bucket with `keys`."""
+    if USE_SQLITE:
+        placeholders = ",".join("?" * len(keys))
+        rows = sqlite_engine.fetch_all(
+            f"SELECT DISTINCT c.deck_id, c.tokens FROM dedup_bands b JOIN dedup_cards c ON c.id = b.card_id "
+            f"WHERE b.user_id = ? AND c.user_id = b.user_id AND b.band_key IN ({placeholders})",
+            (user_id, *keys),
+        )
+        return [set(tokens.split()) for deck_id, tokens in rows if deck_id not in exclude_decks]
+
+    with _memory_lock:
+        card_ids: Set[int] = set()
+        for key in keys:
+            card_ids |= _memory_bands.get((user_id, key), set())
+        return [
+            tokens for card_id in card_ids
+            for _, deck_id, tokens in [_memory_cards[card_id]] if deck_id not in exclude_decks
+        ]
+
+
+def _replace_deck(user_id: str, deck_id: str, entries: List[Tuple[Set[str], List[int]]]) -> None:
+    """Replace the user's indexed cards of a deck with `entries` of (tokens, band keys)."""
+    global _memory_next_id
+    if USE_SQLITE:
+        def write(conn):
+            conn.execute(
+                "DELETE FROM dedup_bands WHERE user_id = ? AND card_id IN "
+                "(SELECT id FROM dedup_cards WHERE user_id = ? AND deck_id = ?)",
+                (user_id, user_id, deck_id),
+            )
+            conn.execute("DELETE FROM dedup_cards WHERE user_id = ? AND deck_id = ?", (user_id, deck_id))
+            now = time.time()
+            for tokens, keys in entries:
+                card_id = conn.execute(
+                    "INSERT INTO dedup_cards (user_id, deck_id, tokens, created_at) VALUES (?, ?, ?, ?)",
+                    (user_id, deck_id, " ".join(sorted(tokens)), now),
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO dedup_bands (user_id, band_key, card_id) VALUES (?, ?, ?)",
+                    [(user_id, key, card_id) for key in keys],
+                )
+        sqlite_engine.run_write(write)
+        return
+
+    with _memory_lock:
+        stale = [
+            card_id for card_id, (owner, deck, _) in _memory_cards.items() if owner == user_id and deck == deck_id
+        ]
+        for card_id in stale:
+            del _memory_cards[card_id]
+            for bucket_key in [k for k in _memory_bands if k[0] == user_id]:
+                _memory_bands[bucket_key].discard(card_id)
+        for tokens, keys in entries:
+            _memory_next_id += 1
+            _memory_cards[_memory_next_id] = (user_id, deck_id, tokens)
+            for key in keys:
+                _memory_bands.setdefault((user_id, key), set()).add(_memory_next_id)
+
+
+# ============================================================================
+# Sessions
+# ============================================================================
+
+class DedupSession:
+    """
+    Near-duplicate filter for the cards of one deck as they are generated.
+
+    Args:
+        user_id: Owner; None (or anonymous) only deduplicates within the deck
+        deck_id: Deck being written; its previously indexed cards are ignored
+            (they are being replaced) and replaced on commit
+        exclude_decks: Other decks not to compare against (e.g. the deck a save copies)
+        threshold: Token Jaccard at or above which a card is a duplicate
+        cross_deck: Also compare against the user's other decks
+    """
+
+    def __init__(
+        self,
+        user_id: Optional[str],
+        deck_id: Optional[str],
+        exclude_decks: Iterable[str] = (),
+        threshold: float = DEDUP_THRESHOLD,
+        cross_deck: bool = DEDUP_CROSS_DECK,
+    ):
+        self.user_id = user_id if user_id and user_id != "anonymous" else None
+        self.deck_id = deck_id
+        self.threshold = threshold
+        self.cross_deck = cross_deck and self.user_id is not None
+        self._exclude = {deck for deck in (deck_id, *exclude_decks) if deck}
+        self._buckets: Dict[int, List[int]] = {}
+        self._kept: List[Tuple[Set[str], List[int]]] = []
+        self.dropped_in_deck = 0
+        self.dropped_cross_deck = 0
+
+    def add(self, text: str) -> bool:
+        """Record a card; returns False if it near-duplicates a kept or indexed card."""
+        tokens = tokenize(text)
+        keys = band_keys(signature(tokens))
+
+        seen: Set[int] = set()
+        for key in keys:
+            for index in self._buckets.get(key, ()):
+                if index not in seen:
+                    seen.add(index)
+                    if jaccard(tokens, self._kept[index][0]) >= self.threshold:
+                        self.dropped_in_deck += 1
+                        return False
+
+        if self.cross_deck:
+            try:
+                for other in _candidates(self.user_id, keys, self._exclude):
+                    if jaccard(tokens, other) >= self.threshold:
+                        self.dropped_cross_deck += 1
+                        return False
+            except Exception as e:
+                # Deduplication must never fail a generation
+                logger.warning(f"Dedup index lookup failed: {e}")
+
+        for key in keys:
+            self._buckets.setdefault(key, []).append(len(self._kept))
+        self._kept.append((tokens, keys))
+        return True
+
+    def commit(self) -> None:
+        """Index the kept cards under the deck (replacing its previous cards)."""
+        if self.dropped_in_deck or self.dropped_cross_deck:
+            logger.info(
+                f"[dedup] deck={self.deck_id}: kept {len(self._kept)}, dropped {self.dropped_in_deck} in-deck "
+                f"and {self.dropped_cross_deck} cross-deck near-duplicates"
+            )
+        if self.user_id is None or not self.deck_id:
+            return
+        if not self._kept:
+            # Nothing is stored in that case, so the deck keeps its previous cards and entries
+            return
+        try:
+            _replace_deck(self.user_id, self.deck_id, self._kept)
+        except Exception as e:
+            logger.warning(f"Failed to index deck {self.deck_id} for deduplication: {e}")
+
+
+def filter_cards(
+    session: DedupSession,
+    cards: List[Dict[str, Any]],
+    question_key: str = "question",
+    answer_key: str = "answer",
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Drop near-duplicate cards (first one wins) and keep at most `limit`; commit the session once they are saved."""
+    kept = []
+    for card in cards:
+        if limit is not None and len(kept) >= limit:
+            break
+        if session.add(card_text(card, question_key, answer_key)):
+            kept.append(card)
+    return kept
+
+
+def deduplicate(
+    cards: List[Dict[str, Any]],
+    user_id: Optional[str] = None,
+    deck_id: Optional[str] = None,
+    question_key: str = "question",
+    answer_key: str = "answer",
+    exclude_decks: Iterable[str] = (),
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Drop near-duplicate cards (first one wins), keep at most `limit`, and index them under `deck_id` right away."""
+    session = DedupSession(user_id, deck_id, exclude_decks=exclude_decks)
+    kept = filter_cards(session, cards, question_key, answer_key, limit)
+    session.commit()
+    return kept
+
+
+def remove_deck(user_id: str, deck_id: str) -> None:
+    """Forget the user's indexed cards of a deleted deck, so they stop suppressing new cards."""
+    _replace_deck(user_id, deck_id, [])
+
+
+def index_deck(user_id: Optional[str], deck_id: str, cards: List[Dict[str, Any]]) -> None:
+    """Index a deck as is (e.g. a cloned deck), without dropping anything."""
+    session = DedupSession(user_id, deck_id, cross_deck=False, threshold=float("inf"))
+    for card in cards:
+        session.add(card_text(card))
+    session.commit()
@@ -0,0 +1,354 @@
+"""
+Embedding Store
+
+Dense vectors for semantic retrieval. Summary citations were scored on word
+overlap only, so a sentence that paraphrases its source came back
+"insufficient"; with an embedding backend configured they are scored by
+embedding cosine instead (services/retrieval_index.py stays the fallback).
+
+- Pluggable backends: OpenAI embeddings (batched through the LLM gateway)
+  or a local deterministic hashed-feature stand-in for tests and offline use
+- One float32 matrix per source content (content hash + chunk fingerprint),
+  saved under uploads/embeddings/<backend>/ and loaded memory-mapped
+  (services/index_store.py, shared with retrieval_index)
+- Exact brute-force top-k, or an IVF index (spherical k-means lists, probing
+  the nearest EMBEDDING_IVF_NPROBE lists) once a matrix reaches
+  EMBEDDING_IVF_MIN_VECTORS rows
+
+`VectorIndex` and `embed` are not tied to chunks and can index cards the same way.
+See benchmarks/embedding_search.py for search latency at 10k and 100k vectors.
+"""
+
+import os
+import re
+import zlib
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from services import llm_gateway
+from services.index_store import IndexCache, load_index_dir, save_index_dir
+from services.retrieval_index import chunks_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "off").lower()  # off | openai | local
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))  # matches card_embeddings.embedding
+EMBEDDING_LOCAL_DIMENSIONS = int(os.getenv("EMBEDDING_LOCAL_DIMENSIONS", "256"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "32"))
+EMBEDDING_IVF_MIN_VECTORS = int(os.getenv("EMBEDDING_IVF_MIN_VECTORS", "20000"))
+EMBEDDING_IVF_NPROBE = int(os.getenv("EMBEDDING_IVF_NPROBE", "8"))
+EMBEDDING_IVF_ITERATIONS = 8
+EMBEDDING_IVF_TRAIN_PER_LIST = 64  # k-means trains on a sample of this many vectors per list
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
+EMBEDDING_STORE_DIR = Path(os.getenv("EMBEDDING_STORE_DIR", str(UPLOAD_DIR / "embeddings")))
+
+# Saved indexes from another format version are rebuilt
+INDEX_VERSION = 1
+
+# Output size of OpenAI embedding models that do not take `dimensions`
+_FIXED_DIMENSIONS = {"text-embedding-ada-002": 1536}
+
+_IVF_SEED = 1234
+_ASSIGN_BLOCK_ROWS = 16384  # bounds the (rows x lists) score block during k-means
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# ============================================================================
+# Backends
+# ============================================================================
+
+class OpenAIEmbeddingBackend:
+    """OpenAI embeddings, EMBEDDING_BATCH_SIZE inputs per request."""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.model = model
+        # Only text-embedding-3 models can be shortened; older ones have one fixed size
+        self.shortenable = model.startswith("text-embedding-3")
+        self.dimensions = dimensions if self.shortenable else _FIXED_DIMENSIONS.get(model, dimensions)
+        self.name = f"openai-{model}-{self.dimensions}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            # The API rejects empty inputs
+            batch = [text if text.strip() else " " for text in texts[start:start + EMBEDDING_BATCH_SIZE]]
+            request = dict(model=self.model, input=batch)
+            if self.shortenable:
+                # The pinned openai client predates its `dimensions` argument, so it goes in the body
+                request["extra_body"] = {"dimensions": self.dimensions}
+            response = llm_gateway.embeddings(**request)
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+            _stats.incr("batches")
+        return np.array(vectors, dtype=np.float32).reshape(len(texts), self.dimensions)
+
+
+class LocalEmbeddingBackend:
+    """
+    Deterministic stand-in: signed feature hashing of words and character
+    trigrams. No network or key; trigrams let inflections ("produces",
+    "produced") land near each other, which is enough for tests.
+    """
+
+    def __init__(self, dimensions: int = EMBEDDING_LOCAL_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f"local-{dimensions}"
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for word in _TOKEN_RE.findall(text.lower()):
+            features.append(word)
+            padded = f"<{word}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        _stats.incr("batches")
+        return vectors
+
+
+def make_backend(name: str = EMBEDDING_BACKEND):
+    """The backend for EMBEDDING_BACKEND, or None when embeddings are off."""
+    if name == "openai":
+        return OpenAIEmbeddingBackend()
+    if name == "local":
+        return LocalEmbeddingBackend()
+    if name not in ("", "off"):
+        logger.warning(f"Unknown EMBEDDING_BACKEND={name!r}, embeddings disabled")
+    return None
+
+
+_backend = make_backend()
+
+
+def is_enabled() -> bool:
+    return _backend is not None
+
+
+def embed(texts: Sequence[str], backend=None) -> np.ndarray:
+    """Unit-length float32 embeddings, shape (len(texts), dimensions)."""
+    backend = backend or _backend
+    if backend is None:
+        raise RuntimeError("No embedding backend configured (set EMBEDDING_BACKEND)")
+    _stats.incr("embedded_texts", len(texts))
+    return _normalize(backend.embed(list(texts)))
+
+
+# ============================================================================
+# Vector index
+# ============================================================================
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _ASSIGN_BLOCK_ROWS):
+        block = vectors[start:start + _ASSIGN_BLOCK_ROWS]
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+def _train_centroids(vectors: np.ndarray, n_lists: int) -> np.ndarray:
+    """Spherical k-means on a sample of the vectors."""
+    rng = np.random.RandomState(_IVF_SEED)
+    sample_size = min(len(vectors), n_lists * EMBEDDING_IVF_TRAIN_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+    for _ in range(EMBEDDING_IVF_ITERATIONS):
+        assignment = _assign(sample, centroids)
+        members = sparse.csr_matrix(
+            (np.ones(sample_size, dtype=np.float32), (assignment, np.arange(sample_size))), shape=(n_lists, sample_size)
+        )
+        sums = np.asarray(members @ sample)
+        empty = np.asarray(members.sum(axis=1)).ravel() == 0
+        sums[empty] = centroids[empty]  # keep the old centroid of an empty list
+        centroids = _normalize(sums)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Top-k cosine search over unit-length float32 vectors.
+
+    With IVF, rows are stored grouped by list (list i is rows
+    offsets[i]:offsets[i + 1]) and `ids` maps a row back to its original position.
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        fingerprint: str = "",
+        centroids: Optional[np.ndarray] = None,
+        offsets: Optional[np.ndarray] = None,
+        ids: Optional[np.ndarray] = None,
+    ):
+        self.vectors = vectors
+        self.fingerprint = fingerprint
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def is_ivf(self) -> bool:
+        return self.centroids is not None
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, fingerprint: str = "", ivf: Optional[bool] = None) -> "VectorIndex":
+        """Index `vectors` (normalized here); IVF by default from EMBEDDING_IVF_MIN_VECTORS rows."""
+        vectors = _normalize(vectors)
+        if ivf is None:
+            ivf = len(vectors) >= EMBEDDING_IVF_MIN_VECTORS
+        if not ivf or len(vectors) < 2:
+            return cls(vectors, fingerprint)
+
+        n_lists = max(1, int(np.sqrt(len(vectors))))
+        centroids = _train_centroids(vectors, n_lists)
+        assignment = _assign(vectors, centroids)
+        ids = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=n_lists))
+        return cls(np.ascontiguousarray(vectors[ids]), fingerprint, centroids, offsets, ids)
+
+    def search(self, queries: np.ndarray, top_k: int, n_probe: int = EMBEDDING_IVF_NPROBE) -> List[List[Tuple[int, float]]]:
+        """Top `top_k` (original row, cosine) per query row, best first."""
+        queries = _normalize(np.atleast_2d(queries))
+        if not len(self.vectors):
+            return [[] for _ in queries]
+
+        if not self.is_ivf:
+            scores = queries @ self.vectors.T
+            return [[(int(i), float(row[i])) for i in _top_k(row, top_k)] for row in scores]
+
+        results = []
+        list_scores = queries @ self.centroids.T
+        for query, query_list_scores in zip(queries, list_scores):
+            probed = _top_k(query_list_scores, n_probe)
+            rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in probed])
+            scores = self.vectors[rows] @ query
+            top = _top_k(scores, top_k)
+            results.append([(int(self.ids[rows[i]]), float(scores[i])) for i in top])
+        return results
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: Path) -> None:
+        arrays = {"vectors": self.vectors}
+        if self.is_ivf:
+            arrays.update(centroids=self.centroids, offsets=self.offsets, ids=self.ids)
+        save_index_dir(path, arrays, {"fingerprint": self.fingerprint, "ivf": self.is_ivf}, INDEX_VERSION)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["VectorIndex"]:
+        """Memory-map a saved index, or None if missing or from another version."""
+        saved = load_index_dir(path, INDEX_VERSION)
+        if saved is None:
+            return None
+        meta, arrays = saved
+        if not meta.get("ivf"):
+            return cls(arrays["vectors"], meta["fingerprint"])
+        return cls(
+            arrays["vectors"],
+            meta["fingerprint"],
+            np.asarray(arrays["centroids"]),
+            np.asarray(arrays["offsets"]),
+            arrays["ids"],
+        )
+
+
+# ============================================================================
+# Per-source indexes
+# ============================================================================
+
+class EmbeddingStats:
+    """Embedding counters for this process. Thread-safe."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {"embedded_texts": 0, "batches": 0}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+# Global stats instance
+_stats = EmbeddingStats()
+
+_indexes: IndexCache[VectorIndex] = IndexCache(EMBEDDING_CACHE_SIZE, "embedding index")
+
+
+def get_index(texts: Sequence[str], key: Optional[str], backend=None) -> VectorIndex:
+    """
+    The vector index over `texts` (e.g. a source's chunks, in order), embedding
+    them on first use.
+
+    Args:
+        key: Stable id of the content (a source's content hash); None embeds
+            into a throwaway index that is neither cached nor saved
+        backend: Embedding backend (default: EMBEDDING_BACKEND)
+    """
+    backend = backend or _backend
+    if backend is None:
+        raise RuntimeError("No embedding backend configured (set EMBEDDING_BACKEND)")
+    fingerprint = chunks_fingerprint(texts)
+    if key is None:
+        _indexes.count_build()
+        return VectorIndex.build(embed(texts, backend), fingerprint)
+
+    return _indexes.get(
+        (backend.name, key, fingerprint), EMBEDDING_STORE_DIR / backend.name / key / fingerprint, fingerprint,
+        VectorIndex.load, lambda: VectorIndex.build(embed(texts, backend), fingerprint),
+    )
+
+
+def search_texts(texts: Sequence[str], key: Optional[str], queries: Sequence[str], top_k: int) -> List[List[Tuple[int, float]]]:
+    """Top `top_k` (position in `texts`, cosine) for every query, one embedding batch for all queries."""
+    if not texts or not queries:
+        return [[] for _ in queries]
+    index = get_index(texts, key)
+    return index.search(embed(queries), top_k)
+
+
+def get_stats() -> Dict[str, Any]:
+    cache = _indexes.stats()
+    return {
+        "backend": _backend.name if _backend else None,
+        "cached_indexes": cache.pop("entries"),
+        **cache,
+        **_stats.snapshot(),
+    }
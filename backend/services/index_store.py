@@ -0,0 +1,118 @@
+"""
+Saved Search Index Store
+
+Persistence shared by the per-source search indexes (retrieval_index for
+BM25, embedding_store for dense vectors):
+
+- An index is a directory of .npy arrays plus meta.json, written to a
+  temporary directory and renamed into place, so readers never see a
+  partial index and concurrent builders keep whichever landed first
+- Loads memory-map the arrays and reject other format versions
+- `IndexCache` keeps an in-process LRU on top, keyed by content and
+  chunk fingerprint, falling back to disk and then to a build
+"""
+
+import os
+import json
+import shutil
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def save_index_dir(path: Path, arrays: Dict[str, np.ndarray], meta: Dict[str, Any], version: int) -> None:
+    """Write `arrays` and `meta` atomically to directory `path` (kept if another process got there first)."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.part")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    for name, array in arrays.items():
+        np.save(tmp_path / f"{name}.npy", array)
+    (tmp_path / "meta.json").write_text(json.dumps({"version": version, **meta}), encoding="utf-8")
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_index_dir(path: Path, version: int) -> Optional[Tuple[Dict[str, Any], Dict[str, np.ndarray]]]:
+    """(meta, memory-mapped arrays by name) of a saved index, or None if missing or from another version."""
+    try:
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != version:
+        return None
+    arrays = {array_path.stem: np.load(array_path, mmap_mode="r") for array_path in path.glob("*.npy")}
+    return meta, arrays
+
+
+class IndexCache(Generic[T]):
+    """In-process LRU of indexes by key, backed by the on-disk copies. Thread-safe."""
+
+    def __init__(self, max_entries: int, label: str = "index"):
+        self._entries: "OrderedDict[Hashable, T]" = OrderedDict()
+        self._max_entries = max_entries
+        self._label = label
+        self._lock = Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "builds": 0}
+
+    def count_build(self) -> None:
+        """Record a throwaway build that bypassed the cache."""
+        with self._lock:
+            self._counters["builds"] += 1
+
+    def get(
+        self,
+        cache_key: Hashable,
+        path: Path,
+        fingerprint: str,
+        load: Callable[[Path], Optional[T]],
+        build: Callable[[], T],
+    ) -> T:
+        """
+        The index for `cache_key`: from memory, else loaded from `path`,
+        else built and saved there.
+
+        Args:
+            fingerprint: Expected `fingerprint` of the index; a saved index
+                with another one is rebuilt
+            load: Reads a saved index (None if missing or outdated)
+            build: Builds the index; the result must have `save(path)`
+        """
+        with self._lock:
+            index = self._entries.get(cache_key)
+            if index is not None:
+                self._entries.move_to_end(cache_key)
+                self._counters["memory_hits"] += 1
+                return index
+
+        index = load(path)
+        if index is not None and index.fingerprint == fingerprint:
+            counter = "disk_hits"
+        else:
+            index = build()
+            counter = "builds"
+            try:
+                index.save(path)
+            except OSError as e:
+                logger.warning(f"Failed to save {self._label} {path}: {e}")
+
+        with self._lock:
+            self._counters[counter] += 1
+            self._entries[cache_key] = index
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), **self._counters}
@@ -0,0 +1,497 @@
+"""
+Durable Job Queue
+
+A persistent `jobs` table shared by every generation flow (PDF flashcards,
+YouTube flashcards, summaries). Jobs survive deploys and crashes:
+
+- Workers claim jobs with a lease and extend it with heartbeats
+- Jobs whose lease expired (worker died) are reclaimed by the next worker
+- Failures are retried with exponential backoff + jitter up to max_attempts
+- Handlers waiting on slow external work (the batch lane) raise JobDeferred:
+  the job goes back to the queue without using an attempt or holding a worker
+- A worker that lost its lease (another worker reclaimed the job) must not
+  write results: handlers call `ensure_lease()` before persisting, which
+  raises JobLeaseLost once the heartbeat noticed
+- API processes only enqueue and read; the number of workers scales separately
+  (see job_worker.py)
+- Single-flight: `enqueue_or_attach` returns the active job with the same
+  dedupe_key instead of queueing the same work twice
+
+Uses SQLAlchemy Core against DATABASE_URL, so it works on SQLite and Postgres.
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+
+from sqlalchemy import (
+    create_engine, MetaData, Table, Column, String, Text, Integer, Float, Index,
+    select, update, and_, or_, exists, literal,
+)
+
+from db import sqlite_engine
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# Configuration (via environment variables)
+# ============================================================================
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///pdf_flashcards.db")
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+
+# Job kinds
+KIND_PDF_FLASHCARDS = "pdf_flashcards"
+KIND_YOUTUBE_FLASHCARDS = "youtube_flashcards"
+KIND_TRANSCRIPT_FLASHCARDS = "transcript_flashcards"
+KIND_SUMMARY = "summary"
+
+# Job statuses
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+
+class JobError(Exception):
+    """
+    Raised by job handlers to fail a job.
+
+    Args:
+        message: Error description stored in last_error
+        retryable: Whether the job may be retried (if attempts remain)
+        result: Optional JSON-serializable payload stored on final failure
+    """
+
+    def __init__(self, message: str, retryable: bool = True, result: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.result = result
+
+
+class JobDeferred(Exception):
+    """
+    Raised by job handlers to release the worker and run the job again later.
+
+    Args:
+        delay: Seconds until the job is runnable again
+        stage: Optional stage recorded while the job waits
+    """
+
+    def __init__(self, delay: float, stage: Optional[str] = None):
+        super().__init__(f"Deferred for {delay:.0f}s")
+        self.delay = delay
+        self.stage = stage
+
+
+class JobLeaseLost(Exception):
+    """Raised by `ensure_lease` when another worker reclaimed the running job."""
+    pass
+
+
+# Set by the worker while a handler runs; set()-ed once the lease is lost
+_current_lease: ContextVar[Optional[threading.Event]] = ContextVar("job_lease_lost", default=None)
+
+
+@contextmanager
+def lease_scope(lost: threading.Event) -> Iterator[threading.Event]:
+    """Make `lost` the running job's lease flag for `ensure_lease` calls inside the block."""
+    token = _current_lease.set(lost)
+    try:
+        yield lost
+    finally:
+        _current_lease.reset(token)
+
+
+def ensure_lease() -> None:
+    """
+    Raise JobLeaseLost if the running job's lease was lost.
+
+    Handlers call this before writing results (decks, summaries); outside a
+    job it does nothing.
+    """
+    lost = _current_lease.get()
+    if lost is not None and lost.is_set():
+        raise JobLeaseLost("Job lease lost; another worker owns this job")
+
+
+# ============================================================================
+# Schema
+# ============================================================================
+
+metadata = MetaData()
+
+jobs = Table(
+    "jobs",
+    metadata,
+    Column("id", String(36), primary_key=True),
+    Column("kind", String(64), nullable=False),
+    Column("dedupe_key", String(255), nullable=True),
+    Column("source_id", String(255), nullable=True),
+    Column("user_id", String(255), nullable=True),
+    Column("payload", Text, nullable=False, default="{}"),
+    Column("status", String(16), nullable=False, default=STATUS_QUEUED),
+    Column("stage", String(32), nullable=True),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("max_attempts", Integer, nullable=False, default=JOB_MAX_ATTEMPTS),
+    Column("run_after", Float, nullable=False),
+    Column("lease_owner", String(255), nullable=True),
+    Column("lease_expires_at", Float, nullable=True),
+    Column("heartbeat_at", Float, nullable=True),
+    Column("last_error", Text, nullable=True),
+    Column("result", Text, nullable=True),
+    Column("created_at", Float, nullable=False),
+    Column("updated_at", Float, nullable=False),
+    Index("idx_jobs_status_run_after", "status", "run_after"),
+    Index("idx_jobs_source_id", "source_id"),
+    Index("idx_jobs_dedupe_key", "dedupe_key"),
+)
+
+engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+sqlite_engine.configure_sqlalchemy_engine(engine)
+
+
+def init_db() -> None:
+    """Create the jobs table (called at startup, see db/schema.py)."""
+    try:
+        metadata.create_all(bind=engine)
+    except Exception as e:
+        logger.warning(f"Could not initialize jobs table: {e}")
+
+
+def _row_to_job(row) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    job = dict(row._mapping)
+    job["payload"] = json.loads(job["payload"]) if job.get("payload") else {}
+    job["result"] = json.loads(job["result"]) if job.get("result") else None
+    return job
+
+
+def _backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with full jitter, capped at JOB_RETRY_MAX_SECONDS."""
+    ceiling = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+# ============================================================================
+# Producer API
+# ============================================================================
+
+def enqueue(
+    kind: str,
+    payload: Dict[str, Any],
+    source_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+    dedupe_key: Optional[str] = None,
+) -> str:
+    """
+    Add a job to the queue.
+
+    Returns:
+        The new job id
+    """
+    now = time.time()
+    job_id = str(uuid.uuid4())
+    with engine.begin() as conn:
+        conn.execute(jobs.insert().values(
+            id=job_id,
+            kind=kind,
+            dedupe_key=dedupe_key,
+            source_id=source_id,
+            user_id=user_id,
+            payload=json.dumps(payload),
+            status=STATUS_QUEUED,
+            attempts=0,
+            max_attempts=max_attempts,
+            run_after=now,
+            created_at=now,
+            updated_at=now,
+        ))
+    logger.info(f"Enqueued job {job_id} kind={kind} source={source_id}")
+    return job_id
+
+
+def enqueue_or_attach(
+    kind: str,
+    payload: Dict[str, Any],
+    dedupe_key: str,
+    source_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+) -> Tuple[str, bool]:
+    """
+    Add a job unless one with the same dedupe_key is still queued or running.
+
+    The insert is a single INSERT ... SELECT ... WHERE NOT EXISTS, so two
+    concurrent callers do not both queue the job (on Postgres, two inserts in
+    the same instant can still both land; the work then runs twice, as before).
+
+    Returns:
+        (job id, True if a new job was queued / False if attached to an active one)
+    """
+    now = time.time()
+    job_id = str(uuid.uuid4())
+    active = exists().where(and_(jobs.c.dedupe_key == dedupe_key, jobs.c.status.in_(ACTIVE_STATUSES)))
+    values = {
+        "id": job_id,
+        "kind": kind,
+        "dedupe_key": dedupe_key,
+        "source_id": source_id,
+        "user_id": user_id,
+        "payload": json.dumps(payload),
+        "status": STATUS_QUEUED,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "run_after": now,
+        "created_at": now,
+        "updated_at": now,
+    }
+    with engine.begin() as conn:
+        inserted = conn.execute(jobs.insert().from_select(
+            list(values),
+            select(*[literal(value, type_=jobs.c[name].type) for name, value in values.items()]).where(~active),
+        )).rowcount
+    if inserted:
+        logger.info(f"Enqueued job {job_id} kind={kind} source={source_id} dedupe_key={dedupe_key}")
+        return job_id, True
+
+    job = find_active(dedupe_key)
+    if job is None:
+        # The active job finished between the insert and this read: queue a fresh one
+        return enqueue_or_attach(kind, payload, dedupe_key, source_id, user_id, max_attempts)
+    logger.info(f"Attached to job {job['id']} kind={kind} source={source_id} dedupe_key={dedupe_key}")
+    return job["id"], False
+
+
+def find_active(dedupe_key: str) -> Optional[Dict[str, Any]]:
+    """Oldest queued or running job with this dedupe_key, if any."""
+    query = (
+        select(jobs)
+        .where(and_(jobs.c.dedupe_key == dedupe_key, jobs.c.status.in_(ACTIVE_STATUSES)))
+        .order_by(jobs.c.created_at)
+        .limit(1)
+    )
+    with engine.connect() as conn:
+        return _row_to_job(conn.execute(query).first())
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Read a job by id."""
+    with engine.connect() as conn:
+        return _row_to_job(conn.execute(select(jobs).where(jobs.c.id == job_id)).first())
+
+
+def get_latest_job(source_id: str, kind: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Most recently created job for a source (optionally of one kind)."""
+    query = select(jobs).where(jobs.c.source_id == source_id)
+    if kind:
+        query = query.where(jobs.c.kind == kind)
+    query = query.order_by(jobs.c.created_at.desc()).limit(1)
+    with engine.connect() as conn:
+        return _row_to_job(conn.execute(query).first())
+
+
+async def wait_for_job(job_id: str, timeout: float, poll_interval: float = 0.5) -> Optional[Dict[str, Any]]:
+    """
+    Wait (without blocking the event loop) until a job finishes.
+
+    Returns:
+        The finished job, or the still-active job if `timeout` elapsed
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        job = await asyncio.to_thread(get_job, job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return job
+        if time.monotonic() >= deadline:
+            return job
+        await asyncio.sleep(poll_interval)
+
+
+# ============================================================================
+# Worker API
+# ============================================================================
+
+def claim(worker_id: str, kinds: Optional[List[str]] = None, lease_seconds: int = JOB_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+    """
+    Claim the next runnable job for `worker_id`.
+
+    Runnable means queued and due, or running with an expired lease (the
+    previous worker died). The claim is a conditional UPDATE, so two workers
+    can never own the same job.
+    """
+    now = time.time()
+    runnable = or_(
+        and_(jobs.c.status == STATUS_QUEUED, jobs.c.run_after <= now),
+        and_(jobs.c.status == STATUS_RUNNING, jobs.c.lease_expires_at < now),
+    )
+    if kinds:
+        runnable = and_(runnable, jobs.c.kind.in_(kinds))
+
+    with engine.begin() as conn:
+        candidates = conn.execute(
+            select(jobs.c.id, jobs.c.status, jobs.c.attempts, jobs.c.max_attempts, jobs.c.lease_expires_at)
+            .where(runnable)
+            .order_by(jobs.c.run_after)
+            .limit(5)
+        ).all()
+
+    for candidate in candidates:
+        # A reclaimed job that already used all attempts is failed, not re-run
+        if candidate.status == STATUS_RUNNING and candidate.attempts >= candidate.max_attempts:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(jobs)
+                    .where(and_(jobs.c.id == candidate.id, jobs.c.status == STATUS_RUNNING,
+                                jobs.c.lease_expires_at == candidate.lease_expires_at))
+                    .values(status=STATUS_FAILED, last_error="Lease expired (worker lost)",
+                            lease_owner=None, updated_at=now)
+                )
+            continue
+
+        with engine.begin() as conn:
+            claimed = conn.execute(
+                update(jobs)
+                .where(and_(jobs.c.id == candidate.id, jobs.c.status == candidate.status,
+                            jobs.c.attempts == candidate.attempts,
+                            jobs.c.lease_expires_at == candidate.lease_expires_at))
+                .values(
+                    status=STATUS_RUNNING,
+                    stage=None,
+                    attempts=jobs.c.attempts + 1,
+                    lease_owner=worker_id,
+                    lease_expires_at=now + lease_seconds,
+                    heartbeat_at=now,
+                    updated_at=now,
+                )
+            ).rowcount
+        if claimed:
+            if candidate.status == STATUS_RUNNING:
+                logger.warning(f"Reclaimed job {candidate.id} after expired lease")
+            return get_job(candidate.id)
+
+    return None
+
+
+def heartbeat(job_id: str, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+    """
+    Extend the lease of a running job.
+
+    Returns:
+        False if the worker no longer owns the job
+    """
+    now = time.time()
+    with engine.begin() as conn:
+        return bool(conn.execute(
+            update(jobs)
+            .where(and_(jobs.c.id == job_id, jobs.c.lease_owner == worker_id, jobs.c.status == STATUS_RUNNING))
+            .values(lease_expires_at=now + lease_seconds, heartbeat_at=now, updated_at=now)
+        ).rowcount)
+
+
+def set_stage(job_id: str, stage: str) -> None:
+    """Record the pipeline stage a job is currently in."""
+    with engine.begin() as conn:
+        conn.execute(update(jobs).where(jobs.c.id == job_id).values(stage=stage, updated_at=time.time()))
+
+
+def complete(job_id: str, worker_id: str, result: Optional[Dict[str, Any]] = None) -> None:
+    """Mark a job as succeeded and store its result."""
+    with engine.begin() as conn:
+        conn.execute(
+            update(jobs)
+            .where(and_(jobs.c.id == job_id, jobs.c.lease_owner == worker_id))
+            .values(
+                status=STATUS_SUCCEEDED,
+                result=json.dumps(result) if result is not None else None,
+                lease_owner=None,
+                lease_expires_at=None,
+                updated_at=time.time(),
+            )
+        )
+
+
+def fail(job_id: str, worker_id: str, error: str, retryable: bool = True,
+         result: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Record a failed attempt.
+
+    Retryable failures with attempts left go back to the queue after a
+    backoff; everything else is marked failed.
+
+    Returns:
+        True if the job will be retried
+    """
+    job = get_job(job_id)
+    if job is None:
+        return False
+
+    now = time.time()
+    will_retry = retryable and job["attempts"] < job["max_attempts"]
+    values = {
+        "last_error": error[:2000],
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "updated_at": now,
+    }
+    if will_retry:
+        delay = _backoff_seconds(job["attempts"])
+        values.update(status=STATUS_QUEUED, run_after=now + delay)
+        logger.warning(f"Job {job_id} attempt {job['attempts']} failed, retrying in {delay:.1f}s: {error}")
+    else:
+        values.update(status=STATUS_FAILED, result=json.dumps(result) if result is not None else None)
+        logger.error(f"Job {job_id} failed after {job['attempts']} attempt(s): {error}")
+
+    with engine.begin() as conn:
+        conn.execute(
+            update(jobs).where(and_(jobs.c.id == job_id, jobs.c.lease_owner == worker_id)).values(**values)
+        )
+    return will_retry
+
+
+def defer(job_id: str, worker_id: str, delay: float, stage: Optional[str] = None) -> None:
+    """Put a running job back in the queue for later without using up an attempt."""
+    now = time.time()
+    with engine.begin() as conn:
+        conn.execute(
+            update(jobs)
+            .where(and_(jobs.c.id == job_id, jobs.c.lease_owner == worker_id))
+            .values(
+                status=STATUS_QUEUED,
+                stage=stage,
+                attempts=jobs.c.attempts - 1,
+                run_after=now + delay,
+                lease_owner=None,
+                lease_expires_at=None,
+                updated_at=now,
+            )
+        )
+    logger.info(f"Job {job_id} deferred for {delay:.0f}s")
+
+
+def job_summary(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Public view of a job for API responses."""
+    if not job:
+        return None
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+    }
@@ -0,0 +1,173 @@
+"""
+Incremental JSON Array Parser
+
+Parses the top-level JSON array of a streamed LLM completion element by
+element, so each flashcard can be used as soon as its object closes instead
+of after the last token arrives:
+
+    parser = JsonArrayStream(key="flashcards")
+    for delta in llm_gateway.stream_chat_completion(...):
+        for card in parser.feed(delta):
+            ...
+
+- Text before the opening `[` (markdown fences, preambles) is skipped;
+  a `[` inside a string there does not start the array
+- With `key`, the array is the value of that object key (`{"key": [...]}`),
+  or a bare top-level array; arrays under other keys are skipped
+- Brackets and braces inside strings (and escaped quotes) are handled
+- An element that is not valid JSON is counted in `invalid` and skipped
+- Anything after the closing `]` is ignored
+
+`salvage_array` applies the same parser to a complete response that failed
+to parse, e.g. one cut off by max_tokens mid-array, and keeps every element
+that was finished.
+"""
+
+import json
+import logging
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class JsonArrayStream:
+    """Feed text chunks, get back every array element completed by them."""
+
+    def __init__(self, key: Optional[str] = None):
+        self._key = key
+        self._buffer: List[str] = []  # text of the element being read
+        self._started = False  # seen the opening "["
+        # Before the array: strings, nesting and the last key, so that only the right "[" starts it
+        self._pre_depth = 0
+        self._pre_string: Optional[List[str]] = None  # chars of the string being read, if in one
+        self._pre_escape = False
+        self._pre_key: Optional[str] = None  # last string read, while only ":"/whitespace followed it
+        self._pre_colon = False
+        self._done = False  # seen the closing "]"
+        self._depth = 0  # nesting depth inside the current element
+        self._in_string = False
+        self._escape = False
+        self.items = 0
+        self.invalid = 0
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    @property
+    def done(self) -> bool:
+        """Whether the closing bracket of the array has been read."""
+        return self._done
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Consume a chunk of text and return the elements it completed, in order."""
+        elements: List[Any] = []
+        for char in chunk:
+            if self._done:
+                break
+
+            if not self._started:
+                self._scan_preamble(char)
+                continue
+
+            if self._in_string:
+                self._buffer.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 0:
+                        # A top-level string element closes with its quote
+                        self._emit(elements)
+                continue
+
+            if self._depth == 0:
+                # Between elements, or inside a top-level number/literal
+                if char == "]":
+                    self._emit(elements)
+                    self._done = True
+                elif char == ",":
+                    self._emit(elements)
+                elif char in "{[":
+                    self._emit(elements)
+                    self._buffer.append(char)
+                    self._depth = 1
+                elif char == '"':
+                    self._emit(elements)
+                    self._buffer.append(char)
+                    self._in_string = True
+                elif not char.isspace():
+                    self._buffer.append(char)
+                continue
+
+            self._buffer.append(char)
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    # Objects and arrays are usable as soon as they close
+                    self._emit(elements)
+        return elements
+
+    def _scan_preamble(self, char: str) -> None:
+        """Track one character before the array; sets _started on the opening bracket."""
+        if self._pre_string is not None:
+            if self._pre_escape:
+                self._pre_escape = False
+            elif char == "\\":
+                self._pre_escape = True
+            elif char == '"':
+                self._pre_key, self._pre_colon = "".join(self._pre_string), False
+                self._pre_string = None
+                return
+            self._pre_string.append(char)
+            return
+
+        if char == "[":
+            keyed = self._pre_colon and self._pre_key == self._key
+            if self._key is None or keyed or self._pre_depth == 0:
+                self._started = True
+                return
+        if char == '"':
+            self._pre_string = []
+            return
+        if char == ":" and self._pre_key is not None and not self._pre_colon:
+            self._pre_colon = True
+            return
+        if char.isspace():
+            return
+        self._pre_key, self._pre_colon = None, False
+        if char in "{[":
+            self._pre_depth += 1
+        elif char in "}]":
+            self._pre_depth = max(0, self._pre_depth - 1)
+
+    def _emit(self, elements: List[Any]) -> None:
+        text = "".join(self._buffer).strip()
+        self._buffer = []
+        if not text:
+            return
+        try:
+            elements.append(json.loads(text))
+            self.items += 1
+        except json.JSONDecodeError:
+            self.invalid += 1
+            logger.debug(f"Skipping malformed array element: {text[:200]}")
+
+
+def salvage_array(text: str, key: Optional[str] = None) -> Tuple[List[Any], bool]:
+    """
+    Recover every complete element of the first JSON array in `text` (the
+    array under `key`, when given).
+
+    Returns:
+        (elements, complete) where `complete` is whether the array was closed
+    """
+    parser = JsonArrayStream(key)
+    elements = parser.feed(text or "")
+    return elements, parser.done
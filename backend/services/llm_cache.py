@@ -0,0 +1,231 @@
+"""
+LLM Response Cache
+
+Disk-backed cache of chat completion responses, keyed by a hash of the
+model, the (whitespace-normalized) messages and the sampling parameters.
+Regenerating a deck for the same video, transcript or PDF text then costs
+neither the latency nor the tokens of another OpenAI call.
+
+- Stored in the app's SQLite database (db/sqlite_engine), so it survives
+  restarts and is shared by every process on the host
+- Entries expire after LLM_CACHE_TTL_SECONDS
+- Least-recently-used entries are evicted once the cache exceeds
+  LLM_CACHE_MAX_BYTES
+- Only complete responses (finish_reason == "stop") are stored
+- Callers opt out per call (`use_cache=False` on the gateway)
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from db import sqlite_engine
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))  # 7 days
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # 256MB
+LLM_CACHE_EVICTION_INTERVAL = int(os.getenv("LLM_CACHE_EVICTION_INTERVAL", "50"))  # stores between size checks
+
+# Request arguments that do not change the completion
+_IGNORED_KEYS = {"timeout", "stream", "extra_headers", "extra_query", "extra_body", "user"}
+
+
+# ============================================================================
+# Counters
+# ============================================================================
+
+class LLMCacheStats:
+    """Process-local counters for the response cache."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "expired": 0, "evictions": 0}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_ratio": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+_stats = LLMCacheStats()
+_stores_since_eviction = 0
+_eviction_lock = Lock()
+
+
+# ============================================================================
+# Schema
+# ============================================================================
+
+def _create_tables(conn) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_response_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT,
+            response_json TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_access_at REAL NOT NULL,
+            hits INTEGER DEFAULT 0
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_llm_response_cache_last_access ON llm_response_cache (last_access_at)"
+    )
+
+
+def init_db() -> None:
+    """Initialize the cache table (called at startup, see db/schema.py); disables the cache if that fails."""
+    global LLM_CACHE_ENABLED
+    try:
+        sqlite_engine.run_write(_create_tables)
+    except Exception as e:
+        logger.warning(f"Could not initialize LLM response cache table: {e}")
+        LLM_CACHE_ENABLED = False
+
+
+# ============================================================================
+# Keys
+# ============================================================================
+
+def _normalize(value: Any) -> Any:
+    """Collapse whitespace in message text so formatting-only differences share a key."""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def make_key(request: Dict[str, Any]) -> str:
+    """Cache key for chat completion arguments (model, messages, sampling parameters)."""
+    material = {k: v for k, v in request.items() if k not in _IGNORED_KEYS}
+    material["messages"] = _normalize(material.get("messages", []))
+    encoded = json.dumps(material, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+# ============================================================================
+# Lookups and Writes
+# ============================================================================
+
+def get(cache_key: str) -> Optional[str]:
+    """Return the cached response JSON for a key, or None."""
+    now = time.time()
+    try:
+        row = sqlite_engine.fetch_one(
+            "SELECT response_json, expires_at FROM llm_response_cache WHERE cache_key = ?",
+            (cache_key,),
+        )
+    except Exception as e:
+        logger.warning(f"LLM cache read failed: {e}")
+        row = None
+
+    if row is None:
+        _stats.incr("misses")
+        return None
+
+    response_json, expires_at = row
+    if expires_at < now:
+        _stats.incr("misses")
+        _stats.incr("expired")
+        _delete(cache_key)
+        return None
+
+    _stats.incr("hits")
+    try:
+        sqlite_engine.execute_write(
+            "UPDATE llm_response_cache SET last_access_at = ?, hits = hits + 1 WHERE cache_key = ?",
+            (now, cache_key),
+        )
+    except Exception as e:
+        logger.debug(f"LLM cache touch failed: {e}")
+    return response_json
+
+
+def put(cache_key: str, model: Optional[str], response_json: str) -> None:
+    """Store a response and evict old entries when the cache grows past its budget."""
+    global _stores_since_eviction
+    now = time.time()
+    try:
+        sqlite_engine.execute_write(
+            "INSERT OR REPLACE INTO llm_response_cache "
+            "(cache_key, model, response_json, size_bytes, created_at, expires_at, last_access_at, hits) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            (cache_key, model, response_json, len(response_json.encode("utf-8")), now,
+             now + LLM_CACHE_TTL_SECONDS, now),
+        )
+        _stats.incr("stores")
+    except Exception as e:
+        logger.warning(f"LLM cache write failed: {e}")
+        return
+
+    with _eviction_lock:
+        _stores_since_eviction += 1
+        due = _stores_since_eviction >= LLM_CACHE_EVICTION_INTERVAL
+        if due:
+            _stores_since_eviction = 0
+    if due:
+        evict()
+
+
+def _delete(cache_key: str) -> None:
+    try:
+        sqlite_engine.execute_write("DELETE FROM llm_response_cache WHERE cache_key = ?", (cache_key,))
+    except Exception as e:
+        logger.debug(f"LLM cache delete failed: {e}")
+
+
+def evict(max_bytes: int = LLM_CACHE_MAX_BYTES) -> int:
+    """Drop expired entries, then least-recently-used ones until under `max_bytes`."""
+
+    def run(conn) -> int:
+        removed = conn.execute("DELETE FROM llm_response_cache WHERE expires_at < ?", (time.time(),)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM llm_response_cache").fetchone()[0]
+        if total <= max_bytes:
+            return removed
+        doomed = []
+        for cache_key, size in conn.execute(
+            "SELECT cache_key, size_bytes FROM llm_response_cache ORDER BY last_access_at"
+        ):
+            if total <= max_bytes:
+                break
+            doomed.append((cache_key,))
+            total -= size
+        conn.executemany("DELETE FROM llm_response_cache WHERE cache_key = ?", doomed)
+        return removed + len(doomed)
+
+    try:
+        removed = sqlite_engine.run_write(run)
+    except Exception as e:
+        logger.warning(f"LLM cache eviction failed: {e}")
+        return 0
+    if removed:
+        _stats.incr("evictions", removed)
+        logger.info(f"LLM cache evicted {removed} entries")
+    return removed
+
+
+def record_bypass() -> None:
+    _stats.incr("bypassed")
+
+
+def get_stats() -> Dict[str, Any]:
+    """Hit/miss counters for this process."""
+    return {"enabled": LLM_CACHE_ENABLED, **_stats.snapshot()}
@@ -0,0 +1,325 @@
+"""
+LLM Gateway
+
+One place that owns the OpenAI clients for the whole process. Every call site
+(flashcards, YouTube cards, transcript cleaning, summaries) goes through here
+instead of building a new httpx.Client + OpenAI client per request, so:
+
+- TCP/TLS connections are reused (keep-alive pool) across generations
+- The total number of concurrent connections to OpenAI is bounded
+- Connect/read timeouts are configured once
+- Sockets are no longer leaked by clients that were never closed
+
+Sync callers use `get_client()` / `chat_completion()`. Async callers use
+`achat_completion()`, which runs on an AsyncOpenAI client bound to the
+current event loop and never blocks it.
+
+`embeddings()` runs embedding requests on the same client.
+
+`stream_chat_completion()` yields the completion text as it is generated
+(see services/json_stream.py for parsing it incrementally).
+
+All completion helpers consult the persistent response cache
+(services/llm_cache.py) first; pass `use_cache=False` for fresh output.
+Every call's token usage and latency is reported to services/usage_meter.py.
+Retries, adaptive timeouts and hedging live in services/llm_resilience.py;
+the SDK's own retries are disabled so attempts are not multiplied.
+"""
+
+import os
+import asyncio
+import logging
+import time
+import weakref
+from threading import Lock
+from typing import Any, Dict, Iterator, Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+from services import llm_cache, llm_resilience, token_budget, usage_meter
+
+logger = logging.getLogger(__name__)
+
+# Configuration (via environment variables)
+OPENAI_TIMEOUT_SECONDS = int(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "10"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "30"))
+
+
+class LLMConfigError(RuntimeError):
+    """Raised when the OpenAI API key is not configured."""
+    pass
+
+
+def _api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise LLMConfigError("OPENAI_API_KEY environment variable is required")
+    return api_key
+
+
+def is_configured() -> bool:
+    """Whether an OpenAI API key is available."""
+    return bool(os.getenv("OPENAI_API_KEY"))
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+# ============================================================================
+# Sync client (one per process)
+# ============================================================================
+
+_client: Optional[OpenAI] = None
+_client_lock = Lock()
+
+
+def get_client() -> OpenAI:
+    """
+    The shared sync OpenAI client (thread-safe, created on first use).
+
+    Raises:
+        LLMConfigError: If OPENAI_API_KEY is not set
+    """
+    global _client
+    if _client is None:
+        api_key = _api_key()
+        with _client_lock:
+            if _client is None:
+                http_client = httpx.Client(timeout=_timeout(), limits=_limits())
+                _client = OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+                logger.info(
+                    f"Initialized shared OpenAI client (max_connections={OPENAI_MAX_CONNECTIONS}, "
+                    f"keepalive={OPENAI_MAX_KEEPALIVE_CONNECTIONS})"
+                )
+    return _client
+
+
+def _cache_key(request: Dict[str, Any], use_cache: bool) -> Optional[str]:
+    # Raw stream=True calls bypass the cache; stream_chat_completion handles its own
+    if not llm_cache.LLM_CACHE_ENABLED or request.get("stream"):
+        return None
+    if not use_cache:
+        llm_cache.record_bypass()
+        return None
+    return llm_cache.make_key(request)
+
+
+def _cacheable(response) -> bool:
+    # Truncated (finish_reason="length") or filtered responses are never reused
+    return bool(response.choices) and all(choice.finish_reason == "stop" for choice in response.choices)
+
+
+def _create(**kwargs: Any):
+    # One attempt; losing hedges are recorded too, since they are billed
+    started = time.monotonic()
+    response = get_client().chat.completions.create(**kwargs)
+    usage_meter.record_response(kwargs.get("model"), response, time.monotonic() - started)
+    return response
+
+
+def chat_completion(use_cache: bool = True, **kwargs: Any):
+    """
+    Run `chat.completions.create` on the shared sync client.
+
+    Args:
+        use_cache: Serve identical requests from the response cache (False for fresh output)
+        **kwargs: Arguments for `chat.completions.create`
+    """
+    kwargs.setdefault("timeout", OPENAI_TIMEOUT_SECONDS)
+    started = time.monotonic()
+    cache_key = _cache_key(kwargs, use_cache)
+    if cache_key:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            usage_meter.record_cache_hit(kwargs.get("model"), time.monotonic() - started)
+            return ChatCompletion.model_validate_json(cached)
+
+    response = llm_resilience.call(_create, kwargs)
+
+    if cache_key and _cacheable(response):
+        llm_cache.put(cache_key, kwargs.get("model"), response.model_dump_json())
+    return response
+
+
+def stream_chat_completion(use_cache: bool = True, **kwargs: Any) -> Iterator[str]:
+    """
+    Run a streaming `chat.completions.create` and yield the content deltas.
+
+    A cached response is replayed as one delta; a streamed response that
+    finished normally is assembled and stored like a plain completion.
+    Closing the iterator early closes the HTTP response.
+
+    Args:
+        use_cache: Serve identical requests from the response cache (False for fresh output)
+        **kwargs: Arguments for `chat.completions.create` (single choice)
+    """
+    kwargs.pop("stream", None)
+    kwargs.setdefault("timeout", OPENAI_TIMEOUT_SECONDS)
+    started = time.monotonic()
+    cache_key = _cache_key(kwargs, use_cache)
+    if cache_key:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            usage_meter.record_cache_hit(kwargs.get("model"), time.monotonic() - started)
+            yield ChatCompletion.model_validate_json(cached).choices[0].message.content or ""
+            return
+
+    stream = llm_resilience.call(get_client().chat.completions.create, {**kwargs, "stream": True}, hedge=False)
+    parts = []
+    finish_reason = None
+    last_chunk = None
+    try:
+        for chunk in stream:
+            last_chunk = chunk
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                yield choice.delta.content
+    finally:
+        stream.response.close()
+        # Streamed chunks carry no usage block: count the tokens locally
+        model = kwargs.get("model")
+        usage_meter.record(
+            model,
+            token_budget.count_message_tokens(kwargs.get("messages", []), model or token_budget.DEFAULT_MODEL),
+            token_budget.count_tokens("".join(parts), model or token_budget.DEFAULT_MODEL),
+            time.monotonic() - started,
+            estimated=True,
+        )
+
+    if cache_key and finish_reason == "stop" and last_chunk is not None:
+        response = ChatCompletion.model_validate({
+            "id": last_chunk.id,
+            "object": "chat.completion",
+            "created": last_chunk.created,
+            "model": last_chunk.model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(parts)},
+                "finish_reason": finish_reason,
+            }],
+        })
+        llm_cache.put(cache_key, kwargs.get("model"), response.model_dump_json())
+
+
+def _embed(**kwargs: Any):
+    started = time.monotonic()
+    response = get_client().embeddings.create(**kwargs)
+    usage_meter.record(kwargs.get("model"), response.usage.prompt_tokens, 0, time.monotonic() - started)
+    return response
+
+
+def embeddings(**kwargs: Any):
+    """
+    Run `embeddings.create` on the shared sync client (retried like completions, never cached).
+
+    Args:
+        **kwargs: Arguments for `embeddings.create`
+    """
+    kwargs.setdefault("timeout", OPENAI_TIMEOUT_SECONDS)
+    return llm_resilience.call(_embed, kwargs)
+
+
+# ============================================================================
+# Async clients (one per event loop)
+# ============================================================================
+
+# httpx.AsyncClient connections belong to the loop that opened them, and job
+# workers run each job in its own loop (asyncio.run), so clients are per loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_async_lock = Lock()
+
+
+def get_async_client() -> AsyncOpenAI:
+    """
+    The AsyncOpenAI client for the running event loop.
+
+    Raises:
+        LLMConfigError: If OPENAI_API_KEY is not set
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        api_key = _api_key()
+        with _async_lock:
+            client = _async_clients.get(loop)
+            if client is None:
+                http_client = httpx.AsyncClient(timeout=_timeout(), limits=_limits())
+                client = AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+                _async_clients[loop] = client
+    return client
+
+
+async def _acreate(**kwargs: Any):
+    started = time.monotonic()
+    response = await get_async_client().chat.completions.create(**kwargs)
+    usage_meter.record_response(kwargs.get("model"), response, time.monotonic() - started)
+    return response
+
+
+async def achat_completion(use_cache: bool = True, **kwargs: Any):
+    """Run `chat.completions.create` on the event loop's async client (see chat_completion)."""
+    kwargs.setdefault("timeout", OPENAI_TIMEOUT_SECONDS)
+    started = time.monotonic()
+    cache_key = _cache_key(kwargs, use_cache)
+    if cache_key:
+        cached = await asyncio.to_thread(llm_cache.get, cache_key)
+        if cached is not None:
+            usage_meter.record_cache_hit(kwargs.get("model"), time.monotonic() - started)
+            return ChatCompletion.model_validate_json(cached)
+
+    response = await llm_resilience.acall(_acreate, kwargs)
+
+    if cache_key and _cacheable(response):
+        await asyncio.to_thread(llm_cache.put, cache_key, kwargs.get("model"), response.model_dump_json())
+    return response
+
+
+# ============================================================================
+# Lifecycle
+# ============================================================================
+
+def close() -> None:
+    """Close the shared sync client (e.g. on shutdown)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+async def aclose() -> None:
+    """Close the async client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _async_lock:
+        client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.close()
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        "sync_client": _client is not None,
+        "async_clients": len(_async_clients),
+        "max_connections": OPENAI_MAX_CONNECTIONS,
+        "max_keepalive_connections": OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        "resilience": llm_resilience.get_stats(),
+    }
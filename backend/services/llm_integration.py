@@ -4,26 +4,26 @@ LLM integration for generating flashcards from transcript excerpts.
 import json
 import logging
 import os
-from typing import Dict, List, Any
-import httpx
-import openai
-from openai import OpenAI
+from typing import Dict, List, Any, Optional
+from services import llm_gateway
+from services.json_stream import salvage_array
 
 logger = logging.getLogger(__name__)
 
 # SECURITY: OpenAI configuration
 OPENAI_TIMEOUT_SECONDS = int(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
 
-def call_llm_json(system_prompt: str, user_prompt: str) -> Dict[str, Any]:
+def call_llm_json(system_prompt: str, user_prompt: str, salvage_key: Optional[str] = None) -> Dict[str, Any]:
     """
     Call OpenAI API and return STRICT JSON response.
+    
+    If the response is cut off or malformed and `salvage_key` is given, the
+    complete elements of its first array are returned as `{salvage_key: [...]}`
+    instead of failing the whole (already paid for) generation.
     """
     try:
-        # SECURITY: Use HTTP client with timeout
-        http_client = httpx.Client(timeout=OPENAI_TIMEOUT_SECONDS)
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
-        
-        response = client.chat.completions.create(
+        # Shared process-wide client from the LLM gateway
+        response = llm_gateway.chat_completion(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -36,7 +36,15 @@ def call_llm_json(system_prompt: str, user_prompt: str) -> Dict[str, Any]:
         )
         
         content = response.choices[0].message.content
-        return json.loads(content)
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            if salvage_key:
+                items, _ = salvage_array(content, key=salvage_key)
+                if items:
+                    logger.warning(f"Salvaged {len(items)} complete '{salvage_key}' items from a malformed LLM response")
+                    return {salvage_key: items}
+            raise
         
     except json.JSONDecodeError as e:
         logger.error(f"Failed to parse LLM JSON response: {e}")
@@ -78,7 +86,7 @@ Transcript excerpts (JSON):
 >>>"""
 
     try:
-        result = call_llm_json(system_prompt, user_prompt)
+        result = call_llm_json(system_prompt, user_prompt, salvage_key="cards")
         cards = result.get('cards', [])
         
         # Validate and clean cards
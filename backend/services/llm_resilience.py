@@ -0,0 +1,393 @@
+"""
+LLM Call Resilience
+
+Retry, adaptive timeouts and hedging for the OpenAI calls made by the LLM
+gateway. Previously each call was one attempt bounded only by
+OPENAI_TIMEOUT_SECONDS, so a single slow upstream response set the tail
+latency of flashcard generation.
+
+- Transient errors (timeouts, connection errors, 429s without
+  `insufficient_quota`, 5xx) are retried with full-jitter exponential backoff,
+  honouring Retry-After. The caller's `timeout` becomes the deadline for the
+  whole call, retries included, so the worst case is no longer than before.
+- Per-attempt timeouts adapt to the rolling latency of similar requests
+  (same model and max_tokens): p99 x OPENAI_TIMEOUT_MULTIPLIER, never below
+  OPENAI_MIN_ATTEMPT_TIMEOUT_SECONDS or above the remaining deadline.
+- Optional hedging (OPENAI_HEDGE_ENABLED): if an attempt has not answered by
+  the rolling p95, a duplicate request is sent and whichever answers first
+  wins. Hedges are paid for out of a token bucket refilled by
+  OPENAI_HEDGE_MAX_RATIO per request, which caps the extra spend.
+
+Streams are only retried while opening (before any delta is yielded); they
+are never hedged and keep the fixed per-read timeout.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "3"))
+OPENAI_RETRY_BASE_SECONDS = float(os.getenv("OPENAI_RETRY_BASE_SECONDS", "0.5"))
+OPENAI_RETRY_MAX_SECONDS = float(os.getenv("OPENAI_RETRY_MAX_SECONDS", "8"))
+
+OPENAI_ADAPTIVE_TIMEOUTS = os.getenv("OPENAI_ADAPTIVE_TIMEOUTS", "true").lower() == "true"
+OPENAI_TIMEOUT_MULTIPLIER = float(os.getenv("OPENAI_TIMEOUT_MULTIPLIER", "2.0"))
+OPENAI_MIN_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_MIN_ATTEMPT_TIMEOUT_SECONDS", "15"))
+OPENAI_LATENCY_WINDOW = int(os.getenv("OPENAI_LATENCY_WINDOW", "200"))
+OPENAI_LATENCY_MIN_SAMPLES = int(os.getenv("OPENAI_LATENCY_MIN_SAMPLES", "20"))
+
+OPENAI_HEDGE_ENABLED = os.getenv("OPENAI_HEDGE_ENABLED", "false").lower() == "true"
+OPENAI_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("OPENAI_HEDGE_MIN_DELAY_SECONDS", "1.0"))
+OPENAI_HEDGE_MAX_RATIO = float(os.getenv("OPENAI_HEDGE_MAX_RATIO", "0.05"))
+OPENAI_HEDGE_BURST = float(os.getenv("OPENAI_HEDGE_BURST", "3"))
+OPENAI_HEDGE_MAX_WORKERS = int(os.getenv("OPENAI_HEDGE_MAX_WORKERS", "16"))
+
+LatencyKey = Tuple[Optional[str], Optional[int], bool]
+
+
+# ============================================================================
+# Latency tracking
+# ============================================================================
+
+class LatencyTracker:
+    """Rolling window of attempt latencies per (model, max_tokens, stream). Thread-safe."""
+
+    def __init__(self, window: int = OPENAI_LATENCY_WINDOW, min_samples: int = OPENAI_LATENCY_MIN_SAMPLES):
+        self._window = window
+        self._min_samples = min_samples
+        self._samples: Dict[LatencyKey, Deque[float]] = {}
+        self._lock = Lock()
+
+    def observe(self, key: LatencyKey, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self._window)
+            samples.append(seconds)
+
+    def percentile(self, key: LatencyKey, pct: float) -> Optional[float]:
+        """The pct-th percentile latency, or None until there are enough samples."""
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None or len(samples) < self._min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            keys = list(self._samples)
+        result = {}
+        for key in keys:
+            with self._lock:
+                count = len(self._samples[key])
+            result["/".join(str(part) for part in key)] = {
+                "samples": count,
+                "p50": self.percentile(key, 50),
+                "p95": self.percentile(key, 95),
+                "p99": self.percentile(key, 99),
+            }
+        return result
+
+
+class HedgeBudget:
+    """
+    Token bucket limiting hedged requests to a fraction of all requests.
+
+    Every request adds `ratio` credits (up to `burst`); a hedge costs one.
+    """
+
+    def __init__(self, ratio: float = OPENAI_HEDGE_MAX_RATIO, burst: float = OPENAI_HEDGE_BURST):
+        self._ratio = ratio
+        self._burst = burst
+        self._credits = 0.0
+        self._lock = Lock()
+
+    def on_request(self) -> None:
+        with self._lock:
+            self._credits = min(self._burst, self._credits + self._ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._credits >= 1.0:
+                self._credits -= 1.0
+                return True
+            return False
+
+
+class ResilienceStats:
+    """Counters for retries, timeouts and hedges."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {
+            "calls": 0, "attempts": 0, "retries": 0, "timeouts": 0, "failures": 0,
+            "hedges": 0, "hedge_wins": 0,
+        }
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+# Global instances
+_latency = LatencyTracker()
+_hedge_budget = HedgeBudget()
+_stats = ResilienceStats()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=OPENAI_HEDGE_MAX_WORKERS, thread_name_prefix="llm-hedge")
+    return _hedge_executor
+
+
+# ============================================================================
+# Policy
+# ============================================================================
+
+def _latency_key(request: Dict[str, Any]) -> LatencyKey:
+    # Completion length drives latency, so requests are compared per max_tokens;
+    # a stream "answers" when its headers arrive, so streams are kept apart
+    return request.get("model"), request.get("max_tokens"), bool(request.get("stream"))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether another attempt could succeed (timeouts, connection errors, 429, 5xx)."""
+    if isinstance(error, APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(error, RateLimitError):
+        # An exhausted account quota does not recover within a request
+        return getattr(error, "code", None) != "insufficient_quota"
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(OPENAI_RETRY_MAX_SECONDS, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return random.uniform(0, min(OPENAI_RETRY_MAX_SECONDS, OPENAI_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def attempt_timeout(key: LatencyKey, remaining: float) -> float:
+    """Timeout for the next attempt: adaptive p99-based limit, capped by the remaining deadline."""
+    if not OPENAI_ADAPTIVE_TIMEOUTS or key[2]:
+        # A stream's timeout applies to every read, not to the whole completion
+        return remaining
+    p99 = _latency.percentile(key, 99)
+    if p99 is None:
+        return remaining
+    return min(remaining, max(OPENAI_MIN_ATTEMPT_TIMEOUT_SECONDS, p99 * OPENAI_TIMEOUT_MULTIPLIER))
+
+
+def hedge_delay(key: LatencyKey) -> Optional[float]:
+    """Seconds to wait before hedging, or None when hedging does not apply."""
+    if not OPENAI_HEDGE_ENABLED:
+        return None
+    p95 = _latency.percentile(key, 95)
+    if p95 is None:
+        return None
+    return max(OPENAI_HEDGE_MIN_DELAY_SECONDS, p95)
+
+
+def _deadline_seconds(request: Dict[str, Any]) -> float:
+    timeout = request.get("timeout")
+    if isinstance(timeout, (int, float)):
+        return float(timeout)
+    # httpx.Timeout or NOT_GIVEN: use its read timeout when there is one
+    return float(getattr(timeout, "read", None) or 60)
+
+
+def _observe(key: LatencyKey, started: float, error: Optional[Exception] = None) -> None:
+    _stats.incr("attempts")
+    if error is None:
+        _latency.observe(key, time.monotonic() - started)
+    elif isinstance(error, APITimeoutError):
+        # A timed-out attempt took at least this long; counting it lets the
+        # adaptive timeout grow when upstream slows down instead of timing out every attempt
+        _stats.incr("timeouts")
+        _latency.observe(key, time.monotonic() - started)
+
+
+# ============================================================================
+# Sync calls
+# ============================================================================
+
+def _timed(create: Callable[..., Any], key: LatencyKey, request: Dict[str, Any]) -> Any:
+    started = time.monotonic()
+    try:
+        response = create(**request)
+    except Exception as e:
+        _observe(key, started, e)
+        raise
+    _observe(key, started)
+    return response
+
+
+def _hedged(create: Callable[..., Any], key: LatencyKey, request: Dict[str, Any]) -> Any:
+    delay = hedge_delay(key)
+    if delay is None or delay >= request["timeout"]:
+        return _timed(create, key, request)
+
+    # Attempts run in copies of this context so usage stays attributed to the caller
+    executor = _executor()
+    primary = executor.submit(contextvars.copy_context().run, _timed, create, key, request)
+    done, _ = wait([primary], timeout=delay)
+    if done or not _hedge_budget.try_spend():
+        return primary.result()
+
+    _stats.incr("hedges")
+    hedge = executor.submit(contextvars.copy_context().run, _timed, create, key, request)
+    pending = {primary, hedge}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    _stats.incr("hedge_wins")
+                # The other attempt finishes in the background and is discarded
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call(create: Callable[..., Any], request: Dict[str, Any], hedge: bool = True) -> Any:
+    """
+    Run `create(**request)` with retries, adaptive timeouts and optional hedging.
+
+    Args:
+        create: The OpenAI call (e.g. `client.chat.completions.create`)
+        request: Its keyword arguments; `timeout` is the deadline for the whole call
+        hedge: Whether duplicate requests may be sent (never for streams)
+    """
+    key = _latency_key(request)
+    deadline = time.monotonic() + _deadline_seconds(request)
+    _stats.incr("calls")
+    _hedge_budget.on_request()
+
+    attempt = 0
+    while True:
+        attempt += 1
+        remaining = deadline - time.monotonic()
+        attempt_request = {**request, "timeout": attempt_timeout(key, remaining)}
+        try:
+            if hedge and not key[2]:
+                return _hedged(create, key, attempt_request)
+            return _timed(create, key, attempt_request)
+        except Exception as e:
+            delay = backoff_delay(attempt, e)
+            if attempt >= OPENAI_MAX_ATTEMPTS or not is_retryable(e) or time.monotonic() + delay >= deadline:
+                _stats.incr("failures")
+                raise
+            _stats.incr("retries")
+            logger.warning(f"LLM attempt {attempt}/{OPENAI_MAX_ATTEMPTS} failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+# ============================================================================
+# Async calls
+# ============================================================================
+
+async def _atimed(create: Callable[..., Awaitable[Any]], key: LatencyKey, request: Dict[str, Any]) -> Any:
+    started = time.monotonic()
+    try:
+        response = await create(**request)
+    except Exception as e:
+        _observe(key, started, e)
+        raise
+    _observe(key, started)
+    return response
+
+
+async def _ahedged(create: Callable[..., Awaitable[Any]], key: LatencyKey, request: Dict[str, Any]) -> Any:
+    delay = hedge_delay(key)
+    if delay is None or delay >= request["timeout"]:
+        return await _atimed(create, key, request)
+
+    primary = asyncio.ensure_future(_atimed(create, key, request))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done or not _hedge_budget.try_spend():
+        return await primary
+
+    _stats.incr("hedges")
+    hedge = asyncio.ensure_future(_atimed(create, key, request))
+    pending = {primary, hedge}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        _stats.incr("hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # Cancelling the loser closes its connection
+        for task in pending:
+            task.cancel()
+
+
+async def acall(create: Callable[..., Awaitable[Any]], request: Dict[str, Any]) -> Any:
+    """Async version of `call` (hedging cancels the losing request)."""
+    key = _latency_key(request)
+    deadline = time.monotonic() + _deadline_seconds(request)
+    _stats.incr("calls")
+    _hedge_budget.on_request()
+
+    attempt = 0
+    while True:
+        attempt += 1
+        remaining = deadline - time.monotonic()
+        attempt_request = {**request, "timeout": attempt_timeout(key, remaining)}
+        try:
+            return await _ahedged(create, key, attempt_request)
+        except Exception as e:
+            delay = backoff_delay(attempt, e)
+            if attempt >= OPENAI_MAX_ATTEMPTS or not is_retryable(e) or time.monotonic() + delay >= deadline:
+                _stats.incr("failures")
+                raise
+            _stats.incr("retries")
+            logger.warning(f"LLM attempt {attempt}/{OPENAI_MAX_ATTEMPTS} failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        "max_attempts": OPENAI_MAX_ATTEMPTS,
+        "adaptive_timeouts": OPENAI_ADAPTIVE_TIMEOUTS,
+        "hedging": OPENAI_HEDGE_ENABLED,
+        **_stats.snapshot(),
+        "latency": _latency.snapshot(),
+    }
@@ -0,0 +1,240 @@
+"""
+PDF Flashcard Pipeline
+
+The PDF -> flashcards flow, run by queue workers (see job_worker.py):
+
+1. Resolve the content hash and reuse an identical upload's deck if present
+2. Otherwise take the cached text (or a budgeted extraction)
+3. Ensure the Supabase deck exists
+4. Generate with the LLM, inserting each card as soon as it is parsed from
+   the streamed completion (long documents go through flashcard_generator's
+   map-reduce mode), or copy the cloned deck. Generated cards that
+   near-duplicate another card of the deck or of the user's other decks are
+   dropped (services/dedup_index.py)
+5. Mark the PDF completed
+
+`pdfs.status` is only moved to an error status once the job will not be
+retried, so a transient OpenAI failure does not flash an error in the UI.
+Only a missing file or an unusable PDF fails the job at once; any other
+error (network, database busy, ...) is retried with the queue's backoff.
+"""
+
+import logging
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from fastapi import HTTPException
+
+from pdf_processor import PdfExtractionError
+from flashcard_generator import generate_flashcards
+from repo.dual_repo import (
+    upsert_flashcard, delete_flashcards, create_deck_in_supabase, get_pdf_record, update_pdf_status
+)
+from services import content_index, text_cache, dedup_index
+from services.progress import (
+    publish_stage, publish_card, STAGE_EXTRACTING, STAGE_GENERATING, STAGE_PERSISTING
+)
+from services.job_queue import JobError, JobLeaseLost, ensure_lease
+
+logger = logging.getLogger(__name__)
+summary_logger = logging.getLogger("summaries")
+
+UPLOAD_DIR = Path("uploads")
+
+# pdfs.status values for OpenAI errors (HTTPException status code -> status)
+HTTP_ERROR_STATUSES = {
+    429: "quota_exceeded",
+    401: "auth_error",
+    504: "timeout",
+}
+
+# Status when cross-deck deduplication leaves no cards (the previous deck is kept)
+DUPLICATE_CARDS_STATUS = "duplicate_cards"
+
+# OpenAI errors worth another attempt; auth errors are not
+NON_RETRYABLE_HTTP_CODES = {401}
+
+
+def run_pdf_flashcards(
+    pdf_id: str,
+    user_id: Optional[str],
+    force_regenerate: bool = False,
+    final_attempt: bool = True,
+    job_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Process a PDF and generate its flashcards.
+
+    Args:
+        pdf_id: The PDF ID
+        user_id: Supabase auth user ID for deck creation
+        force_regenerate: Skip the content-hash index and regenerate
+        final_attempt: Whether a failure here is final (sets the error status)
+        job_id: Queue job running this pipeline, for progress events
+
+    Returns:
+        {"pdf_id", "cards", "cloned"} on success, plus "coverage" (see generate_flashcards) when generated
+
+    Raises:
+        JobError: On failure; `retryable` tells the worker whether to retry
+    """
+    try:
+        update_pdf_status(pdf_id, "processing")
+
+        file_path = UPLOAD_DIR / f"{pdf_id}.pdf"
+        if not file_path.exists():
+            raise FileNotFoundError("PDF file not found")
+
+        # Reuse results for byte-identical uploads
+        content_hash = content_index.get_pdf_hash(pdf_id, str(file_path))
+        cached_entry = content_index.lookup_flashcards(content_hash, force_regenerate=force_regenerate)
+
+        if cached_entry:
+            flashcards_data = cached_entry["flashcards"]
+            logger.info(f"Cloning {len(flashcards_data)} flashcards from PDF {cached_entry['source_pdf_id']} for {pdf_id}")
+        else:
+            publish_stage(job_id, pdf_id, STAGE_EXTRACTING)
+            # Always the full document text (shared with the eager extraction started at
+            # upload), so the same PDF gets the same sections whatever finished first
+            try:
+                text_content = text_cache.get_source_text(pdf_id)
+            except RuntimeError as e:
+                raise PdfExtractionError(str(e))
+
+        # Ensure deck exists in Supabase BEFORE inserting flashcards (required for foreign key constraint)
+        deck_created = ensure_pdf_deck(pdf_id, user_id)
+
+        if cached_entry:
+            publish_stage(job_id, pdf_id, STAGE_PERSISTING)
+            ensure_lease()
+            # Clear any existing flashcards for this PDF, then insert the new ones
+            delete_flashcards(pdf_id)
+            for i, flashcard in enumerate(flashcards_data):
+                upsert_flashcard(pdf_id, flashcard["question"], flashcard["answer"], i + 1)
+            # A clone is an explicit copy: indexed for later decks, never deduplicated
+            dedup_index.index_deck(user_id, pdf_id, flashcards_data)
+        else:
+            publish_stage(job_id, pdf_id, STAGE_GENERATING)
+            dedup = dedup_index.DedupSession(user_id, pdf_id)
+            kept = []
+            coverage: Dict[str, Any] = {}
+
+            def keep_card(card: Dict[str, str], card_number: int) -> None:
+                # A reclaimed job is running elsewhere: stop early (generate_flashcards
+                # passes JobLeaseLost through rather than mapping it to an HTTP error)
+                ensure_lease()
+                if not dedup.add(dedup_index.card_text(card)):
+                    return
+                kept.append(card)
+                publish_card(job_id, pdf_id, len(kept), card)
+
+            def draft_card(card: Dict[str, str], draft_number: int) -> None:
+                ensure_lease()
+                publish_card(job_id, pdf_id, draft_number, card, draft=True)
+
+            # NOTE: Quota was already consumed atomically by enforce_quota when the job was enqueued
+            # A forced regeneration also skips the LLM response cache
+            generated = generate_flashcards(
+                text_content, use_cache=not force_regenerate, on_card=keep_card,
+                coverage=coverage, on_draft=draft_card,
+            )
+            # The index keeps the whole generated deck: clones go to users with other libraries.
+            # (the extracted text is already stored by text_cache under the same hash)
+            content_index.store_flashcards(content_hash, pdf_id, generated)
+            if not kept:
+                # Every card duplicated the user's other decks: keep the previous deck
+                # (and its dedup entries) rather than replacing it with an empty one
+                update_pdf_status(pdf_id, DUPLICATE_CARDS_STATUS)
+                logger.warning(f"All {len(generated)} generated cards for PDF {pdf_id} duplicate the user's other decks")
+                raise JobError(
+                    "Every generated flashcard duplicates one in the user's other decks",
+                    retryable=False, result={"status": DUPLICATE_CARDS_STATUS},
+                )
+            publish_stage(job_id, pdf_id, STAGE_PERSISTING)
+            ensure_lease()
+            # The previous deck is only replaced once generation has succeeded,
+            # so a failure midway leaves it intact
+            delete_flashcards(pdf_id)
+            for i, card in enumerate(kept):
+                upsert_flashcard(pdf_id, card["question"], card["answer"], i + 1)
+            dedup.commit()
+            flashcards_data = kept
+
+        logger.info(f"Generated {len(flashcards_data)} flashcards for user {user_id}")
+
+        # Clone the summary too when the original upload already has one
+        if cached_entry:
+            clone_cached_summary(pdf_id, cached_entry)
+
+        ensure_lease()
+        update_pdf_status(pdf_id, "completed")
+        logger.info(f"✅ Successfully processed PDF {pdf_id} and generated {len(flashcards_data)} flashcards")
+        if not deck_created:
+            logger.info(f"PDF {pdf_id} processing complete, but deck may not exist in Supabase")
+
+        result = {"pdf_id": pdf_id, "cards": len(flashcards_data), "cloned": bool(cached_entry)}
+        if not cached_entry:
+            result["coverage"] = coverage
+        return result
+
+    except HTTPException as e:
+        # OpenAI errors mapped by flashcard_generator
+        retryable = e.status_code not in NON_RETRYABLE_HTTP_CODES
+        status = HTTP_ERROR_STATUSES.get(e.status_code, "service_error")
+        if final_attempt or not retryable:
+            update_pdf_status(pdf_id, status)
+        logger.warning(f"Flashcard generation failed for PDF {pdf_id} ({status}): {e.detail}")
+        raise JobError(str(e.detail), retryable=retryable, result={"status": status})
+
+    except (FileNotFoundError, PdfExtractionError) as e:
+        # Missing files and unreadable PDFs fail the same way on every attempt
+        update_pdf_status(pdf_id, "error")
+        logger.error(f"❌ Error processing PDF {pdf_id}: {str(e)}")
+        raise JobError(str(e), retryable=False, result={"status": "error"})
+
+    except (JobError, JobLeaseLost):
+        raise
+
+    except Exception as e:
+        # Transient (network, database busy, ...): retried with backoff
+        if final_attempt:
+            update_pdf_status(pdf_id, "error")
+        logger.error(f"❌ Error processing PDF {pdf_id}: {str(e)}")
+        raise JobError(str(e), retryable=True, result={"status": "error"})
+
+
+def ensure_pdf_deck(pdf_id: str, user_id: Optional[str]) -> bool:
+    """Create the Supabase deck for a PDF if it does not exist yet; returns whether it exists."""
+    try:
+        record = get_pdf_record(pdf_id)
+        filename = record["filename"] if record else None
+        if not filename:
+            logger.warning(f"Could not find filename for PDF {pdf_id} when creating deck in Supabase")
+            return False
+
+        title = record["title"]
+        logger.info(f"Ensuring deck exists in Supabase: deck_id={pdf_id}, title={title}, user_id={user_id}")
+        success = create_deck_in_supabase(
+            deck_id=pdf_id,
+            title=title,
+            source_type="pdf",
+            source_label=filename,
+            user_id=user_id  # may be None, function handles that gracefully
+        )
+        return bool(success)
+    except Exception as deck_error:
+        logger.error(f"Exception while ensuring deck exists in Supabase for PDF {pdf_id}: {deck_error}", exc_info=True)
+        return False
+
+
+def clone_cached_summary(pdf_id: str, cached_entry: dict) -> None:
+    """Copy a summary stored in the content-hash index onto a new source."""
+    sentences_data = content_index.summary_for_source(cached_entry, pdf_id)
+    if not sentences_data:
+        return
+    try:
+        from services.summary_builder import save_summary
+        summary_id = save_summary(pdf_id, sentences_data)
+        summary_logger.info(f"[clone] Cloned summary={summary_id} onto source={pdf_id}")
+    except Exception as e:
+        summary_logger.warning(f"[clone] Failed to clone summary onto source={pdf_id}: {e}")
@@ -0,0 +1,198 @@
+"""
+Job Progress Events
+
+Pipelines report stage transitions (extracting, generating, persisting,
+completed, error) through `publish_stage`. Each transition is:
+
+1. Persisted on the job row (job_queue.set_stage), so any process can read it
+2. Pushed to in-process subscribers, so SSE streams served by the same
+   process as the worker see it immediately
+
+Streams served by a process that is not running the job fall back to
+polling the job row (one indexed query every PROGRESS_POLL_SECONDS).
+
+While generating, `publish_card` pushes each flashcard as soon as it is
+parsed from the streamed completion. Long sources first push `draft`
+cards from each section, then the final deck once sections are reduced.
+Card events are not persisted (the deck is saved once generation
+completes), so only same-process streams receive them.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from threading import Lock
+from typing import Dict, Any, Optional, Set, Tuple, AsyncIterator
+
+from services import job_queue
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+PROGRESS_POLL_SECONDS = float(os.getenv("PROGRESS_POLL_SECONDS", "2.0"))
+PROGRESS_KEEPALIVE_SECONDS = float(os.getenv("PROGRESS_KEEPALIVE_SECONDS", "15"))
+PROGRESS_STREAM_MAX_SECONDS = float(os.getenv("PROGRESS_STREAM_MAX_SECONDS", "900"))
+
+# Stages
+STAGE_QUEUED = "queued"
+STAGE_RETRYING = "retrying"
+STAGE_RUNNING = "running"
+STAGE_EXTRACTING = "extracting"
+STAGE_GENERATING = "generating"
+STAGE_PERSISTING = "persisting"
+STAGE_BATCHED = "batched"  # waiting for the batch lane (services/batch_lane.py)
+STAGE_COMPLETED = "completed"
+STAGE_ERROR = "error"
+TERMINAL_STAGES = (STAGE_COMPLETED, STAGE_ERROR)
+
+
+class ProgressBroker:
+    """
+    In-process fan-out of stage events to asyncio subscribers.
+
+    `publish` may be called from worker threads; events are handed to each
+    subscriber's event loop with call_soon_threadsafe.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def subscribe(self, source_id: str) -> Tuple[asyncio.AbstractEventLoop, asyncio.Queue]:
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers.setdefault(source_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, source_id: str, subscriber: Tuple[asyncio.AbstractEventLoop, asyncio.Queue]) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(source_id)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[source_id]
+
+    def publish(self, source_id: str, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(source_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # Subscriber's loop is closed; it will be unsubscribed by its stream
+                pass
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+# Global broker instance
+_broker = ProgressBroker()
+
+
+def publish_stage(job_id: Optional[str], source_id: Optional[str], stage: str, **details: Any) -> None:
+    """Record a stage transition for a job and notify live subscribers."""
+    if job_id:
+        try:
+            job_queue.set_stage(job_id, stage)
+        except Exception as e:
+            logger.warning(f"Failed to persist stage {stage} for job {job_id}: {e}")
+    if source_id:
+        _broker.publish(source_id, {"stage": stage, "job_id": job_id, **details})
+
+
+def publish_card(
+    job_id: Optional[str],
+    source_id: Optional[str],
+    card_number: int,
+    card: Dict[str, str],
+    draft: bool = False,
+) -> None:
+    """Notify live subscribers that a flashcard was generated (`draft`: a section card the reduce step may drop)."""
+    if source_id:
+        _broker.publish(source_id, {
+            "stage": STAGE_GENERATING,
+            "job_id": job_id,
+            "card": {
+                "card_number": card_number,
+                "question": card["question"],
+                "answer": card["answer"],
+                "draft": draft,
+            },
+        })
+
+
+def stage_from_job(job: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Derive the current stage of a job from its row."""
+    if not job:
+        return None
+    if job["status"] == job_queue.STATUS_SUCCEEDED:
+        return STAGE_COMPLETED
+    if job["status"] == job_queue.STATUS_FAILED:
+        return STAGE_ERROR
+    if job["status"] == job_queue.STATUS_QUEUED:
+        if job.get("stage") == STAGE_BATCHED:
+            return STAGE_BATCHED
+        return STAGE_RETRYING if job["attempts"] else STAGE_QUEUED
+    return job.get("stage") or STAGE_RUNNING
+
+
+def _job_event(job: Dict[str, Any]) -> Dict[str, Any]:
+    event = {"stage": stage_from_job(job), "job_id": job["id"]}
+    if job["status"] == job_queue.STATUS_FAILED:
+        event.update(job.get("result") or {})
+    return event
+
+
+async def stream_stages(source_id: str, kind: Optional[str] = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """
+    Yield stage (and card) events for the latest job of a source until it finishes.
+
+    Yields None when nothing happened for PROGRESS_KEEPALIVE_SECONDS, so the
+    caller can send a keep-alive.
+    """
+    subscriber = _broker.subscribe(source_id)
+    _, queue = subscriber
+    started = time.monotonic()
+    last_event_at = started
+    last_stage = None
+    try:
+        job = await asyncio.to_thread(job_queue.get_latest_job, source_id, kind)
+        if job is None:
+            return
+        job_id = job["id"]
+        event = _job_event(job)
+        last_stage = event["stage"]
+        yield event
+        if last_stage in TERMINAL_STAGES:
+            return
+
+        while time.monotonic() - started < PROGRESS_STREAM_MAX_SECONDS:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=PROGRESS_POLL_SECONDS)
+                if event.get("job_id") not in (None, job_id):
+                    continue
+            except asyncio.TimeoutError:
+                # The job may be running in another process: read its row
+                job = await asyncio.to_thread(job_queue.get_job, job_id)
+                if job is None:
+                    return
+                event = _job_event(job)
+
+            if "card" in event or event["stage"] != last_stage:
+                last_stage = event["stage"]
+                last_event_at = time.monotonic()
+                yield event
+                if last_stage in TERMINAL_STAGES:
+                    return
+            elif time.monotonic() - last_event_at >= PROGRESS_KEEPALIVE_SECONDS:
+                last_event_at = time.monotonic()
+                yield None
+    finally:
+        _broker.unsubscribe(source_id, subscriber)
+
+
+def get_stats() -> Dict[str, Any]:
+    return {"subscribers": _broker.subscriber_count()}
@@ -0,0 +1,209 @@
+"""
+Lexical Retrieval Index for Summary Citations
+
+Scores summary sentences against a source's chunks. Previously every
+sentence either recomputed a Python set Jaccard against every chunk
+(summary_builder) or refit a TfidfVectorizer from scratch (the old Celery task).
+Now each source gets one index:
+
+- Chunks are weighted with BM25 (term saturation + length normalization)
+  and stored as an L2-normalized sparse matrix
+- All queries are scored against all chunks in one sparse matrix product;
+  scores are cosines in [0, 1], so support thresholds keep their meaning
+- Indexes are keyed by the source's content hash and saved to disk
+  (uploads/retrieval/<key>/<chunks fingerprint>/) as .npy arrays that later loads memory-map,
+  with a small in-process LRU on top (services/index_store.py)
+
+Callers compute spans and previews only for the top hits they use.
+"""
+
+import os
+import re
+import math
+import hashlib
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from services.index_store import IndexCache, load_index_dir, save_index_dir
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
+RETRIEVAL_INDEX_DIR = Path(os.getenv("RETRIEVAL_INDEX_DIR", str(UPLOAD_DIR / "retrieval")))
+RETRIEVAL_INDEX_CACHE_SIZE = int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "32"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Saved indexes from another format version are rebuilt
+INDEX_VERSION = 1
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in ENGLISH_STOP_WORDS]
+
+
+def chunks_fingerprint(texts: Sequence[str]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+# ============================================================================
+# Index
+# ============================================================================
+
+class RetrievalIndex:
+    """BM25-weighted, L2-normalized chunk-term matrix with its vocabulary."""
+
+    def __init__(self, matrix: sparse.csr_matrix, vocab: Dict[str, int], idf: np.ndarray, fingerprint: str):
+        self.matrix = matrix
+        self.vocab = vocab
+        self.idf = idf
+        self.fingerprint = fingerprint
+        # Weight of query terms that appear in no chunk (they still lower the cosine)
+        n_chunks = matrix.shape[0]
+        self._unseen_idf = math.log(1 + (n_chunks + 0.5) / 0.5)
+
+    @property
+    def n_chunks(self) -> int:
+        return self.matrix.shape[0]
+
+    @classmethod
+    def build(cls, texts: Sequence[str]) -> "RetrievalIndex":
+        vocab: Dict[str, int] = {}
+        counts = []
+        for text in texts:
+            counter = Counter(tokenize(text))
+            counts.append(counter)
+            for term in counter:
+                if term not in vocab:
+                    vocab[term] = len(vocab)
+
+        n_chunks = len(texts)
+        lengths = np.array([sum(counter.values()) for counter in counts], dtype=np.float64)
+        avg_length = lengths.mean() if n_chunks and lengths.sum() else 1.0
+
+        indptr = [0]
+        indices: List[int] = []
+        tfs: List[float] = []
+        for counter in counts:
+            indices.extend(vocab[term] for term in counter)
+            tfs.extend(counter.values())
+            indptr.append(len(indices))
+        indices_arr = np.array(indices, dtype=np.int32)
+        tf = np.array(tfs, dtype=np.float64)
+
+        df = np.bincount(indices_arr, minlength=len(vocab)).astype(np.float64)
+        idf = np.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+
+        # BM25 term weight, then unit-length rows so chunk scores are cosines
+        row_lengths = np.repeat(lengths, np.diff(indptr))
+        weights = idf[indices_arr] * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * row_lengths / avg_length))
+        matrix = sparse.csr_matrix(
+            (weights, indices_arr, np.array(indptr, dtype=np.int64)), shape=(n_chunks, max(1, len(vocab)))
+        )
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        matrix = sparse.csr_matrix(sparse.diags(1.0 / norms) @ matrix)
+        return cls(matrix, vocab, idf, chunks_fingerprint(texts))
+
+    def _query_matrix(self, queries: Sequence[str]) -> sparse.csr_matrix:
+        rows, cols, values = [], [], []
+        for row, query in enumerate(queries):
+            terms = set(tokenize(query))
+            known = [self.vocab[term] for term in terms if term in self.vocab]
+            weights = self.idf[known] if known else np.zeros(0)
+            norm = math.sqrt(float(np.square(weights).sum()) + (len(terms) - len(known)) * self._unseen_idf ** 2)
+            if norm == 0:
+                continue
+            rows.extend([row] * len(known))
+            cols.extend(known)
+            values.extend((weights / norm).tolist())
+        return sparse.csr_matrix((values, (rows, cols)), shape=(len(queries), self.matrix.shape[1]))
+
+    def score(self, queries: Sequence[str]) -> np.ndarray:
+        """Cosine scores, shape (len(queries), n_chunks), in one vectorized pass."""
+        if not queries or not self.n_chunks:
+            return np.zeros((len(queries), self.n_chunks))
+        return (self._query_matrix(queries) @ self.matrix.T).toarray()
+
+    def search(self, queries: Sequence[str], top_k: int) -> List[List[Tuple[int, float]]]:
+        """Top `top_k` (chunk index, score) per query, best first."""
+        scores = self.score(queries)
+        k = min(top_k, self.n_chunks)
+        results = []
+        for row in scores:
+            if k <= 0:
+                results.append([])
+                continue
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top], kind="stable")]
+            results.append([(int(i), float(row[i])) for i in top])
+        return results
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: Path) -> None:
+        save_index_dir(
+            path,
+            {"data": self.matrix.data, "indices": self.matrix.indices, "indptr": self.matrix.indptr, "idf": self.idf},
+            {"shape": list(self.matrix.shape), "fingerprint": self.fingerprint, "vocab": self.vocab},
+            INDEX_VERSION,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["RetrievalIndex"]:
+        """Memory-map a saved index, or None if missing or from another version."""
+        saved = load_index_dir(path, INDEX_VERSION)
+        if saved is None:
+            return None
+        meta, arrays = saved
+        matrix = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple(meta["shape"]), copy=False
+        )
+        return cls(matrix, meta["vocab"], arrays["idf"], meta["fingerprint"])
+
+
+# ============================================================================
+# Cache
+# ============================================================================
+
+# Global cache instance
+_cache: IndexCache[RetrievalIndex] = IndexCache(RETRIEVAL_INDEX_CACHE_SIZE, "retrieval index")
+
+
+def get_index(texts: Sequence[str], key: Optional[str] = None) -> RetrievalIndex:
+    """
+    The retrieval index over `texts` (chunk texts, in chunk order).
+
+    Args:
+        key: Stable id of the source's content (its content hash); None builds
+            a throwaway index that is neither cached nor saved
+    """
+    if key is None:
+        _cache.count_build()
+        return RetrievalIndex.build(texts)
+    fingerprint = chunks_fingerprint(texts)
+    # One directory per chunking of the content, so callers that chunk
+    # the same source differently never overwrite each other's index
+    return _cache.get(
+        (key, fingerprint), RETRIEVAL_INDEX_DIR / key / fingerprint, fingerprint,
+        RetrievalIndex.load, lambda: RetrievalIndex.build(texts),
+    )
+
+
+def get_stats() -> Dict[str, Any]:
+    return _cache.stats()
@@ -0,0 +1,201 @@
+"""
+Span Alignment
+
+Finds where a sentence (a summary sentence, a card's evidence quote) occurs
+in a source text, as exact character offsets plus a match score, in time
+linear in the text length (plus sorting the anchors found):
+
+- A verbatim (case-insensitive) occurrence is found with one `str.find`
+- Otherwise the text is split into tokens and separators once, so the
+  winning span's offsets are exact sums of piece lengths (no `str.find`
+  mapping back to the first occurrence); only positions holding a query
+  word are examined
+- Word n-grams of the query are hashed into a dict; one pass over the
+  text's n-grams collects anchors (text position, query position), falling
+  back from trigrams to bigrams to single non-stop words when nothing anchors
+- Anchors on (nearly) the same diagonal agree on where the query starts; a
+  two-pointer sweep over diagonals finds the band covering the most query
+  tokens, and the span runs from its first to its last anchor
+
+The score is the share of query tokens covered by anchors in that window
+(1.0 for a verbatim match, case-insensitive).
+"""
+
+import os
+import re
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+# Configuration
+SPAN_ALIGN_MIN_SCORE = float(os.getenv("SPAN_ALIGN_MIN_SCORE", "0.3"))
+SPAN_ALIGN_MIN_TOKENS = 3  # a shorter match is no evidence (unless the query is shorter)
+SPAN_FALLBACK_CHARS = 240
+
+_TOKEN_RE = re.compile(r"\w+")
+_SPLIT_RE = re.compile(r"(\w+)")
+
+
+class Alignment(NamedTuple):
+    start: int
+    end: int
+    score: float
+    matched_tokens: int
+
+
+class TokenizedText:
+    """A text's lowercased tokens, as ids, with their offsets (built on first use); reusable across queries."""
+
+    def __init__(self, text: str):
+        self.text = text
+        lowered = text.lower()
+        # A few characters change length when lowercased; offsets must stay exact
+        self.lowered = lowered if len(lowered) == len(text) else None
+        self._parts = None
+        self.vocab = None
+        self.ids = None
+
+    def tokenize(self) -> None:
+        if self.ids is not None:
+            return
+        # Separators and tokens alternate: [sep, token, sep, token, ..., sep]
+        self._parts = _SPLIT_RE.split(self.lowered if self.lowered is not None else self.text)
+        tokens = self._parts[1::2]
+        if self.lowered is None:
+            tokens = [token.lower() for token in tokens]
+        self.vocab = {}
+        self.ids = np.fromiter(
+            (self.vocab.setdefault(token, len(self.vocab)) for token in tokens), dtype=np.int64, count=len(tokens)
+        )
+
+    def span(self, first: int, last: int) -> Tuple[int, int]:
+        """Character span from the start of token `first` to the end of token `last`."""
+        start = sum(map(len, self._parts[:2 * first + 1]))
+        return start, start + sum(map(len, self._parts[2 * first + 1:2 * last + 2]))
+
+
+def _tokens(text: str) -> List[str]:
+    return [token.lower() for token in _TOKEN_RE.findall(text)]
+
+
+def _ngram_codes(ids: np.ndarray, n: int, base: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions of the n-grams made only of query tokens (ids >= 0), and a code per n-gram."""
+    count = len(ids) - n + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    valid = np.ones(count, dtype=bool)
+    codes = np.zeros(count, dtype=np.int64)
+    for k in range(n):
+        window = ids[k:k + count]
+        valid &= window >= 0
+        codes = codes * base + window
+    positions = np.flatnonzero(valid)
+    return positions, codes[positions]
+
+
+def _anchors(query_ids: np.ndarray, text_ids: np.ndarray, n: int, base: int, skip: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(text positions, query positions) of every query n-gram occurrence in the text."""
+    query_positions, query_codes = _ngram_codes(query_ids, n, base)
+    if n == 1:
+        # Lone stop words ("the", "of") anchor everywhere and prove nothing
+        keep = ~skip[query_positions]
+        query_positions, query_codes = query_positions[keep], query_codes[keep]
+    order = np.argsort(query_codes, kind="stable")
+    query_positions, query_codes = query_positions[order], query_codes[order]
+
+    text_positions, text_codes = _ngram_codes(text_ids, n, base)
+    lo = np.searchsorted(query_codes, text_codes, side="left")
+    counts = np.searchsorted(query_codes, text_codes, side="right") - lo
+    # Expand each text n-gram to every query position holding the same n-gram
+    total = int(counts.sum())
+    starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    return np.repeat(text_positions, counts), query_positions[starts + np.arange(total)]
+
+
+def align(query: str, text, min_score: float = SPAN_ALIGN_MIN_SCORE) -> Optional[Alignment]:
+    """
+    Best span of `text` matching `query`, or None below `min_score`.
+
+    Args:
+        query: Sentence or quote to locate
+        text: The text to search (a str, or a TokenizedText to reuse across queries)
+        min_score: Minimum share of query tokens that must be matched
+    """
+    target = text if isinstance(text, TokenizedText) else TokenizedText(text)
+    query_tokens = _tokens(query)
+    if not query_tokens:
+        return None
+
+    # Verbatim occurrence: one C-level scan, no tokenizing
+    needle = query.strip().lower()
+    if target.lowered is not None and len(needle) == len(query.strip()):
+        start = target.lowered.find(needle)
+        if start != -1:
+            return Alignment(start, start + len(needle), 1.0, len(query_tokens))
+
+    target.tokenize()
+    if not len(target.ids):
+        return None
+    # Local ids for the query's distinct tokens; every other text token is -1
+    local = {}
+    query_ids = np.array([local.setdefault(token, len(local)) for token in query_tokens], dtype=np.int64)
+    lookup = np.full(len(target.vocab), -1, dtype=np.int64)
+    for token, local_id in local.items():
+        if token in target.vocab:
+            lookup[target.vocab[token]] = local_id
+    text_ids = lookup[target.ids]
+    skip = np.array([token in ENGLISH_STOP_WORDS for token in query_tokens])
+    base = len(local) + 1
+
+    m = len(query_tokens)
+    min_tokens = min(SPAN_ALIGN_MIN_TOKENS, m)
+    tolerance = max(2, m // 4)
+    for n in (3, 2, 1):
+        if n > m:
+            continue
+        text_pos, query_pos = _anchors(query_ids, text_ids, n, base, skip)
+        if not len(text_pos):
+            continue
+
+        # An anchor's diagonal (text position - query position) says where the
+        # query would start in the text. For every band of diagonals
+        # [b, b + tolerance] (a few inserted or dropped words), count the
+        # distinct query tokens covered by its anchors' n-grams
+        diagonals = text_pos - query_pos
+        low = int(diagonals.min()) - tolerance
+        span_count = int(diagonals.max()) - low + 1
+        cells = np.unique(
+            (np.repeat(query_pos, n) + np.tile(np.arange(n), len(query_pos))) * span_count
+            + np.repeat(diagonals - low, n)
+        )
+        cell_tokens, cell_diagonals = cells // span_count, cells % span_count
+        # A covered token counts once per band: at its last diagonal inside
+        # the band, i.e. for bands b with d - tolerance <= b < next_d - tolerance
+        next_diagonals = np.append(cell_diagonals[1:], span_count + tolerance + 1)
+        next_diagonals[np.append(cell_tokens[1:] != cell_tokens[:-1], True)] = span_count + tolerance + 1
+        band_from = cell_diagonals - tolerance
+        band_to = np.minimum(cell_diagonals, next_diagonals - tolerance - 1)
+        counted = band_from <= band_to
+        coverage = np.cumsum(
+            np.bincount(band_from[counted], minlength=span_count + 1)
+            - np.bincount(band_to[counted] + 1, minlength=span_count + 1)
+        )
+        band = int(np.argmax(coverage))
+        matched = int(coverage[band])
+
+        score = matched / m
+        if matched < min_tokens or score < min_score:
+            continue
+        in_band = (diagonals - low >= band) & (diagonals - low <= band + tolerance)
+        start, end = target.span(int(text_pos[in_band].min()), int(text_pos[in_band].max()) + n - 1)
+        return Alignment(start, end, score, matched)
+    return None
+
+
+def find_span(sentence: str, text, min_score: float = SPAN_ALIGN_MIN_SCORE) -> Tuple[int, int]:
+    """Character span of `sentence` in `text` (str or TokenizedText); the first SPAN_FALLBACK_CHARS characters if it does not align."""
+    alignment = align(sentence, text, min_score)
+    if alignment is None:
+        return 0, min(SPAN_FALLBACK_CHARS, len(text.text if isinstance(text, TokenizedText) else text))
+    return alignment.start, alignment.end
@@ -1,22 +1,29 @@
 """
 Tolerant and debuggable summary builder service
 """
+import os
 import json
 import logging
 import sqlite3
 from typing import List, Dict, Tuple, Optional
 from pathlib import Path
-import httpx
-from openai import OpenAI, AuthenticationError, RateLimitError, APITimeoutError, APIError
-from pdf_processor import extract_text_from_pdf
-
-# SECURITY: OpenAI configuration
-OPENAI_TIMEOUT_SECONDS = int(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+from openai import AuthenticationError, RateLimitError, APITimeoutError, APIError
 from models import Base, Summary, SummarySentence, SummarySentenceCitation
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
-import os
+from services import content_index, retrieval_index, embedding_store, span_align, summary_store
+from services.text_cache import get_source_text, resolve_source_hash
+from services import llm_gateway, token_budget, usage_meter, batch_lane
+from services.job_queue import JobDeferred, ensure_lease
+from services.progress import STAGE_BATCHED
+from services.json_stream import salvage_array
+from db import sqlite_engine
+from collections import OrderedDict
+from threading import Lock
+
+# SECURITY: OpenAI configuration
+OPENAI_TIMEOUT_SECONDS = int(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
 
 # Load environment variables
 load_dotenv()
@@ -27,25 +34,44 @@ log = logging.getLogger("citations")
 # Database setup - use environment variable or fallback to SQLite
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///pdf_flashcards.db")
 engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-Base.metadata.create_all(bind=engine)
+sqlite_engine.configure_sqlalchemy_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def init_db() -> None:
+    """Create the summary/chunk tables (called at startup, see db/schema.py)."""
+    Base.metadata.create_all(bind=engine)
+
 # Configuration
 SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
 TOP_K = int(os.getenv("SUMMARY_EVIDENCE_TOPK", "6"))
-THRESH = float(os.getenv("SUMMARY_SUPPORT_THRESHOLD", "0.74"))
+THRESH = float(os.getenv("SUMMARY_SUPPORT_THRESHOLD", "0.74"))  # BM25 cosine
+# Embedding cosines sit on another scale (paraphrases score well below 0.74), so they get their own cutoff
+EMBEDDING_THRESH = float(os.getenv("SUMMARY_EMBEDDING_SUPPORT_THRESHOLD", "0.5"))
+SUMMARY_PROMPT_TOKENS = int(os.getenv("SUMMARY_PROMPT_TOKENS", "1200"))  # whole sentence-generation prompt
 
 def get_openai_client():
-    """Get OpenAI client with error handling and timeout configuration"""
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
+    """Get the shared OpenAI client (timeouts and pooling live in the LLM gateway)"""
+    if not llm_gateway.is_configured():
         raise RuntimeError("OPENAI_API_KEY environment variable is required")
-    # SECURITY: Use HTTP client with timeout
-    http_client = httpx.Client(timeout=OPENAI_TIMEOUT_SECONDS)
-    return OpenAI(api_key=api_key, http_client=http_client)
+    return llm_gateway.get_client()
+
+# Chunk lists per (source_id, content_hash), most recently used last
+CHUNK_CACHE_MAX_SOURCES = int(os.getenv("CHUNK_CACHE_MAX_SOURCES", "64"))
+_chunk_cache: "OrderedDict[Tuple[str, str], List[Dict]]" = OrderedDict()
+_chunk_cache_lock = Lock()
 
 def get_chunks_for_source(source_id: str) -> List[Dict]:
     """Get chunks for a source"""
+    content_hash = resolve_source_hash(source_id)
+    cache_key = (source_id, content_hash)
+    if content_hash:
+        with _chunk_cache_lock:
+            cached = _chunk_cache.get(cache_key)
+            if cached is not None:
+                _chunk_cache.move_to_end(cache_key)
+                return cached
+    
     # Use SQLAlchemy session for database-agnostic access
     session = SessionLocal()
     try:
@@ -57,14 +83,8 @@ def get_chunks_for_source(source_id: str) -> List[Dict]:
     finally:
         session.close()
     
-    # Extract text from PDF
-    file_path = Path("uploads") / f"{source_id}.pdf"
-    if not file_path.exists():
-        raise RuntimeError("PDF file not found")
-    
-    text_content = extract_text_from_pdf(str(file_path))
-    if not text_content.strip():
-        raise RuntimeError("No text could be extracted from PDF")
+    # Extracted text is cached per content hash (memory + on-disk artifact)
+    text_content = get_source_text(source_id)
     
     # Create chunks from the text
     chunk_size = 500
@@ -82,129 +102,158 @@ def get_chunks_for_source(source_id: str) -> List[Dict]:
             'end_word': min(i + chunk_size, len(words))
         })
     
+    if content_hash:
+        with _chunk_cache_lock:
+            _chunk_cache[cache_key] = chunks
+            while len(_chunk_cache) > CHUNK_CACHE_MAX_SOURCES:
+                _chunk_cache.popitem(last=False)
+    
     return chunks
 
-def llm_generate_sentences(chunks: List[Dict], model: str) -> List[str]:
-    """Generate candidate sentences from source using LLM"""
+def prepare_source(source_id: str) -> None:
+    """
+    Extract and chunk a freshly uploaded source ahead of time.
+    
+    Runs as a background task right after upload so that flashcard generation
+    and summary builds start directly with the LLM call. Failures are logged
+    only; the generation path extracts on demand if this did not complete.
+    """
+    try:
+        chunks = get_chunks_for_source(source_id)
+        log.info(f"[prepare] Pre-extracted source={source_id} chunks={len(chunks)}")
+    except Exception as e:
+        log.warning(f"[prepare] Pre-extraction failed for source={source_id}: {e}")
+
+def _sentence_request(chunks: List[Dict], model: str) -> Dict:
+    """Chat completion arguments for summary sentence generation"""
     if not chunks:
         raise RuntimeError("No chunks provided for sentence generation")
     
-    # Combine first few chunks for context
+    # Combine first few chunks for context, filled up to the prompt's token budget
+    system_prompt = "You are a helpful assistant that creates structured summaries with evidence queries. Always respond with valid JSON only."
     context_text = " ".join([chunk['text'] for chunk in chunks[:3]])
-    context_text = context_text[:4000]  # Limit to avoid token limits
+    full_length = len(context_text)
+    context_text, prompt_tokens = token_budget.fit_text(
+        context_text, SUMMARY_PROMPT_TOKENS, fixed=[system_prompt, _sentence_prompt("")], model=model
+    )
+    token_budget.record("summary_sentences", prompt_tokens, truncated=len(context_text) < full_length)
     
-    prompt = f"""You summarize academic/technical text into 6–10 short sentences.
+    return dict(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": _sentence_prompt(context_text)}
+        ],
+        temperature=0.7,
+        max_tokens=2000,
+        response_format={"type": "json_object"},
+        timeout=OPENAI_TIMEOUT_SECONDS,  # SECURITY: Prevent hanging requests
+    )
+
+def _sentence_prompt(context_text: str) -> str:
+    return f"""You summarize academic/technical text into 6–10 short sentences.
 For each sentence, also emit an "evidence_query" suitable for retrieval from the original text.
 Return ONLY a JSON object with a "sentences" array: {{"sentences": [{{"sentence": "...", "evidence_query": "..."}}]}}
 Do not include commentary.
 
 Text to summarize:
 {context_text}"""
-    
+
+def _parse_sentences(response) -> List[str]:
+    response_content = response.choices[0].message.content
     try:
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that creates structured summaries with evidence queries. Always respond with valid JSON only."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=2000,
-            response_format={"type": "json_object"},
-            timeout=OPENAI_TIMEOUT_SECONDS,  # SECURITY: Prevent hanging requests
-        )
-        
-        response_content = response.choices[0].message.content
-        summary_data = json.loads(response_content)
-        sentences = summary_data.get("sentences", [])
-        
+        sentences = json.loads(response_content).get("sentences", [])
+    except json.JSONDecodeError:
+        # Cut off mid-array: keep the sentences that were completed
+        sentences, _ = salvage_array(response_content, key="sentences")
         if not sentences:
-            raise RuntimeError("Model produced no sentences")
-        
-        # Extract just the sentence text
-        return [item.get("sentence", "") for item in sentences if item.get("sentence", "").strip()]
-        
-    except AuthenticationError as e:
-        raise RuntimeError(f"OpenAI authentication failed: {str(e)}")
-    except RateLimitError as e:
-        raise RuntimeError(f"OpenAI rate limit exceeded: {str(e)}")
-    except APITimeoutError as e:
-        raise RuntimeError(f"OpenAI API timeout: {str(e)}")
-    except APIError as e:
-        raise RuntimeError(f"OpenAI API error: {str(e)}")
-    except json.JSONDecodeError as e:
-        raise RuntimeError(f"Failed to parse OpenAI response as JSON: {str(e)}")
+            raise
+        log.warning(f"Salvaged {len(sentences)} sentences from a malformed LLM response")
+    sentences = [item for item in sentences if isinstance(item, dict)]
+    
+    if not sentences:
+        raise RuntimeError("Model produced no sentences")
+    
+    # Extract just the sentence text
+    return [item.get("sentence", "") for item in sentences if item.get("sentence", "").strip()]
+
+def _sentence_error(e: Exception) -> RuntimeError:
+    """Map OpenAI/JSON failures to the RuntimeError messages callers log"""
+    if isinstance(e, AuthenticationError):
+        return RuntimeError(f"OpenAI authentication failed: {str(e)}")
+    if isinstance(e, RateLimitError):
+        return RuntimeError(f"OpenAI rate limit exceeded: {str(e)}")
+    if isinstance(e, APITimeoutError):
+        return RuntimeError(f"OpenAI API timeout: {str(e)}")
+    if isinstance(e, APIError):
+        return RuntimeError(f"OpenAI API error: {str(e)}")
+    if isinstance(e, json.JSONDecodeError):
+        return RuntimeError(f"Failed to parse OpenAI response as JSON: {str(e)}")
+    return RuntimeError(f"OpenAI call failed: {str(e)}")
+
+def llm_generate_sentences(chunks: List[Dict], model: str) -> List[str]:
+    """Generate candidate sentences from source using LLM"""
+    request = _sentence_request(chunks, model)
+    try:
+        get_openai_client()  # Fails fast with a clear error if no API key is configured
+        return _parse_sentences(llm_gateway.chat_completion(**request))
     except Exception as e:
-        raise RuntimeError(f"OpenAI call failed: {str(e)}")
+        raise _sentence_error(e)
 
-def search_chunks(source_id: str, query: str, top_k: int) -> List[Tuple[str, float, Optional[int], Optional[int], str]]:
-    """Search for similar chunks using simple text matching"""
+async def allm_generate_sentences(chunks: List[Dict], model: str) -> List[str]:
+    """Async variant of llm_generate_sentences; does not block the event loop"""
+    request = _sentence_request(chunks, model)
+    try:
+        if not llm_gateway.is_configured():
+            raise RuntimeError("OPENAI_API_KEY environment variable is required")
+        return _parse_sentences(await llm_gateway.achat_completion(**request))
+    except Exception as e:
+        raise _sentence_error(e)
+
+def search_chunks_batch(source_id: str, queries: List[str], top_k: int) -> List[List[Tuple[str, float, Optional[int], Optional[int], str]]]:
+    """Top_k similar chunks for every query: embedding cosine when a backend is configured, else BM25"""
+    return _search_chunks_batch(source_id, queries, top_k)[0]
+
+def _search_chunks_batch(source_id: str, queries: List[str], top_k: int) -> Tuple[List[List[Tuple[str, float, Optional[int], Optional[int], str]]], bool]:
+    """search_chunks_batch results, and whether the scores are embedding cosines (False: BM25)"""
     chunks = get_chunks_for_source(source_id)
-    if not chunks:
-        return []
-    
-    # Simple similarity based on word overlap
-    query_words = set(query.lower().split())
-    results = []
+    if not chunks or not queries:
+        return [[] for _ in queries], False
     
-    for chunk in chunks:
-        chunk_words = set(chunk['text'].lower().split())
-        intersection = len(query_words.intersection(chunk_words))
-        union = len(query_words.union(chunk_words))
-        similarity = intersection / union if union > 0 else 0
-        
-        # Find span in chunk
-        start_char, end_char = find_span_in_chunk(query, chunk['text'])
-        preview_text = chunk['text'][start_char:end_char] if end_char <= len(chunk['text']) else chunk['text'][start_char:]
-        
-        results.append((chunk['id'], similarity, start_char, end_char, preview_text))
+    texts = [chunk['text'] for chunk in chunks]
+    key = resolve_source_hash(source_id)
+    all_hits = None
+    semantic = False
+    if embedding_store.is_enabled():
+        try:
+            all_hits = embedding_store.search_texts(texts, key, queries, top_k)
+            semantic = True
+        except TypeError:
+            # A bug (e.g. an argument the OpenAI client does not take), not an outage: do not hide it
+            raise
+        except Exception as e:
+            log.warning(f"[builder] Semantic retrieval failed for source={source_id}, using lexical index: {e}")
+    if all_hits is None:
+        all_hits = retrieval_index.get_index(texts, key=key).search(queries, top_k)
     
-    # Sort by similarity and return top_k
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results[:top_k]
+    results = []
+    tokenized = {}  # chunks hit by several queries are tokenized once
+    for query, hits in zip(queries, all_hits):
+        query_results = []
+        for position, similarity in hits:
+            chunk = chunks[position]
+            if position not in tokenized:
+                tokenized[position] = span_align.TokenizedText(chunk['text'])
+            # Spans only for the hits we return
+            start_char, end_char = span_align.find_span(query, tokenized[position])
+            preview_text = chunk['text'][start_char:end_char] if end_char <= len(chunk['text']) else chunk['text'][start_char:]
+            query_results.append((chunk['id'], similarity, start_char, end_char, preview_text))
+        results.append(query_results)
+    return results, semantic
 
-def find_span_in_chunk(sentence: str, chunk_text: str) -> Tuple[int, int]:
-    """Find the span of sentence within chunk text"""
-    # Try exact match first
-    start_idx = chunk_text.lower().find(sentence.lower())
-    if start_idx != -1:
-        end_idx = start_idx + len(sentence)
-        return start_idx, end_idx
-    
-    # Try to find key words from the sentence in the chunk
-    sentence_words = sentence.lower().split()
-    chunk_words = chunk_text.lower().split()
-    
-    # Find the best matching sequence
-    best_match_start = None
-    best_match_length = 0
-    
-    for i in range(len(chunk_words)):
-        match_length = 0
-        for j in range(len(sentence_words)):
-            if i + j < len(chunk_words) and chunk_words[i + j] == sentence_words[j]:
-                match_length += 1
-            else:
-                break
-        
-        if match_length > best_match_length and match_length >= 3:  # At least 3 words match
-            best_match_length = match_length
-            # Convert word index to character index
-            word_start_idx = chunk_text.lower().find(chunk_words[i])
-            word_end_idx = word_start_idx
-            for k in range(best_match_length):
-                if i + k < len(chunk_words):
-                    word_end_idx += len(chunk_words[i + k]) + 1  # +1 for space
-            
-            best_match_start = word_start_idx
-            best_match_end = word_end_idx - 1  # Remove trailing space
-    
-    if best_match_start is not None:
-        return best_match_start, best_match_end
-    
-    # Fallback: return first 240 characters of chunk
-    return 0, min(240, len(chunk_text))
+def search_chunks(source_id: str, query: str, top_k: int) -> List[Tuple[str, float, Optional[int], Optional[int], str]]:
+    """Search for similar chunks (see search_chunks_batch)"""
+    return search_chunks_batch(source_id, [query], top_k)[0]
 
 def get_chunk_text(chunk_id: str) -> str:
     """Get text content for a chunk"""
@@ -225,42 +274,14 @@ def slice_preview(text: str, start_char: int, end_char: int) -> str:
     return text[start_char:end_char] if end_char <= len(text) else text[start_char:]
 
 def save_summary(source_id: str, sentences_data: List[Dict]) -> str:
-    """Save summary data to database with upsert"""
+    """Replace the source's summary, sentences and citations in one transaction (bulk inserts)"""
+    # Inside a queue job: do not overwrite a summary the reclaiming worker is building
+    ensure_lease()
     session = SessionLocal()
     try:
-        # Delete existing summary for this source
-        session.query(Summary).filter(Summary.source_id == source_id).delete()
-        
-        # Create new summary
-        summary = Summary(source_id=source_id, text="")
-        session.add(summary)
-        session.flush()
-        
-        # Add sentences and citations
-        for sentence_data in sentences_data:
-            sentence = SummarySentence(
-                summary_id=summary.id,
-                order_index=sentence_data["order_index"],
-                sentence_text=sentence_data["sentence_text"],
-                support_status=sentence_data["support_status"]
-            )
-            session.add(sentence)
-            session.flush()
-            
-            # Add citations
-            for citation_data in sentence_data["citations"]:
-                citation = SummarySentenceCitation(
-                    sentence_id=sentence.id,
-                    chunk_id=citation_data["chunk_id"],
-                    start_char=citation_data["start_char"],
-                    end_char=citation_data["end_char"],
-                    score=citation_data["score"],
-                    preview_text=citation_data.get("preview_text")
-                )
-                session.add(citation)
-        
+        summary_id = summary_store.replace_summary(session, source_id, sentences_data)
         session.commit()
-        return summary.id
+        return summary_id
     except Exception as e:
         session.rollback()
         raise e
@@ -280,45 +301,13 @@ async def build_summary_inline(source_id: str, top_k: int, thresh: float, model:
         log.info(f"[builder] Found {len(chunks)} chunks for source: {source_id}")
         
         # 2) Generate candidate sentences from source (LLM)
-        sentences = llm_generate_sentences(chunks, model)
+        sentences = await allm_generate_sentences(chunks, model)
         if not sentences:
             raise RuntimeError("Model produced no sentences")
         
         log.info(f"[builder] Generated {len(sentences)} candidate sentences")
         
-        # 3) For each sentence, retrieve top_k chunks (embedding/semantic search)
-        out = []
-        for i, sentence in enumerate(sentences):
-            hits = search_chunks(source_id, sentence, top_k)
-            support = "insufficient"
-            cits = []
-            
-            if hits:
-                best = hits[0]
-                if best[1] >= thresh:  # similarity score
-                    support = "supported"
-                    # Ensure preview_text is populated; if spans are missing, slice first 200 chars
-                    preview = best[4] if best[4] else slice_preview(get_chunk_text(best[0]), best[2] or 0, best[3] or 200)
-                    cits = [{
-                        "chunk_id": best[0],
-                        "score": round(best[1], 4),
-                        "start_char": best[2] or 0,
-                        "end_char": best[3] or min(220, len(get_chunk_text(best[0]))),
-                        "preview_text": preview
-                    }]
-            
-            out.append({
-                "order_index": i,
-                "sentence_text": sentence.strip(),
-                "support_status": support,
-                "citations": cits
-            })
-            
-            log.debug(f"[builder] Sentence {i}: {support} (score: {hits[0][1] if hits else 0:.3f}, threshold: {thresh})")
-        
-        # 4) Persist (summary, sentences, citations) in a transaction
-        summary_id = save_summary(source_id, out)
-        log.info(f"[builder] Saved summary={summary_id} source={source_id} sentences={len(out)} thresh={thresh} top_k={top_k}")
+        summary_id = _finish_summary(source_id, sentences, top_k, thresh)
         
         from types import SimpleNamespace
         return SimpleNamespace(summary_id=summary_id)
@@ -326,3 +315,88 @@ async def build_summary_inline(source_id: str, top_k: int, thresh: float, model:
     except Exception as e:
         log.exception(f"[builder] Failed to build summary for source={source_id}: {e}")
         raise e
+
+def build_summary_batched(job_id: str, source_id: str, top_k: int, thresh: float, model: str):
+    """Build a summary with the sentence generation done by the batch lane
+    
+    The first run queues the LLM request and defers the job; later runs defer
+    again until the batch lane has the completion, then finish the build.
+    
+    Returns:
+        The summary, or None if the batch request failed (build it interactively instead)
+    
+    Raises:
+        JobDeferred: While the completion is not available yet
+    """
+    entry = batch_lane.get(job_id)
+    if entry is None:
+        chunks = get_chunks_for_source(source_id)
+        if not chunks:
+            raise RuntimeError("No chunks found for this source")
+        batch_lane.submit(job_id, _sentence_request(chunks, model))
+        log.info(f"[builder] Queued sentence generation for source={source_id} on the batch lane")
+        raise JobDeferred(batch_lane.BATCH_LANE_JOB_POLL_SECONDS, stage=STAGE_BATCHED)
+    if not batch_lane.is_done(entry):
+        raise JobDeferred(batch_lane.BATCH_LANE_JOB_POLL_SECONDS, stage=STAGE_BATCHED)
+    if entry["status"] == batch_lane.STATUS_FAILED:
+        log.warning(f"[builder] Batch request failed for source={source_id}: {entry['error']}")
+        return None
+    
+    from openai.types.chat import ChatCompletion
+    response = ChatCompletion.model_validate(entry["response"])
+    usage_meter.record_response(model, response, entry["updated_at"] - entry["created_at"])
+    try:
+        sentences = _parse_sentences(response)
+    except Exception as e:
+        raise _sentence_error(e)
+    if not sentences:
+        raise RuntimeError("Model produced no sentences")
+    
+    from types import SimpleNamespace
+    return SimpleNamespace(summary_id=_finish_summary(source_id, sentences, top_k, thresh))
+
+def _finish_summary(source_id: str, sentences: List[str], top_k: int, thresh: float) -> str:
+    """Cite, persist and index generated summary sentences; returns the summary id
+
+    `thresh` applies to BM25 scores; embedding scores use EMBEDDING_THRESH.
+    """
+    # 3) For each sentence, retrieve top_k chunks (embedding/semantic search)
+    out = []
+    all_hits, semantic = _search_chunks_batch(source_id, sentences, top_k)
+    if semantic:
+        thresh = EMBEDDING_THRESH
+    for i, (sentence, hits) in enumerate(zip(sentences, all_hits)):
+        support = "insufficient"
+        cits = []
+        
+        if hits:
+            best = hits[0]
+            if best[1] >= thresh:  # similarity score
+                support = "supported"
+                # Ensure preview_text is populated; if spans are missing, slice first 200 chars
+                preview = best[4] if best[4] else slice_preview(get_chunk_text(best[0]), best[2] or 0, best[3] or 200)
+                cits = [{
+                    "chunk_id": best[0],
+                    "score": round(best[1], 4),
+                    "start_char": best[2] or 0,
+                    "end_char": best[3] or min(220, len(get_chunk_text(best[0]))),
+                    "preview_text": preview
+                }]
+        
+        out.append({
+            "order_index": i,
+            "sentence_text": sentence.strip(),
+            "support_status": support,
+            "citations": cits
+        })
+        
+        log.debug(f"[builder] Sentence {i}: {support} (score: {hits[0][1] if hits else 0:.3f}, threshold: {thresh})")
+    
+    # 4) Persist (summary, sentences, citations) in a transaction
+    summary_id = save_summary(source_id, out)
+    log.info(f"[builder] Saved summary={summary_id} source={source_id} sentences={len(out)} thresh={thresh} top_k={top_k}")
+    
+    # 5) Make the summary reusable for byte-identical uploads
+    file_path = Path("uploads") / f"{source_id}.pdf"
+    content_index.store_summary(content_index.get_pdf_hash(source_id, str(file_path)), source_id, out)
+    return summary_id
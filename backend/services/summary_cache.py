@@ -0,0 +1,115 @@
+"""
+Summary Response Cache
+
+GET /summaries keeps the serialized response (with an ETag) in a per-process
+cache, so a repeat view skips the joined summary query and serialization.
+
+Every summary replacement gets a new summary id, which is the cache's
+version: a cached body is only served while the source's current summary id
+still matches it, so rebuilds committed by another process (e.g. a
+standalone job_worker) are picked up on the next read. Committing a
+replacement in this process also drops the entry right away.
+"""
+
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Configuration
+SUMMARY_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_RESPONSE_CACHE_MAX_ENTRIES", "256"))
+SUMMARY_RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("SUMMARY_RESPONSE_CACHE_TTL_SECONDS", "300"))
+
+
+class SummaryResponseCache:
+    """
+    Serialized GET /summaries responses and their ETags, by source, each
+    tagged with the summary id it was built from. LRU with a TTL. Thread-safe.
+
+    `generation()` is read before loading from the database and passed to
+    `put`, which refuses the body if an invalidation happened in between.
+    """
+
+    def __init__(self, max_entries: int = SUMMARY_RESPONSE_CACHE_MAX_ENTRIES, ttl: float = SUMMARY_RESPONSE_CACHE_TTL_SECONDS):
+        self._entries: "OrderedDict[str, Tuple[float, str, str, bytes]]" = OrderedDict()
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._generation = 0
+        self._lock = Lock()
+        self._counters = {"hits": 0, "misses": 0, "stale": 0, "invalidations": 0}
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def get(self, source_id: str, summary_id: str) -> Optional[Tuple[str, bytes]]:
+        with self._lock:
+            entry = self._entries.get(source_id)
+            if entry is not None and entry[1] != summary_id:
+                # Replaced since it was cached (possibly by another process)
+                self._counters["stale"] += 1
+                entry = None
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(source_id, None)
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(source_id)
+            self._counters["hits"] += 1
+            return entry[2], entry[3]
+
+    def put(self, source_id: str, summary_id: str, body: bytes, generation: int) -> Tuple[str, bytes]:
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        with self._lock:
+            if generation == self._generation:
+                self._entries[source_id] = (time.monotonic() + self._ttl, summary_id, etag, body)
+                self._entries.move_to_end(source_id)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return etag, body
+
+    def invalidate(self, source_id: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(source_id, None)
+            self._counters["invalidations"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), **self._counters}
+
+
+# Global cache instance
+_response_cache = SummaryResponseCache()
+
+
+def cache_generation() -> int:
+    return _response_cache.generation()
+
+
+def cached_response(source_id: str, summary_id: str) -> Optional[Tuple[str, bytes]]:
+    """(ETag, JSON body) of the cached GET /summaries response, if it was built from `summary_id`."""
+    return _response_cache.get(source_id, summary_id)
+
+
+def cache_response(source_id: str, summary_id: str, body: bytes, generation: int) -> Tuple[str, bytes]:
+    """Cache a serialized response of summary `summary_id` read at `generation`; returns (ETag, body)."""
+    return _response_cache.put(source_id, summary_id, body, generation)
+
+
+def invalidate(source_id: str) -> None:
+    _response_cache.invalidate(source_id)
+
+
+def invalidate_on_commit(session: Session, source_id: str) -> None:
+    """Drop the source's cached response once `session` commits (nothing on rollback)."""
+    # Not before the commit, or a reader could cache the old tree again
+    event.listen(session, "after_commit", lambda _session: invalidate(source_id), once=True)
+
+
+def get_stats() -> Dict[str, int]:
+    return _response_cache.stats()
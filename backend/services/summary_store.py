@@ -0,0 +1,160 @@
+"""
+Summary Persistence
+
+Writes a whole summary tree (summary, sentences, citations) in one
+transaction with a handful of statements, however many sentences it has:
+
+- IDs are generated client-side (uuid4), so no flush is needed to learn a
+  parent's id before inserting its children
+- The source's previous summary tree is deleted explicitly (citations,
+  sentences, summaries), without relying on ON DELETE CASCADE, which
+  SQLite only honours with foreign keys enabled
+- Sentences and citations are each one bulk INSERT (executemany /
+  insertmanyvalues), instead of one round-trip per row
+
+The caller owns the session and commits it, so readers see either the old
+summary or the new one, never a partial tree.
+
+Reads load the tree in one joined query. Every replacement gets a new
+summary id, which versions the cached GET /summaries response (see
+services/summary_cache); committing a replacement in this process also
+drops the cached response right away.
+"""
+
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from models import Summary, SummarySentence, SummarySentenceCitation
+from services.summary_cache import invalidate_on_commit
+
+
+# ============================================================================
+# Writes
+# ============================================================================
+
+def replace_summary(session: Session, source_id: str, sentences_data: List[Dict], text: str = "") -> str:
+    """
+    Replace the summary of `source_id` with a new one (uncommitted); returns its id.
+
+    Args:
+        session: Session to write in; the caller commits or rolls back
+        source_id: Source the summary belongs to
+        sentences_data: Dicts with order_index, sentence_text, support_status and
+            citations (dicts with chunk_id, start_char, end_char, score and
+            optionally preview_text)
+        text: Summary text
+    """
+    summary_id = str(uuid.uuid4())
+    sentence_rows = []
+    citation_rows = []
+    for sentence_data in sentences_data:
+        sentence_id = str(uuid.uuid4())
+        sentence_rows.append({
+            "id": sentence_id,
+            "summary_id": summary_id,
+            "order_index": sentence_data["order_index"],
+            "sentence_text": sentence_data["sentence_text"],
+            "support_status": sentence_data["support_status"],
+        })
+        for citation_data in sentence_data["citations"]:
+            citation_rows.append({
+                "id": str(uuid.uuid4()),
+                "sentence_id": sentence_id,
+                "chunk_id": citation_data["chunk_id"],
+                "start_char": citation_data["start_char"],
+                "end_char": citation_data["end_char"],
+                "score": citation_data["score"],
+                "preview_text": citation_data.get("preview_text"),
+            })
+
+    old_summaries = select(Summary.id).where(Summary.source_id == source_id)
+    old_sentences = select(SummarySentence.id).where(SummarySentence.summary_id.in_(old_summaries))
+    session.execute(
+        delete(SummarySentenceCitation).where(SummarySentenceCitation.sentence_id.in_(old_sentences)),
+        execution_options={"synchronize_session": False},
+    )
+    session.execute(
+        delete(SummarySentence).where(SummarySentence.summary_id.in_(old_summaries)),
+        execution_options={"synchronize_session": False},
+    )
+    session.execute(
+        delete(Summary).where(Summary.source_id == source_id),
+        execution_options={"synchronize_session": False},
+    )
+
+    session.execute(insert(Summary), [{"id": summary_id, "source_id": source_id, "text": text}])
+    if sentence_rows:
+        session.execute(insert(SummarySentence), sentence_rows)
+    if citation_rows:
+        session.execute(insert(SummarySentenceCitation), citation_rows)
+
+    invalidate_on_commit(session, source_id)
+    return summary_id
+
+
+# ============================================================================
+# Reads
+# ============================================================================
+
+def current_summary_id(session: Session, source_id: str) -> Optional[str]:
+    """Id of the source's summary (None if it has none); changes on every replacement."""
+    return session.execute(select(Summary.id).where(Summary.source_id == source_id).limit(1)).scalar()
+
+
+def load_summary(session: Session, source_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The source's summary with sentences and citations, in one joined query.
+
+    Returns None if the source has no summary. Citations are ordered by score;
+    their preview_text may be None (older rows), for the caller to fill in.
+    """
+    summary_id = select(Summary.id).where(Summary.source_id == source_id).limit(1).scalar_subquery()
+    rows = session.execute(
+        select(
+            Summary.id,
+            SummarySentence.id,
+            SummarySentence.order_index,
+            SummarySentence.sentence_text,
+            SummarySentence.support_status,
+            SummarySentenceCitation.chunk_id,
+            SummarySentenceCitation.start_char,
+            SummarySentenceCitation.end_char,
+            SummarySentenceCitation.score,
+            SummarySentenceCitation.preview_text,
+        )
+        .select_from(Summary)
+        .outerjoin(SummarySentence, SummarySentence.summary_id == Summary.id)
+        .outerjoin(SummarySentenceCitation, SummarySentenceCitation.sentence_id == SummarySentence.id)
+        .where(Summary.id == summary_id)
+        .order_by(SummarySentence.order_index, SummarySentenceCitation.score.desc())
+    ).all()
+    if not rows:
+        return None
+
+    sentences: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+    for (_, sentence_id, order_index, sentence_text, support_status,
+         chunk_id, start_char, end_char, score, preview_text) in rows:
+        if sentence_id is None:
+            continue  # summary without sentences
+        sentence = sentences.get(sentence_id)
+        if sentence is None:
+            sentence = sentences[sentence_id] = {
+                "id": sentence_id,
+                "order_index": order_index,
+                "sentence_text": sentence_text,
+                "support_status": support_status,
+                "citations": [],
+            }
+        if chunk_id is not None:
+            sentence["citations"].append({
+                "chunk_id": chunk_id,
+                "start_char": start_char,
+                "end_char": end_char,
+                "score": score,
+                "preview_text": preview_text,
+            })
+    return {"summary_id": rows[0][0], "source_id": source_id, "sentences": list(sentences.values())}
@@ -13,7 +13,7 @@ SECURITY:
 
 import os
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import requests
 
 logger = logging.getLogger(__name__)
@@ -227,6 +227,34 @@ def consume_quota(
         raise RuntimeError(f"Quota check failed: {str(e)}")
 
 
+def reconcile_quota_usage(adjustments: List[Dict[str, Any]]) -> int:
+    """
+    Call the reconcile_quota_usage RPC function with a batch of adjustments.
+    
+    Each adjustment moves a user's daily/monthly token counters by the
+    difference between the tokens actually used and the tokens reserved by
+    consume_quota (negative deltas refund unused reservations).
+    
+    Args:
+        adjustments: [{"user_id": str, "tokens_delta": int}, ...]
+        
+    Returns:
+        Number of users adjusted
+        
+    Raises:
+        RuntimeError: If Supabase is not configured or the RPC fails
+    """
+    if not adjustments:
+        return 0
+    result = call_rpc("reconcile_quota_usage", {"p_adjustments": adjustments})
+    if isinstance(result, list):
+        result = result[0] if result else 0
+    try:
+        return int(result)
+    except (TypeError, ValueError):
+        return len(adjustments)
+
+
 def get_user_quota_status(user_id: str) -> Dict[str, Any]:
     """
     Get current quota status for a user (read-only).
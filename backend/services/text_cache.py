@@ -0,0 +1,269 @@
+"""
+Extracted-Text Artifact Cache
+
+Extracting a PDF with PyPDF2 is the most expensive non-LLM step in the
+backend, and the summary pipeline used to repeat it for every chunk search
+and citation preview. This cache extracts each source once:
+
+1. In-memory LRU keyed by content hash, bounded by a byte budget
+2. On-disk text artifact (uploads/text/<content_hash>.txt) shared across
+   processes and restarts
+3. Full extraction via pdf_processor as the last resort
+
+Sources are resolved to their content hash (recorded at upload time), so
+byte-identical uploads share one artifact.
+
+Only a complete extraction is stored under the content hash. A PDF longer
+than MAX_PDF_PAGES is stored under a key that includes the page cap
+(<content_hash>.p<cap>.txt), so raising the cap extracts it again. Text cut
+short by the extraction time limit is returned to the caller but never
+cached; the next call extracts again.
+"""
+
+import os
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Any
+
+from pdf_processor import MAX_PDF_PAGES, extract_pdf_text
+from services import content_index
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
+TEXT_ARTIFACT_DIR = Path(os.getenv("TEXT_ARTIFACT_DIR", str(UPLOAD_DIR / "text")))
+TEXT_CACHE_MAX_BYTES = int(os.getenv("TEXT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 64MB
+TEXT_CACHE_MAX_SOURCES = int(os.getenv("TEXT_CACHE_MAX_SOURCES", "4096"))  # memoized source -> hash
+
+
+class TextCache:
+    """
+    In-memory LRU of extracted text with a byte budget, backed by disk artifacts.
+
+    Thread-safe. Concurrent requests for the same content hash wait for a
+    single extraction instead of each parsing the PDF. Per-hash locks only
+    exist while an extraction is pending, and the source -> hash memo is an
+    LRU of at most `max_sources` entries, so neither grows with the number
+    of sources ever seen.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = TEXT_CACHE_MAX_BYTES,
+        artifact_dir: Path = TEXT_ARTIFACT_DIR,
+        max_sources: int = TEXT_CACHE_MAX_SOURCES,
+    ):
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._source_hashes: "OrderedDict[str, str]" = OrderedDict()
+        self._max_sources = max_sources
+        self._bytes = 0
+        self._max_bytes = max_bytes
+        self._artifact_dir = Path(artifact_dir)
+        self._lock = Lock()
+        self._key_locks: Dict[str, Lock] = {}
+        self._pending: Dict[str, int] = {}
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "extractions": 0, "partial_extractions": 0, "evictions": 0}
+
+    # ------------------------------------------------------------------
+    # Memory layer
+    # ------------------------------------------------------------------
+
+    def _get_memory(self, content_hash: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(content_hash)
+            if text is not None:
+                self._entries.move_to_end(content_hash)
+                self._counters["memory_hits"] += 1
+            return text
+
+    def _put_memory(self, content_hash: str, text: str) -> None:
+        size = len(text.encode("utf-8"))
+        if size > self._max_bytes:
+            return  # Larger than the whole budget, keep it on disk only
+        with self._lock:
+            if content_hash in self._entries:
+                self._entries.move_to_end(content_hash)
+                return
+            self._entries[content_hash] = text
+            self._sizes[content_hash] = size
+            self._bytes += size
+            while self._bytes > self._max_bytes and self._entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(evicted)
+                self._counters["evictions"] += 1
+
+    # ------------------------------------------------------------------
+    # Disk layer
+    # ------------------------------------------------------------------
+
+    def _artifact_path(self, content_hash: str) -> Path:
+        return self._artifact_dir / f"{content_hash}.txt"
+
+    def _read_artifact(self, content_hash: str) -> Optional[str]:
+        path = self._artifact_path(content_hash)
+        try:
+            return path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def _write_artifact(self, content_hash: str, text: str) -> None:
+        path = self._artifact_path(content_hash)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.part")
+            tmp_path.write_text(text, encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write text artifact {path}: {e}")
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _keys(content_hash: str):
+        """Cache keys to look up, best first: the full text, then the page-capped text."""
+        return content_hash, f"{content_hash}.p{MAX_PDF_PAGES}"
+
+    def resolve_hash(self, source_id: str) -> Optional[str]:
+        """Map a source id to the content hash of its PDF."""
+        with self._lock:
+            content_hash = self._source_hashes.get(source_id)
+            if content_hash:
+                self._source_hashes.move_to_end(source_id)
+                return content_hash
+        file_path = UPLOAD_DIR / f"{source_id}.pdf"
+        content_hash = content_index.get_pdf_hash(source_id, str(file_path))
+        if content_hash:
+            with self._lock:
+                self._source_hashes[source_id] = content_hash
+                self._source_hashes.move_to_end(source_id)
+                while len(self._source_hashes) > self._max_sources:
+                    self._source_hashes.popitem(last=False)
+        return content_hash
+
+    def peek(self, source_id: str, wait: bool = False) -> Optional[str]:
+        """
+        Return cached text (memory or disk) without extracting.
+
+        With `wait=True`, an extraction already running for this content
+        (e.g. the eager one started at upload) is awaited instead of
+        reporting a miss.
+        """
+        content_hash = self.resolve_hash(source_id)
+        if not content_hash:
+            return None
+        if wait:
+            with self._lock:
+                key_lock = self._key_locks.get(content_hash)
+            if key_lock is not None:
+                with key_lock:
+                    pass
+        for key in self._keys(content_hash):
+            text = self._get_memory(key)
+            if text is None:
+                text = self._read_artifact(key)
+                if text is not None:
+                    with self._lock:
+                        self._counters["disk_hits"] += 1
+                    self._put_memory(key, text)
+            if text is not None:
+                return text
+        return None
+
+    def get(self, source_id: str) -> str:
+        """
+        Return the full extracted text of a source, extracting at most once.
+
+        Raises:
+            RuntimeError: If the PDF is missing or has no extractable text
+        """
+        file_path = UPLOAD_DIR / f"{source_id}.pdf"
+        content_hash = self.resolve_hash(source_id)
+        if not content_hash:
+            raise RuntimeError("PDF file not found")
+
+        text = self.peek(source_id)
+        if text is not None:
+            return text
+
+        # Single-flight: one extraction per content hash. The lock is shared by
+        # the callers pending on this hash and dropped when the last one is done
+        with self._lock:
+            self._pending[content_hash] = self._pending.get(content_hash, 0) + 1
+            key_lock = self._key_locks.setdefault(content_hash, Lock())
+        try:
+            with key_lock:
+                text = self.peek(source_id)
+                if text is not None:
+                    return text
+
+                if not file_path.exists():
+                    raise RuntimeError("PDF file not found")
+
+                extraction = extract_pdf_text(str(file_path))
+                text = extraction.text
+                if not text.strip():
+                    raise RuntimeError("No text could be extracted from PDF")
+
+                with self._lock:
+                    self._counters["extractions"] += 1
+                if extraction.timed_out:
+                    with self._lock:
+                        self._counters["partial_extractions"] += 1
+                    logger.warning(
+                        f"Extraction of source {source_id} timed out after {extraction.pages_read}/"
+                        f"{extraction.total_pages} pages; returning partial text without caching it"
+                    )
+                    return text
+
+                key = content_hash if extraction.complete else self._keys(content_hash)[1]
+                self._write_artifact(key, text)
+                self._put_memory(key, text)
+                logger.info(f"Extracted and cached text for source {source_id}: {len(text)} chars "
+                            f"({extraction.pages_read}/{extraction.total_pages} pages)")
+                return text
+        finally:
+            with self._lock:
+                self._pending[content_hash] -= 1
+                if not self._pending[content_hash]:
+                    del self._pending[content_hash]
+                    del self._key_locks[content_hash]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "sources": len(self._source_hashes),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+            }
+
+
+# Global cache instance
+_text_cache = TextCache()
+
+
+def get_source_text(source_id: str) -> str:
+    """Full extracted text for a source (memory -> disk artifact -> extraction)."""
+    return _text_cache.get(source_id)
+
+
+def peek_source_text(source_id: str, wait: bool = False) -> Optional[str]:
+    """Cached text for a source, or None if it was never extracted."""
+    return _text_cache.peek(source_id, wait=wait)
+
+
+def resolve_source_hash(source_id: str) -> Optional[str]:
+    """Content hash of a source's PDF (memoized per process)."""
+    return _text_cache.resolve_hash(source_id)
+
+
+def get_stats() -> Dict[str, Any]:
+    """Cache counters for this process."""
+    return _text_cache.stats()
@@ -0,0 +1,282 @@
+"""
+Token Budgeting
+
+Prompt budgets used to be character limits (8000 chars for flashcards,
+50000 for transcripts, [:4000] for summaries). Characters misestimate tokens
+badly for code, math and non-English text, so call sites now budget in
+tokens through this module:
+
+- `count_tokens` uses the model's tokenizer (tiktoken) when it is installed,
+  and a fast heuristic estimate otherwise; counts are LRU-cached by a
+  fingerprint of the text (not the text itself), so re-counting the same
+  source text or prompt template is free
+- `truncate_to_tokens` cuts text at the last whole token/word that fits
+- `fit_text` trims a variable part (source text, transcript) so the whole
+  prompt fits an exact token budget
+- `record` keeps per-call-site counters of the prompt tokens actually sent
+"""
+
+import os
+import re
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+DEFAULT_MODEL = os.getenv("TOKEN_BUDGET_MODEL", "gpt-4o-mini")
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "4096"))
+TOKEN_BUDGET_USE_TOKENIZER = os.getenv("TOKEN_BUDGET_USE_TOKENIZER", "true").lower() == "true"
+
+# Chat format overhead (role/separator tokens), per message and per reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+# ============================================================================
+# Tokenizer
+# ============================================================================
+
+_encodings: Dict[str, Any] = {}
+_encodings_lock = Lock()
+
+
+def _encoding(model: str):
+    """The tiktoken encoding for a model, or None when counting by estimate."""
+    if tiktoken is None or not TOKEN_BUDGET_USE_TOKENIZER:
+        return None
+    encoding = _encodings.get(model)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(model)
+            if encoding is None:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    # Newer models: fall back to the 4o family encoding
+                    encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    # Encodings are downloaded on first use; offline hosts estimate instead
+                    logger.warning(f"Tokenizer unavailable for {model}, using estimates: {e}")
+                    encoding = False
+                _encodings[model] = encoding
+    return encoding or None
+
+
+def tokenizer_available(model: str = DEFAULT_MODEL) -> bool:
+    return _encoding(model) is not None
+
+
+# ============================================================================
+# Estimate
+# ============================================================================
+
+# One match per piece the estimate prices separately
+_PIECE_RE = re.compile(
+    r"\s*[A-Za-z]+"                      # English-like words (with their leading space)
+    r"|\s*[0-9]+"                        # digit runs
+    r"|[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]"  # kana, CJK and hangul: about a token each
+    r"|\s*[^\x00-\x7f\s]+"               # other non-ASCII words (accented, Cyrillic, ...)
+    r"|\n+"                              # line breaks
+    r"|\s+"                              # other whitespace
+    r"|."                                # punctuation, operators, symbols
+)
+
+
+def _piece_tokens(piece: str) -> int:
+    word = piece.lstrip()
+    if not word:
+        # Indentation and line breaks are cheap, but never free
+        return 1
+    first = word[0]
+    if first.isascii() and first.isalpha():
+        return (len(word) + 5) // 6
+    if first.isdigit():
+        # Numbers are split into groups of up to three digits
+        return (len(word) + 2) // 3
+    if first.isascii():
+        return 1
+    if len(word) == 1 and ("\u3040" <= first <= "\u9fff" or "\uac00" <= first <= "\ud7af"):
+        return 1
+    return (len(word) + 1) // 2
+
+
+def _pieces(text: str) -> Iterator[Tuple[int, int]]:
+    """Yield (end offset, estimated tokens) for each piece of `text`."""
+    for match in _PIECE_RE.finditer(text):
+        yield match.end(), _piece_tokens(match.group())
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast tokenizer-free estimate (errs high for code and symbols)."""
+    return sum(tokens for _, tokens in _pieces(text))
+
+
+# ============================================================================
+# Counting and truncation
+# ============================================================================
+
+class TokenCountCache:
+    """
+    LRU of token counts keyed by (model, length, hash) of the text.
+
+    Only the fingerprint is kept, so caching counts of whole documents does
+    not pin their text in memory. Thread-safe.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_COUNT_CACHE_SIZE):
+        self._entries: "OrderedDict[tuple, int]" = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    def get(self, key: tuple) -> Optional[int]:
+        with self._lock:
+            count = self._entries.get(key)
+            if count is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return count
+
+    def put(self, key: tuple, count: int) -> None:
+        with self._lock:
+            self._entries[key] = count
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), **self._counters}
+
+
+# Global count cache instance
+_count_cache = TokenCountCache()
+
+
+def count_tokens(text: Optional[str], model: str = DEFAULT_MODEL) -> int:
+    """Tokens in `text` for `model` (exact with tiktoken, estimated otherwise)."""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    key = (model if encoding is not None else None, len(text), hash(text))
+    count = _count_cache.get(key)
+    if count is None:
+        if encoding is not None:
+            count = len(encoding.encode(text, disallowed_special=()))
+        else:
+            count = estimate_tokens(text)
+        _count_cache.put(key, count)
+    return count
+
+
+def count_message_tokens(messages: Iterable[Dict[str, Any]], model: str = DEFAULT_MODEL) -> int:
+    """Prompt tokens of a chat request, including the chat format overhead."""
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE
+        content = message.get("content")
+        if isinstance(content, str):
+            total += count_tokens(content, model)
+    return total
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """The longest prefix of `text` that fits in `max_tokens`."""
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = _encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
+
+    used = 0
+    cut = 0
+    for end, tokens in _pieces(text):
+        if used + tokens > max_tokens:
+            return text[:cut]
+        used += tokens
+        cut = end
+    return text
+
+
+def fit_text(
+    text: str,
+    max_tokens: int,
+    fixed: Iterable[str] = (),
+    model: str = DEFAULT_MODEL,
+) -> Tuple[str, int]:
+    """
+    Trim `text` so it fits in a prompt together with the fixed parts.
+
+    Args:
+        text: Variable part of the prompt (source text, transcript, ...)
+        max_tokens: Budget for the whole prompt
+        fixed: Instructions, system message and other parts sent as-is
+        model: Model whose tokenizer to count with
+
+    Returns:
+        (text, prompt_tokens): the trimmed text and the tokens of the whole prompt
+    """
+    fixed = list(fixed)
+    overhead = TOKENS_PER_REPLY + TOKENS_PER_MESSAGE * max(1, len(fixed))
+    fixed_tokens = overhead + sum(count_tokens(part, model) for part in fixed)
+    available = max(0, max_tokens - fixed_tokens)
+    text_tokens = count_tokens(text, model)
+    if text_tokens > available:
+        text = truncate_to_tokens(text, available, model)
+        text_tokens = count_tokens(text, model)
+    return text, fixed_tokens + text_tokens
+
+
+# ============================================================================
+# Reporting
+# ============================================================================
+
+class TokenBudgetStats:
+    """Per-call-site counters of prompt tokens sent."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._sites: Dict[str, Dict[str, int]] = {}
+
+    def record(self, site: str, prompt_tokens: int, truncated: bool) -> None:
+        with self._lock:
+            counters = self._sites.setdefault(site, {"calls": 0, "prompt_tokens": 0, "truncated": 0})
+            counters["calls"] += 1
+            counters["prompt_tokens"] += prompt_tokens
+            counters["truncated"] += int(truncated)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {site: dict(counters) for site, counters in self._sites.items()}
+
+
+# Global stats instance
+_stats = TokenBudgetStats()
+
+
+def record(site: str, prompt_tokens: int, truncated: bool = False) -> None:
+    """Report the prompt tokens a call site is about to send."""
+    _stats.record(site, prompt_tokens, truncated)
+    logger.info(f"[tokens] {site}: sending {prompt_tokens} prompt tokens{' (truncated)' if truncated else ''}")
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        "tokenizer": tokenizer_available(),
+        "sites": _stats.snapshot(),
+        "count_cache": _count_cache.stats(),
+    }
+
@@ -5,7 +5,7 @@ Cleans raw VTT/SRT transcripts using OpenAI to remove timestamps,
 formatting artifacts, and produce readable text.
 
 Security considerations:
-- Input is truncated to prevent cost attacks
+- Input is truncated to a token budget to prevent cost attacks
 - Timeout configured for OpenAI calls
 - Error handling for all OpenAI-related failures
 """
@@ -13,14 +13,15 @@ Security considerations:
 import os
 import re
 import logging
-import httpx
 from typing import Optional
 from openai import OpenAI, RateLimitError, APITimeoutError, APIError, AuthenticationError
 
+from services import llm_gateway, token_budget
+
 logger = logging.getLogger(__name__)
 
 # Configuration
-MAX_TRANSCRIPT_CHARS = int(os.getenv("MAX_TRANSCRIPT_CHARS", "50000"))  # ~12k tokens
+MAX_TRANSCRIPT_TOKENS = int(os.getenv("MAX_TRANSCRIPT_TOKENS", "12000"))
 OPENAI_TIMEOUT_SECONDS = int(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
 
 
@@ -31,17 +32,13 @@ class TranscriptCleaningError(Exception):
 
 def get_openai_client() -> OpenAI:
     """
-    Get OpenAI client with proper configuration.
-    Includes timeout settings and custom HTTP client.
+    Get the shared OpenAI client from the LLM gateway.
+    Timeouts and connection pooling are configured there.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    if not llm_gateway.is_configured():
         raise TranscriptCleaningError("OpenAI API key not configured")
     
-    # Create HTTP client with timeout
-    http_client = httpx.Client(timeout=OPENAI_TIMEOUT_SECONDS)
-    
-    return OpenAI(api_key=api_key, http_client=http_client)
+    return llm_gateway.get_client()
 
 
 def clean_transcript_with_openai(raw_vtt: str) -> str:
@@ -68,11 +65,11 @@ def clean_transcript_with_openai(raw_vtt: str) -> str:
     
     # Truncate if too long (prevent cost attacks)
     original_length = len(raw_vtt)
-    if len(raw_vtt) > MAX_TRANSCRIPT_CHARS:
+    if token_budget.count_tokens(raw_vtt) > MAX_TRANSCRIPT_TOKENS:
+        raw_vtt = token_budget.truncate_to_tokens(raw_vtt, MAX_TRANSCRIPT_TOKENS)
         logger.warning(
-            f"Truncating transcript from {original_length} to {MAX_TRANSCRIPT_CHARS} chars"
+            f"Truncating transcript from {original_length} to {len(raw_vtt)} chars ({MAX_TRANSCRIPT_TOKENS} tokens)"
         )
-        raw_vtt = raw_vtt[:MAX_TRANSCRIPT_CHARS]
     
     # First, try basic regex cleaning (faster, cheaper)
     cleaned = basic_clean_transcript(raw_vtt)
@@ -84,25 +81,32 @@ def clean_transcript_with_openai(raw_vtt: str) -> str:
     
     # Use OpenAI for complex cleaning
     try:
-        client = get_openai_client()
+        get_openai_client()  # Raises TranscriptCleaningError if no API key is configured
+        
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "You are a transcript cleaner. Remove ALL timestamps, "
+                    "formatting codes, speaker labels, and VTT/SRT artifacts. "
+                    "Return ONLY the clean, readable text as natural paragraphs. "
+                    "Preserve the original language. Do not summarize or modify content."
+                )
+            },
+            {
+                "role": "user",
+                "content": f"Clean this transcript:\n\n{raw_vtt}"
+            }
+        ]
+        token_budget.record(
+            "transcript_cleaning",
+            token_budget.count_message_tokens(messages),
+            truncated=len(raw_vtt) < original_length,
+        )
         
-        response = client.chat.completions.create(
+        response = llm_gateway.chat_completion(
             model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a transcript cleaner. Remove ALL timestamps, "
-                        "formatting codes, speaker labels, and VTT/SRT artifacts. "
-                        "Return ONLY the clean, readable text as natural paragraphs. "
-                        "Preserve the original language. Do not summarize or modify content."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": f"Clean this transcript:\n\n{raw_vtt}"
-                }
-            ],
+            messages=messages,
             temperature=0.1,
             max_tokens=4000,
             timeout=OPENAI_TIMEOUT_SECONDS,
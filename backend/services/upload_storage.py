@@ -0,0 +1,113 @@
+"""
+Upload Storage Service
+
+Streams uploaded files to disk in fixed-size chunks instead of buffering
+the whole request body in memory.
+
+- The size limit is enforced while bytes arrive, so oversized uploads are
+  rejected as soon as they cross the limit.
+- A SHA-256 of the content is computed during the copy.
+- Data is written to a temporary file next to the destination and atomically
+  renamed into place, so readers never see a partially written PDF.
+- Disk I/O (write, fsync, rename) and hashing run in worker threads, so the
+  event loop keeps serving other requests during a large upload.
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Tuple
+
+from fastapi import UploadFile
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))  # 10MB
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # 1MB
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds {limit} bytes")
+        self.limit = limit
+
+
+class EmptyUploadError(Exception):
+    """Raised when an upload contains no bytes."""
+    pass
+
+
+async def save_upload_stream(
+    upload: UploadFile,
+    dest_path: Path,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> Tuple[int, str]:
+    """
+    Stream an upload to `dest_path`, enforcing `max_bytes` as data arrives.
+
+    Args:
+        upload: The incoming FastAPI upload
+        dest_path: Final location of the file
+        max_bytes: Maximum allowed size in bytes
+        chunk_size: Number of bytes read per iteration
+
+    Returns:
+        (size_in_bytes, sha256_hexdigest)
+
+    Raises:
+        UploadTooLargeError: If the body exceeds `max_bytes`
+        EmptyUploadError: If the body is empty
+    """
+    dest_path = Path(dest_path)
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    # Temp file lives in the same directory so os.replace() is atomic
+    tmp_path = dest_path.with_name(f".{dest_path.name}.part")
+
+    hasher = hashlib.sha256()
+    size = 0
+
+    def write_chunk(out, chunk: bytes) -> None:
+        hasher.update(chunk)
+        out.write(chunk)
+
+    def finish(out) -> None:
+        out.flush()
+        os.fsync(out.fileno())
+        out.close()
+        os.replace(tmp_path, dest_path)
+
+    out = None
+    try:
+        out = await asyncio.to_thread(open, tmp_path, "wb")
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(max_bytes)
+            await asyncio.to_thread(write_chunk, out, chunk)
+
+        if size == 0:
+            raise EmptyUploadError("File is empty")
+
+        await asyncio.to_thread(finish, out)
+    except BaseException:
+        # Never leave partial files behind (oversized, empty, or aborted uploads)
+        if out is not None:
+            out.close()
+        try:
+            tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+
+    digest = hasher.hexdigest()
+    logger.info(f"Stored upload {dest_path.name}: {size} bytes, sha256={digest[:12]}...")
+    return size, digest
@@ -0,0 +1,339 @@
+"""
+LLM Usage Metering
+
+Records what every OpenAI call actually cost (prompt and completion tokens,
+latency) instead of throwing `response.usage` away, and reconciles the
+quota reserved up front by enforce_quota (QUOTA_RESERVED_TOKENS) against it.
+
+- Job workers open a `usage_scope` per job attempt (user, deck, feature);
+  the LLM gateway calls `record` for every completion, and the scope is
+  found through a context variable, so generators need no extra arguments.
+  Copy the context when fanning out to other threads
+  (contextvars.copy_context().run); asyncio tasks and to_thread do it already.
+- Each call is stored in the local `llm_usage` table for capacity planning.
+- When a scope ends, `actual - reserved` is queued for its user. A background
+  thread flushes queued calls and quota adjustments every
+  USAGE_FLUSH_INTERVAL_SECONDS, sending the adjustments to Supabase in one
+  batched `reconcile_quota_usage` RPC.
+
+Cache hits are recorded with zero tokens: the user is not charged for them.
+Streamed completions carry no usage block, so their tokens are counted
+locally (services/token_budget.py) and flagged as estimated.
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from db import sqlite_engine
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+USAGE_METERING_ENABLED = os.getenv("USAGE_METERING_ENABLED", "true").lower() == "true"
+USAGE_RECONCILE_ENABLED = os.getenv("USAGE_RECONCILE_ENABLED", "true").lower() == "true"
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "10"))
+USAGE_FLUSH_MAX_ROWS = int(os.getenv("USAGE_FLUSH_MAX_ROWS", "500"))
+
+
+# ============================================================================
+# Scopes
+# ============================================================================
+
+class UsageScope:
+    """Attribution and running totals for one unit of work (a job attempt)."""
+
+    def __init__(
+        self,
+        user_id: Optional[str],
+        deck_id: Optional[str],
+        feature: Optional[str],
+        job_id: Optional[str] = None,
+        reserved_tokens: int = 0,
+    ):
+        self.user_id = user_id
+        self.deck_id = deck_id
+        self.feature = feature
+        self.job_id = job_id
+        self.reserved_tokens = reserved_tokens
+        self.deferred = False  # the job will run again: settle the reservation then
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+_current_scope: ContextVar[Optional[UsageScope]] = ContextVar("llm_usage_scope", default=None)
+
+
+@contextmanager
+def usage_scope(
+    user_id: Optional[str],
+    deck_id: Optional[str] = None,
+    feature: Optional[str] = None,
+    job_id: Optional[str] = None,
+    reserved_tokens: int = 0,
+) -> Iterator[UsageScope]:
+    """
+    Attribute LLM calls made inside the block to a user and deck.
+
+    Args:
+        reserved_tokens: Tokens already charged for this work by enforce_quota;
+            on exit the user's quota is adjusted by (actual - reserved)
+    """
+    scope = UsageScope(user_id, deck_id, feature, job_id, reserved_tokens)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+        _close_scope(scope)
+
+
+def set_deck(deck_id: str) -> None:
+    """Attribute the current scope's calls to a deck created mid-job (e.g. YouTube decks)."""
+    scope = _current_scope.get()
+    if scope is not None:
+        scope.deck_id = deck_id
+
+
+def release_reservation(user_id: Optional[str], reserved_tokens: int) -> None:
+    """Refund tokens enforce_quota reserved for work that will not run (e.g. a request that lost a dedupe race)."""
+    if user_id and user_id != "anonymous" and reserved_tokens:
+        _meter.adjust_quota(user_id, -reserved_tokens)
+
+
+def _close_scope(scope: UsageScope) -> None:
+    logger.info(
+        f"[usage] job={scope.job_id} user={scope.user_id} deck={scope.deck_id} feature={scope.feature}: "
+        f"{scope.calls} calls, {scope.prompt_tokens}+{scope.completion_tokens} tokens "
+        f"(reserved {scope.reserved_tokens})"
+    )
+    reserved = 0 if scope.deferred else scope.reserved_tokens
+    if scope.user_id and scope.user_id != "anonymous" and (reserved or scope.calls):
+        _meter.adjust_quota(scope.user_id, scope.total_tokens - reserved)
+
+
+# ============================================================================
+# Meter
+# ============================================================================
+
+def _create_tables(conn) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            user_id TEXT,
+            deck_id TEXT,
+            feature TEXT,
+            job_id TEXT,
+            model TEXT,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            latency_ms INTEGER NOT NULL,
+            cached INTEGER NOT NULL DEFAULT 0,
+            estimated INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_user_created ON llm_usage (user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_deck ON llm_usage (deck_id)")
+
+
+class UsageMeter:
+    """
+    Buffers usage rows and quota adjustments, flushed by a background thread.
+
+    Thread-safe. Failed reconciliations are kept and retried on the next flush.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: List[tuple] = []
+        self._adjustments: Dict[str, int] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._table_ready = False
+        self._counters = {
+            "calls": 0, "cache_hits": 0, "estimated_calls": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": 0,
+            "reconciled_users": 0, "reconcile_failures": 0,
+        }
+        self._by_model: Dict[str, Dict[str, int]] = {}
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="usage-meter", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(USAGE_FLUSH_INTERVAL_SECONDS)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Usage flush failed: {e}")
+
+    def record(
+        self,
+        scope: Optional[UsageScope],
+        model: Optional[str],
+        prompt_tokens: int,
+        completion_tokens: int,
+        latency_ms: int,
+        cached: bool,
+        estimated: bool,
+    ) -> None:
+        if scope is not None:
+            scope.add(prompt_tokens, completion_tokens)
+        row = (
+            time.time(),
+            scope.user_id if scope else None,
+            scope.deck_id if scope else None,
+            scope.feature if scope else None,
+            scope.job_id if scope else None,
+            model, prompt_tokens, completion_tokens, latency_ms, int(cached), int(estimated),
+        )
+        with self._lock:
+            self._rows.append(row)
+            self._counters["calls"] += 1
+            self._counters["cache_hits"] += int(cached)
+            self._counters["estimated_calls"] += int(estimated)
+            self._counters["prompt_tokens"] += prompt_tokens
+            self._counters["completion_tokens"] += completion_tokens
+            self._counters["latency_ms"] += latency_ms
+            per_model = self._by_model.setdefault(model or "unknown", {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            per_model["calls"] += 1
+            per_model["prompt_tokens"] += prompt_tokens
+            per_model["completion_tokens"] += completion_tokens
+            full = len(self._rows) >= USAGE_FLUSH_MAX_ROWS
+        self._ensure_started()
+        if full:
+            self._wake.set()
+
+    def adjust_quota(self, user_id: str, tokens_delta: int) -> None:
+        if not USAGE_RECONCILE_ENABLED or tokens_delta == 0:
+            return
+        with self._lock:
+            self._adjustments[user_id] = self._adjustments.get(user_id, 0) + tokens_delta
+        self._ensure_started()
+
+    def flush(self) -> None:
+        """Write buffered usage rows and send buffered quota adjustments."""
+        with self._lock:
+            rows, self._rows = self._rows, []
+            adjustments, self._adjustments = self._adjustments, {}
+
+        if rows:
+            try:
+                if not self._table_ready:
+                    sqlite_engine.run_write(_create_tables)
+                    self._table_ready = True
+                sqlite_engine.execute_write_many(
+                    "INSERT INTO llm_usage (created_at, user_id, deck_id, feature, job_id, model, "
+                    "prompt_tokens, completion_tokens, latency_ms, cached, estimated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            except Exception as e:
+                logger.warning(f"Failed to store {len(rows)} LLM usage rows: {e}")
+
+        if adjustments:
+            self._reconcile(adjustments)
+
+    def _reconcile(self, adjustments: Dict[str, int]) -> None:
+        from services.supabase_client import reconcile_quota_usage, SUPABASE_CONFIGURED
+        if not SUPABASE_CONFIGURED:
+            return
+        batch = [{"user_id": user_id, "tokens_delta": delta} for user_id, delta in adjustments.items() if delta]
+        try:
+            reconcile_quota_usage(batch)
+            with self._lock:
+                self._counters["reconciled_users"] += len(batch)
+            logger.info(f"[usage] Reconciled quota for {len(batch)} user(s)")
+        except Exception as e:
+            logger.warning(f"Quota reconciliation failed for {len(batch)} user(s), will retry: {e}")
+            with self._lock:
+                self._counters["reconcile_failures"] += 1
+                for user_id, delta in adjustments.items():
+                    self._adjustments[user_id] = self._adjustments.get(user_id, 0) + delta
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self._counters["calls"]
+            return {
+                **self._counters,
+                "avg_latency_ms": round(self._counters["latency_ms"] / calls, 1) if calls else 0.0,
+                "by_model": {model: dict(counters) for model, counters in self._by_model.items()},
+                "pending_rows": len(self._rows),
+                "pending_adjustments": len(self._adjustments),
+            }
+
+
+# Global meter instance
+_meter = UsageMeter()
+
+
+# ============================================================================
+# Recording (called by the LLM gateway)
+# ============================================================================
+
+def record(
+    model: Optional[str],
+    prompt_tokens: int,
+    completion_tokens: int,
+    latency_s: float,
+    cached: bool = False,
+    estimated: bool = False,
+) -> None:
+    """Record one LLM call against the current usage scope."""
+    if not USAGE_METERING_ENABLED:
+        return
+    try:
+        _meter.record(
+            _current_scope.get(), model, int(prompt_tokens or 0), int(completion_tokens or 0),
+            int(latency_s * 1000), cached, estimated,
+        )
+    except Exception as e:
+        # Metering must never fail a generation
+        logger.warning(f"Failed to record LLM usage: {e}")
+
+
+def record_response(model: Optional[str], response, latency_s: float) -> None:
+    """Record a ChatCompletion using its `usage` block."""
+    usage = getattr(response, "usage", None)
+    record(
+        model,
+        getattr(usage, "prompt_tokens", 0) if usage else 0,
+        getattr(usage, "completion_tokens", 0) if usage else 0,
+        latency_s,
+    )
+
+
+def record_cache_hit(model: Optional[str], latency_s: float) -> None:
+    record(model, 0, 0, latency_s, cached=True)
+
+
+def flush() -> None:
+    """Flush buffered usage now (e.g. on shutdown)."""
+    _meter.flush()
+
+
+def get_stats() -> Dict[str, Any]:
+    """Usage counters for this process."""
+    return {"enabled": USAGE_METERING_ENABLED, **_meter.snapshot()}
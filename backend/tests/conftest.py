@@ -0,0 +1,18 @@
+"""
+Shared test setup
+
+App modules read DATABASE_URL and UPLOAD_DIR at import time, so these are
+pointed at a throwaway directory here, before any test module imports them;
+tests never touch the development database or uploads.
+"""
+
+import os
+import sys
+import tempfile
+
+_TEST_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_DIR, 'test.db')}"
+os.environ["UPLOAD_DIR"] = os.path.join(_TEST_DIR, "uploads")
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
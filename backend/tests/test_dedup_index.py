@@ -0,0 +1,176 @@
+"""
+Near-Duplicate Index Tests
+
+Run with: pytest backend/tests/test_dedup_index.py -v
+
+These tests verify:
+1. LSH banding finds pairs at or above DEDUP_THRESHOLD and rarely pairs far below it
+2. The exact Jaccard check decides at the threshold
+3. In-deck and cross-deck deduplication against the SQLite index
+4. Empty results and deleted decks leave / clear the index as expected,
+   only for the user they belong to (deck ids can be shared, e.g. video ids)
+5. filter_cards indexes nothing until the session is committed
+"""
+
+import random
+import uuid
+
+import pytest
+
+from services import dedup_index
+from services.dedup_index import DedupSession, band_keys, jaccard, signature, tokenize
+
+
+@pytest.fixture(scope="module", autouse=True)
+def dedup_tables():
+    dedup_index.init_db()
+    yield
+
+
+@pytest.fixture
+def user():
+    return f"user-{uuid.uuid4()}"
+
+
+def _words(prefix, count):
+    return [f"{prefix}{i}" for i in range(count)]
+
+
+def _text_pair(shared, only_each):
+    """Two texts whose token sets share `shared` tokens and differ in `only_each` tokens each."""
+    common = _words("common", shared)
+    return " ".join(common + _words("left", only_each)), " ".join(common + _words("right", only_each))
+
+
+def _random_pair(rng, shared, only_each):
+    vocab = rng.sample(range(100000), shared + 2 * only_each)
+    common = [f"w{n}" for n in vocab[:shared]]
+    left = common + [f"w{n}" for n in vocab[shared:shared + only_each]]
+    right = common + [f"w{n}" for n in vocab[shared + only_each:]]
+    return set(left), set(right)
+
+
+def _collide(a, b):
+    return bool(set(band_keys(signature(a))) & set(band_keys(signature(b))))
+
+
+class TestLshThreshold:
+    """Test that banding turns the Jaccard threshold into a candidate cutoff."""
+
+    def test_pairs_at_threshold_become_candidates(self):
+        rng = random.Random(7)
+        # 14 shared / 20 total tokens: Jaccard 0.7
+        pairs = [_random_pair(rng, 14, 3) for _ in range(300)]
+        assert all(jaccard(a, b) == pytest.approx(0.7) for a, b in pairs)
+        recall = sum(_collide(a, b) for a, b in pairs) / len(pairs)
+        assert recall >= 0.95
+
+    def test_dissimilar_pairs_rarely_become_candidates(self):
+        rng = random.Random(11)
+        # 4 shared / 20 total tokens: Jaccard 0.2
+        pairs = [_random_pair(rng, 4, 8) for _ in range(300)]
+        false_positives = sum(_collide(a, b) for a, b in pairs) / len(pairs)
+        assert false_positives <= 0.05
+
+    def test_identical_sets_share_every_band(self):
+        tokens = tokenize("What does the mitochondria produce? ATP")
+        assert band_keys(signature(tokens)) == band_keys(signature(set(tokens)))
+
+
+class TestDedupSession:
+    """Test in-deck and cross-deck deduplication decisions."""
+
+    def test_near_duplicate_in_deck_is_dropped(self, user):
+        first, second = _text_pair(shared=18, only_each=2)  # Jaccard 18/22
+        session = DedupSession(user, "deck", cross_deck=False)
+        assert session.add(first) is True
+        assert session.add(second) is False
+        assert session.dropped_in_deck == 1
+
+    def test_at_threshold_is_a_duplicate(self, user):
+        first, second = _text_pair(shared=14, only_each=3)  # Jaccard 14/20 = 0.7
+        session = DedupSession(user, "deck", cross_deck=False, threshold=0.7)
+        assert session.add(first) is True
+        assert session.add(second) is False
+
+    def test_below_threshold_is_kept(self, user):
+        first, second = _text_pair(shared=13, only_each=4)  # Jaccard 13/21
+        session = DedupSession(user, "deck", cross_deck=False, threshold=0.7)
+        assert session.add(first) is True
+        assert session.add(second) is True
+
+    def test_cross_deck_duplicate_is_dropped(self, user):
+        first, second = _text_pair(shared=18, only_each=2)
+        dedup_index.index_deck(user, "deck-a", [{"question": first, "answer": ""}])
+
+        session = DedupSession(user, "deck-b")
+        assert session.add(second) is False
+        assert session.dropped_cross_deck == 1
+
+    def test_other_users_decks_are_ignored(self, user):
+        first, second = _text_pair(shared=18, only_each=2)
+        dedup_index.index_deck(f"other-{user}", "deck-a", [{"question": first, "answer": ""}])
+        assert DedupSession(user, "deck-b").add(second) is True
+
+    def test_deck_being_replaced_is_ignored(self, user):
+        first, _ = _text_pair(shared=18, only_each=2)
+        dedup_index.index_deck(user, "deck-a", [{"question": first, "answer": ""}])
+        assert DedupSession(user, "deck-a").add(first) is True
+
+
+class TestIndexMaintenance:
+    """Test how commits and deck removal change the index."""
+
+    def test_empty_commit_keeps_previous_entries(self, user):
+        first, _ = _text_pair(shared=18, only_each=2)
+        kept_card = "photosynthesis chlorophyll sunlight glucose oxygen leaves"
+        dedup_index.index_deck(user, "deck-a", [{"question": first, "answer": ""}])
+        dedup_index.index_deck(user, "deck-c", [{"question": kept_card, "answer": ""}])
+
+        # A regeneration of deck-c where every card duplicates deck-a stores nothing...
+        assert dedup_index.deduplicate([{"question": first, "answer": ""}], user, "deck-c") == []
+        # ...so deck-c keeps its previous cards, and they still count as duplicates
+        assert DedupSession(user, "deck-d").add(kept_card) is False
+
+    def test_removed_deck_no_longer_suppresses_cards(self, user):
+        first, second = _text_pair(shared=18, only_each=2)
+        dedup_index.index_deck(user, "deck-a", [{"question": first, "answer": ""}])
+        dedup_index.remove_deck(user, "deck-a")
+        assert DedupSession(user, "deck-b").add(second) is True
+
+    def test_shared_deck_id_is_kept_for_other_users(self, user):
+        first, second = _text_pair(shared=18, only_each=2)
+        other = f"other-{user}"
+        dedup_index.index_deck(user, "video-id", [{"question": first, "answer": ""}])
+        dedup_index.index_deck(other, "video-id", [{"question": first, "answer": ""}])
+
+        # Regenerating and then deleting the first user's deck...
+        dedup_index.index_deck(user, "video-id", [{"question": "unrelated words entirely", "answer": ""}])
+        dedup_index.remove_deck(user, "video-id")
+        # ...leaves the other user's entries in place
+        assert DedupSession(other, "deck-b").add(second) is False
+        assert DedupSession(user, "deck-b").add(second) is True
+
+    def test_deduplicate_respects_limit(self, user):
+        cards = [{"question": f"topic{i} alpha{i} beta{i}", "answer": f"gamma{i}"} for i in range(5)]
+        assert dedup_index.deduplicate(cards, user, "deck-e", limit=3) == cards[:3]
+
+
+class TestFilterCards:
+    """Test deduplicating a list of cards whose deck is saved afterwards."""
+
+    def test_nothing_is_indexed_before_commit(self, user):
+        first, second = _text_pair(shared=18, only_each=2)
+        session = DedupSession(user, "deck-a")
+        assert dedup_index.filter_cards(session, [{"question": first, "answer": ""}]) == [{"question": first, "answer": ""}]
+
+        # The deck was never saved (e.g. the job lost its lease): no entries
+        assert DedupSession(user, "deck-b").add(second) is True
+        session.commit()
+        assert DedupSession(user, "deck-b").add(second) is False
+
+    def test_custom_keys_and_limit(self, user):
+        first, second = _text_pair(shared=18, only_each=2)
+        cards = [{"front": first, "back": ""}, {"front": second, "back": ""}, {"front": "other card text", "back": ""}]
+        kept = dedup_index.filter_cards(DedupSession(user, "deck"), cards, "front", "back", limit=1)
+        assert kept == cards[:1]
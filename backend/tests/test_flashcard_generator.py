@@ -0,0 +1,131 @@
+"""
+Flashcard Generator Tests
+
+Run with: pytest backend/tests/test_flashcard_generator.py -v
+
+These tests verify, against a fake LLM gateway (no network):
+1. JobLeaseLost raised by a card callback reaches the caller unchanged,
+   in single-prompt and long-source mode
+2. Long-source mode sends the whole text, in at most FLASHCARD_MAX_SECTIONS
+   prompts sized from the text, and only skips text beyond the model context
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import flashcard_generator
+from services import llm_gateway, token_budget
+from services.job_queue import JobLeaseLost
+
+
+def _response(n_cards=10, tag="card"):
+    return json.dumps({"flashcards": [
+        {"question": f"Why does {tag}x{i} cause {tag}y{i}?", "answer": f"Because of {tag}z{i}."} for i in range(n_cards)
+    ]})
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """Serve every (streamed or plain) completion with ten cards."""
+    calls = []
+
+    def stream_chat_completion(use_cache=True, **request):
+        calls.append(request)
+        text = _response(tag=f"section{len(calls)}")
+        for start in range(0, len(text), 40):
+            yield text[start:start + 40]
+
+    def chat_completion(use_cache=True, **request):
+        calls.append(request)
+        message = SimpleNamespace(content=_response(tag=f"section{len(calls)}"))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(llm_gateway, "get_client", lambda: object())
+    monkeypatch.setattr(llm_gateway, "stream_chat_completion", stream_chat_completion)
+    monkeypatch.setattr(llm_gateway, "chat_completion", chat_completion)
+    return calls
+
+
+def _lose_lease(card, number):
+    raise JobLeaseLost("reclaimed")
+
+
+class TestLeaseLost:
+    """Test that a lost lease is not reported as a generation failure."""
+
+    def test_single_prompt_on_card(self, gateway):
+        with pytest.raises(JobLeaseLost):
+            flashcard_generator.generate_flashcards("Mitochondria produce ATP.", on_card=_lose_lease)
+
+    def test_long_source_on_draft(self, gateway, monkeypatch):
+        monkeypatch.setattr(flashcard_generator, "input_token_budget", lambda: 50)
+        text = "\n\n".join(f"Paragraph {i} about cellular respiration and ATP. " * 8 for i in range(6))
+        with pytest.raises(JobLeaseLost):
+            flashcard_generator.generate_flashcards(text, on_card=lambda card, n: None, on_draft=_lose_lease)
+
+    def test_long_source_on_card(self, gateway, monkeypatch):
+        monkeypatch.setattr(flashcard_generator, "input_token_budget", lambda: 50)
+        text = "\n\n".join(f"Paragraph {i} about cellular respiration and ATP. " * 8 for i in range(6))
+        with pytest.raises(JobLeaseLost):
+            flashcard_generator.generate_flashcards(text, on_card=_lose_lease)
+
+    def test_other_callback_errors_are_still_mapped(self, gateway):
+        def fail(card, number):
+            raise RuntimeError("boom")
+
+        with pytest.raises(HTTPException) as error:
+            flashcard_generator.generate_flashcards("Mitochondria produce ATP.", on_card=fail)
+        assert error.value.status_code == 500
+
+
+def _document(pages):
+    """About a PDF page of distinct text per page."""
+    return "\n\n".join(
+        f"Page {page}. " + " ".join(f"Topic{page}x{i} relates to concept{page}y{i}." for i in range(40))
+        for page in range(pages)
+    )
+
+
+def _sent_text(calls):
+    return "".join(request["messages"][1]["content"] for request in calls)
+
+
+class TestLongSource:
+    """Test that long sources are covered in full."""
+
+    def test_long_document_is_sent_in_full(self, gateway):
+        text = _document(300)
+        coverage = {}
+        cards = flashcard_generator.generate_flashcards(text, coverage=coverage)
+
+        assert len(gateway) <= flashcard_generator.FLASHCARD_MAX_SECTIONS
+        assert coverage["skipped_sections"] == []
+        assert coverage["sections_used"] == coverage["sections"] == len(gateway)
+        sent = _sent_text(gateway)
+        assert all(f"Topic{page}x39" in sent for page in range(300))
+        assert len(cards) == flashcard_generator.FLASHCARD_DECK_SIZE
+
+    def test_section_size_follows_the_text(self):
+        budget = flashcard_generator.input_token_budget()
+        max_sections = flashcard_generator.FLASHCARD_MAX_SECTIONS
+        # Slightly too long for one prompt: standard-size sections
+        assert flashcard_generator.section_token_budget(budget + 1) == budget
+        # Much longer: the whole text split over FLASHCARD_MAX_SECTIONS sections
+        assert flashcard_generator.section_token_budget(budget * 100) == -(-budget * 100 // max_sections)
+        # Capped by the model context
+        assert flashcard_generator.section_token_budget(10 ** 9) == flashcard_generator.context_token_budget()
+
+    def test_sections_never_exceed_the_context(self, gateway, monkeypatch):
+        monkeypatch.setattr(flashcard_generator, "FLASHCARD_MODEL_CONTEXT_TOKENS", 8000)
+        coverage = {}
+        flashcard_generator.generate_flashcards(_document(300), coverage=coverage)
+
+        # 300 pages do not fit in FLASHCARD_MAX_SECTIONS prompts of an 8k context
+        assert coverage["skipped_sections"]
+        assert coverage["sections_used"] == flashcard_generator.FLASHCARD_MAX_SECTIONS
+        for request in gateway:
+            assert token_budget.count_message_tokens(request["messages"]) <= 8000 - request["max_tokens"]
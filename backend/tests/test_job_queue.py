@@ -0,0 +1,188 @@
+"""
+Job Queue Tests
+
+Run with: pytest backend/tests/test_job_queue.py -v
+
+These tests verify, against a real SQLite jobs table:
+1. Claiming (only due jobs, never twice)
+2. Lease reclaim after a worker dies, and failing exhausted reclaims
+3. Deferring without using an attempt
+4. enqueue_or_attach single-flight under concurrent callers
+"""
+
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services import job_queue
+
+
+@pytest.fixture(scope="module", autouse=True)
+def jobs_table():
+    job_queue.init_db()
+    yield
+
+
+@pytest.fixture
+def kind():
+    """A job kind of its own, so each test only claims the jobs it queued."""
+    return f"test-{uuid.uuid4()}"
+
+
+def _claim(kind, worker_id="worker-a", lease_seconds=60):
+    return job_queue.claim(worker_id, kinds=[kind], lease_seconds=lease_seconds)
+
+
+class TestClaim:
+    """Test claiming queued jobs."""
+
+    def test_claim_marks_job_running(self, kind):
+        job_id = job_queue.enqueue(kind, {"n": 1}, source_id="src")
+        job = _claim(kind)
+        assert job["id"] == job_id
+        assert job["status"] == job_queue.STATUS_RUNNING
+        assert job["attempts"] == 1
+        assert job["lease_owner"] == "worker-a"
+        assert job["payload"] == {"n": 1}
+
+    def test_claimed_job_is_not_claimed_again(self, kind):
+        job_queue.enqueue(kind, {})
+        assert _claim(kind, "worker-a") is not None
+        assert _claim(kind, "worker-b") is None
+
+    def test_job_not_due_is_not_claimed(self, kind):
+        job_id = job_queue.enqueue(kind, {})
+        job_queue.claim("worker-a", kinds=[kind])
+        job_queue.fail(job_id, "worker-a", "transient", retryable=True)
+        # Backed off into the future
+        assert job_queue.get_job(job_id)["status"] == job_queue.STATUS_QUEUED
+        assert _claim(kind) is None
+
+    def test_complete_stores_result(self, kind):
+        job_id = job_queue.enqueue(kind, {})
+        _claim(kind)
+        job_queue.complete(job_id, "worker-a", {"cards": 3})
+        job = job_queue.get_job(job_id)
+        assert job["status"] == job_queue.STATUS_SUCCEEDED
+        assert job["result"] == {"cards": 3}
+        assert job["lease_owner"] is None
+
+    def test_non_retryable_failure_is_final(self, kind):
+        job_id = job_queue.enqueue(kind, {})
+        _claim(kind)
+        assert job_queue.fail(job_id, "worker-a", "bad input", retryable=False, result={"status": "error"}) is False
+        job = job_queue.get_job(job_id)
+        assert job["status"] == job_queue.STATUS_FAILED
+        assert job["result"] == {"status": "error"}
+
+
+class TestLeaseReclaim:
+    """Test reclaiming jobs whose worker stopped heartbeating."""
+
+    def test_expired_lease_is_reclaimed(self, kind):
+        job_id = job_queue.enqueue(kind, {})
+        _claim(kind, "worker-a", lease_seconds=0)
+        time.sleep(0.01)
+
+        job = _claim(kind, "worker-b")
+        assert job["id"] == job_id
+        assert job["lease_owner"] == "worker-b"
+        assert job["attempts"] == 2
+        # The old worker finds out on its next heartbeat
+        assert job_queue.heartbeat(job_id, "worker-a") is False
+        assert job_queue.heartbeat(job_id, "worker-b") is True
+
+    def test_heartbeat_keeps_lease(self, kind):
+        job_queue.enqueue(kind, {})
+        job = _claim(kind, "worker-a", lease_seconds=0)
+        assert job_queue.heartbeat(job["id"], "worker-a", lease_seconds=60) is True
+        time.sleep(0.01)
+        assert _claim(kind, "worker-b") is None
+
+    def test_reclaim_after_last_attempt_fails_job(self, kind):
+        job_id = job_queue.enqueue(kind, {}, max_attempts=1)
+        _claim(kind, "worker-a", lease_seconds=0)
+        time.sleep(0.01)
+
+        assert _claim(kind, "worker-b") is None
+        job = job_queue.get_job(job_id)
+        assert job["status"] == job_queue.STATUS_FAILED
+        assert job["last_error"] == "Lease expired (worker lost)"
+
+    def test_lost_lease_worker_cannot_complete(self, kind):
+        job_id = job_queue.enqueue(kind, {})
+        _claim(kind, "worker-a", lease_seconds=0)
+        time.sleep(0.01)
+        _claim(kind, "worker-b")
+
+        job_queue.complete(job_id, "worker-a", {"stale": True})
+        job = job_queue.get_job(job_id)
+        assert job["status"] == job_queue.STATUS_RUNNING
+        assert job["lease_owner"] == "worker-b"
+
+
+class TestDefer:
+    """Test deferring a job back to the queue."""
+
+    def test_defer_requeues_without_using_an_attempt(self, kind):
+        job_id = job_queue.enqueue(kind, {}, max_attempts=1)
+        _claim(kind)
+        job_queue.defer(job_id, "worker-a", delay=0, stage="batched")
+
+        job = job_queue.get_job(job_id)
+        assert job["status"] == job_queue.STATUS_QUEUED
+        assert job["stage"] == "batched"
+        assert job["attempts"] == 0
+        assert job["lease_owner"] is None
+
+        # Runs again, still with its only attempt
+        job = _claim(kind)
+        assert job["id"] == job_id
+        assert job["attempts"] == 1
+
+    def test_deferred_job_waits_for_its_delay(self, kind):
+        job_id = job_queue.enqueue(kind, {})
+        _claim(kind)
+        job_queue.defer(job_id, "worker-a", delay=3600)
+        assert _claim(kind) is None
+
+
+class TestEnqueueOrAttach:
+    """Test single-flight enqueueing by dedupe key."""
+
+    def test_second_call_attaches(self, kind):
+        key = f"{kind}:source"
+        first_id, first_created = job_queue.enqueue_or_attach(kind, {}, key)
+        second_id, second_created = job_queue.enqueue_or_attach(kind, {}, key)
+        assert first_created is True
+        assert second_created is False
+        assert second_id == first_id
+        assert job_queue.find_active(key)["id"] == first_id
+
+    def test_running_job_is_attached(self, kind):
+        key = f"{kind}:source"
+        job_id, _ = job_queue.enqueue_or_attach(kind, {}, key)
+        _claim(kind)
+        assert job_queue.enqueue_or_attach(kind, {}, key) == (job_id, False)
+
+    def test_finished_job_is_not_attached(self, kind):
+        key = f"{kind}:source"
+        job_id, _ = job_queue.enqueue_or_attach(kind, {}, key)
+        _claim(kind)
+        job_queue.complete(job_id, "worker-a")
+
+        new_id, created = job_queue.enqueue_or_attach(kind, {}, key)
+        assert created is True
+        assert new_id != job_id
+
+    def test_concurrent_callers_queue_one_job(self, kind):
+        key = f"{kind}:source"
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: job_queue.enqueue_or_attach(kind, {}, key), range(8)))
+
+        assert sum(created for _, created in results) == 1
+        assert len({job_id for job_id, _ in results}) == 1
+        assert _claim(kind) is not None
+        assert _claim(kind) is None
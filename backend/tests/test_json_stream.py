@@ -0,0 +1,110 @@
+"""
+Incremental JSON Array Parser Tests
+
+Run with: pytest backend/tests/test_json_stream.py -v
+
+These tests verify:
+1. Elements are returned as soon as they close, whatever the chunking
+2. Nested objects/arrays and brackets or quotes inside strings
+3. Keyed arrays and preambles (fences, text, brackets in strings)
+4. salvage_array on truncated and malformed responses
+"""
+
+import json
+
+from services.json_stream import JsonArrayStream, salvage_array
+
+
+CARDS = [
+    {"question": "What is [x]?", "answer": "A {placeholder}, \"quoted\""},
+    {"question": "Nested?", "answer": {"parts": [1, [2, 3]], "note": "]}"}},
+    {"question": "Escapes", "answer": "back\\slash \\\" ]"},
+]
+RESPONSE = json.dumps({"flashcards": CARDS})
+
+
+def _feed_in_chunks(parser, text, size):
+    elements = []
+    for start in range(0, len(text), size):
+        elements.extend(parser.feed(text[start:start + size]))
+    return elements
+
+
+class TestStreaming:
+    """Test element-by-element parsing of a streamed response."""
+
+    def test_any_chunking_gives_the_same_elements(self):
+        for size in (1, 2, 7, len(RESPONSE)):
+            parser = JsonArrayStream(key="flashcards")
+            assert _feed_in_chunks(parser, RESPONSE, size) == CARDS
+            assert parser.done
+            assert parser.items == len(CARDS)
+
+    def test_element_is_returned_when_it_closes(self):
+        parser = JsonArrayStream()
+        assert parser.feed('[{"a": 1}, {"b": [1, 2') == [{"a": 1}]
+        assert parser.feed("]}") == [{"b": [1, 2]}]
+        assert not parser.done
+        assert parser.feed("]") == []
+        assert parser.done
+
+    def test_scalar_elements(self):
+        parser = JsonArrayStream()
+        assert parser.feed('["a,b", 12, true, null, "c]"]') == ["a,b", 12, True, None, "c]"]
+
+    def test_text_after_the_array_is_ignored(self):
+        parser = JsonArrayStream()
+        assert parser.feed('[1, 2] trailing [3]') == [1, 2]
+
+    def test_malformed_element_is_skipped(self):
+        parser = JsonArrayStream()
+        assert parser.feed('[{"a": 1}, {"b": oops}, {"c": 3}]') == [{"a": 1}, {"c": 3}]
+        assert parser.invalid == 1
+
+
+class TestPreamble:
+    """Test where the array starts."""
+
+    def test_markdown_fence_and_prose_are_skipped(self):
+        text = f"Here you go:\n```json\n{RESPONSE}\n```"
+        assert JsonArrayStream(key="flashcards").feed(text) == CARDS
+
+    def test_bracket_inside_a_preamble_string(self):
+        text = '{"title": "Deck [draft]", "flashcards": [{"question": "q", "answer": "a"}]}'
+        assert JsonArrayStream(key="flashcards").feed(text) == [{"question": "q", "answer": "a"}]
+
+    def test_array_under_another_key_is_skipped(self):
+        text = '{"tags": ["x", "y"], "flashcards": [{"question": "q", "answer": "a"}]}'
+        assert JsonArrayStream(key="flashcards").feed(text) == [{"question": "q", "answer": "a"}]
+
+    def test_bare_array_with_a_key(self):
+        assert JsonArrayStream(key="flashcards").feed('[{"question": "q"}]') == [{"question": "q"}]
+
+    def test_no_array_yet(self):
+        parser = JsonArrayStream(key="flashcards")
+        assert parser.feed('{"flashcards": ') == []
+        assert not parser.started
+
+
+class TestSalvage:
+    """Test recovering complete elements from truncated or malformed text."""
+
+    def test_truncated_mid_element(self):
+        elements, complete = salvage_array(RESPONSE[:RESPONSE.index('"Escapes"') + 4], key="flashcards")
+        assert elements == CARDS[:2]
+        assert complete is False
+
+    def test_truncated_inside_nested_array(self):
+        elements, complete = salvage_array('{"flashcards": [{"q": 1}, {"q": [1, [2, ', key="flashcards")
+        assert elements == [{"q": 1}]
+        assert complete is False
+
+    def test_complete_array(self):
+        elements, complete = salvage_array(RESPONSE, key="flashcards")
+        assert elements == CARDS
+        assert complete is True
+
+    def test_empty_and_missing_input(self):
+        assert salvage_array("") == ([], False)
+        assert salvage_array(None) == ([], False)
+        assert salvage_array("no json here") == ([], False)
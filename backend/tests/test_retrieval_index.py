@@ -0,0 +1,131 @@
+"""
+Lexical Retrieval Index Tests
+
+Run with: pytest backend/tests/test_retrieval_index.py -v
+
+These tests verify:
+1. BM25 cosine scoring (ranking, range, stop words, unseen terms)
+2. Save/load round-trip (same scores, memory-mapped arrays, version check)
+3. get_index caching: memory, then disk, rebuilt when the chunks change
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from services import retrieval_index
+from services.index_store import IndexCache
+from services.retrieval_index import RetrievalIndex
+
+
+CHUNKS = [
+    "Mitochondria produce ATP through cellular respiration in eukaryotic cells.",
+    "Photosynthesis in chloroplasts converts light energy into glucose.",
+    "The French Revolution began in 1789 with the storming of the Bastille.",
+    "Enzymes lower the activation energy of chemical reactions.",
+]
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval_index, "RETRIEVAL_INDEX_DIR", tmp_path)
+    monkeypatch.setattr(retrieval_index, "_cache", IndexCache(4, "retrieval index"))
+    return tmp_path
+
+
+class TestScoring:
+    """Test BM25 cosine scores of queries against chunks."""
+
+    def test_relevant_chunk_ranks_first(self):
+        index = RetrievalIndex.build(CHUNKS)
+        hits = index.search(["How do mitochondria make ATP?", "When did the French Revolution start?"], top_k=2)
+        assert hits[0][0][0] == 0
+        assert hits[1][0][0] == 2
+        assert hits[0][0][1] > hits[0][1][1]
+
+    def test_scores_are_cosines(self):
+        scores = RetrievalIndex.build(CHUNKS).score(["energy glucose light", "bastille"])
+        assert scores.shape == (2, len(CHUNKS))
+        assert np.all(scores >= 0)
+        assert np.all(scores <= 1 + 1e-9)
+
+    def test_stop_words_do_not_match(self):
+        scores = RetrievalIndex.build(CHUNKS).score(["the of in with"])
+        assert np.all(scores == 0)
+
+    def test_unseen_terms_lower_the_score(self):
+        index = RetrievalIndex.build(CHUNKS)
+        exact, diluted = index.score(["enzymes activation energy", "enzymes activation energy zebra quasar"])
+        assert diluted[3] < exact[3]
+
+    def test_empty_inputs(self):
+        index = RetrievalIndex.build(CHUNKS)
+        assert index.search([], top_k=3) == []
+        assert all(score == 0.0 for _, score in index.search([""], top_k=3)[0])
+        assert RetrievalIndex.build([]).search(["anything"], top_k=3) == [[]]
+
+    def test_top_k_larger_than_chunks(self):
+        hits = RetrievalIndex.build(CHUNKS).search(["energy"], top_k=10)[0]
+        assert len(hits) == len(CHUNKS)
+        assert [score for _, score in hits] == sorted((score for _, score in hits), reverse=True)
+
+
+class TestPersistence:
+    """Test the on-disk format."""
+
+    def test_round_trip_keeps_scores(self, tmp_path):
+        index = RetrievalIndex.build(CHUNKS)
+        index.save(tmp_path / "index")
+        loaded = RetrievalIndex.load(tmp_path / "index")
+
+        queries = ["ATP respiration", "storming the Bastille", "chemical energy"]
+        np.testing.assert_allclose(loaded.score(queries), index.score(queries))
+        assert loaded.fingerprint == index.fingerprint
+        assert loaded.vocab == index.vocab
+        assert isinstance(loaded.idf, np.memmap)
+
+    def test_missing_index(self, tmp_path):
+        assert RetrievalIndex.load(tmp_path / "missing") is None
+
+    def test_other_version_is_not_loaded(self, tmp_path):
+        RetrievalIndex.build(CHUNKS).save(tmp_path / "index")
+        meta_path = tmp_path / "index" / "meta.json"
+        meta = json.loads(meta_path.read_text())
+        meta["version"] = retrieval_index.INDEX_VERSION + 1
+        meta_path.write_text(json.dumps(meta))
+        assert RetrievalIndex.load(tmp_path / "index") is None
+
+    def test_existing_index_is_kept(self, tmp_path):
+        RetrievalIndex.build(CHUNKS).save(tmp_path / "index")
+        RetrievalIndex.build(CHUNKS[:2]).save(tmp_path / "index")
+        assert RetrievalIndex.load(tmp_path / "index").n_chunks == len(CHUNKS)
+        assert [path.name for path in tmp_path.iterdir()] == ["index"]
+
+
+class TestGetIndex:
+    """Test the memory and disk cache behind get_index."""
+
+    def test_memory_then_disk_then_build(self, index_dir):
+        first = retrieval_index.get_index(CHUNKS, key="source-hash")
+        assert retrieval_index.get_index(CHUNKS, key="source-hash") is first
+        assert retrieval_index.get_stats() == {"entries": 1, "memory_hits": 1, "disk_hits": 0, "builds": 1}
+
+        # A fresh process: loaded from disk, not rebuilt
+        retrieval_index._cache = IndexCache(4, "retrieval index")
+        loaded = retrieval_index.get_index(CHUNKS, key="source-hash")
+        assert loaded is not first
+        assert retrieval_index.get_stats()["disk_hits"] == 1
+        assert (index_dir / "source-hash" / first.fingerprint / "meta.json").exists()
+
+    def test_different_chunking_gets_its_own_index(self, index_dir):
+        whole = retrieval_index.get_index(CHUNKS, key="source-hash")
+        halves = retrieval_index.get_index(CHUNKS[:2], key="source-hash")
+        assert halves.n_chunks == 2
+        assert whole.n_chunks == len(CHUNKS)
+        assert len(list((index_dir / "source-hash").iterdir())) == 2
+
+    def test_no_key_is_not_cached(self, index_dir):
+        retrieval_index.get_index(CHUNKS)
+        assert retrieval_index.get_stats()["entries"] == 0
+        assert list(index_dir.iterdir()) == []
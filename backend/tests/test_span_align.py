@@ -0,0 +1,93 @@
+"""
+Span Alignment Tests
+
+Run with: pytest backend/tests/test_span_align.py -v
+
+These tests verify:
+1. Verbatim matches give exact offsets (case-insensitive), score 1.0
+2. Paraphrased or reworded queries align to the right span, with exact
+   offsets even when the words occur earlier in the text
+3. Thresholds, fallbacks and TokenizedText reuse
+"""
+
+from services import span_align
+from services.span_align import TokenizedText, align, find_span
+
+
+TEXT = (
+    "Cells need energy. The mitochondria is the powerhouse of the cell and "
+    "produces ATP through cellular respiration. Chloroplasts capture light "
+    "energy, which plants convert into glucose during photosynthesis."
+)
+
+
+class TestVerbatim:
+    """Test queries that occur in the text as is."""
+
+    def test_exact_offsets(self):
+        query = "the powerhouse of the cell"
+        alignment = align(query, TEXT)
+        assert TEXT[alignment.start:alignment.end] == query
+        assert alignment.score == 1.0
+
+    def test_case_insensitive(self):
+        alignment = align("THE MITOCHONDRIA IS THE POWERHOUSE", TEXT)
+        assert TEXT[alignment.start:alignment.end] == "The mitochondria is the powerhouse"
+        assert alignment.score == 1.0
+
+
+class TestFuzzy:
+    """Test queries that only partly match the text."""
+
+    def test_reworded_sentence_spans_its_source(self):
+        alignment = align("Mitochondria produce ATP via cellular respiration", TEXT)
+        assert alignment.start == TEXT.index("ATP")
+        assert TEXT[alignment.start:alignment.end] == "ATP through cellular respiration"
+        assert alignment.score == 0.5
+        assert alignment.matched_tokens == 3
+
+    def test_offsets_point_at_the_aligned_occurrence(self):
+        # "energy" first occurs in the opening sentence; the span must be the later one
+        alignment = align("plants convert light energy into glucose", TEXT)
+        span = TEXT[alignment.start:alignment.end]
+        assert alignment.start > TEXT.index("Chloroplasts")
+        assert span.endswith("glucose")
+
+    def test_offsets_with_punctuation_and_spacing(self):
+        text = "Intro.\n\n  Water ,  boils   at 100 °C  (sea level)."
+        alignment = align("water boils at 100", text)
+        assert text[alignment.start:alignment.end] == "Water ,  boils   at 100"
+
+    def test_unrelated_query_does_not_align(self):
+        assert align("The French Revolution began in 1789", TEXT) is None
+
+    def test_min_score(self):
+        # 3 of 9 query tokens match
+        query = "produces ATP through respiration in yeast and bacteria cultures"
+        assert align(query, TEXT, min_score=0.5) is None
+        alignment = align(query, TEXT, min_score=0.3)
+        assert TEXT[alignment.start:alignment.end] == "produces ATP through"
+
+    def test_empty_inputs(self):
+        assert align("", TEXT) is None
+        assert align("...", TEXT) is None
+        assert align("mitochondria", "") is None
+
+
+class TestFindSpan:
+    """Test the offset helper used for citations."""
+
+    def test_aligned_span(self):
+        assert find_span("the powerhouse of the cell", TEXT) == (
+            TEXT.index("the powerhouse"), TEXT.index("the powerhouse") + len("the powerhouse of the cell")
+        )
+
+    def test_fallback_to_text_start(self):
+        assert find_span("The French Revolution began in 1789", TEXT) == (
+            0, min(span_align.SPAN_FALLBACK_CHARS, len(TEXT))
+        )
+
+    def test_tokenized_text_is_reusable(self):
+        tokenized = TokenizedText(TEXT)
+        queries = ["cellular respiration", "light energy into glucose", "Mitochondria produce ATP"]
+        assert [find_span(query, tokenized) for query in queries] == [find_span(query, TEXT) for query in queries]
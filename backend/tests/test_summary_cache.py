@@ -0,0 +1,110 @@
+"""
+Summary Response Cache Tests
+
+Run with: pytest backend/tests/test_summary_cache.py -v
+
+These tests verify:
+1. Committing a summary replacement invalidates the cached response; a rollback does not
+2. Cached bodies are only served for the summary id they were built from
+3. A body read before an invalidation is not cached
+4. ETags follow the body; expired entries are misses
+"""
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from services import summary_cache
+from services.summary_cache import SummaryResponseCache
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    cache = SummaryResponseCache(max_entries=4, ttl=60)
+    monkeypatch.setattr(summary_cache, "_response_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def _cache(source_id, summary_id, body=b"body"):
+    return summary_cache.cache_response(source_id, summary_id, body, summary_cache.cache_generation())
+
+
+class TestInvalidation:
+    """Test when a replacement drops the cached response."""
+
+    def test_commit_invalidates_cached_response(self, session, response_cache):
+        etag, _ = _cache("src", "summary-1", b"old")
+        summary_cache.invalidate_on_commit(session, "src")
+        session.execute(text("SELECT 1"))
+
+        # Still served until the replacement is committed
+        assert summary_cache.cached_response("src", "summary-1") == (etag, b"old")
+        session.commit()
+        assert summary_cache.cached_response("src", "summary-1") is None
+        assert response_cache.stats()["invalidations"] == 1
+
+    def test_rollback_keeps_cached_response(self, session, response_cache):
+        _cache("src", "summary-1")
+        summary_cache.invalidate_on_commit(session, "src")
+        session.execute(text("SELECT 1"))
+        session.rollback()
+        assert summary_cache.cached_response("src", "summary-1") is not None
+
+    def test_other_sources_are_kept(self, session, response_cache):
+        _cache("src", "summary-1")
+        _cache("other", "summary-2")
+        summary_cache.invalidate_on_commit(session, "src")
+        session.execute(text("SELECT 1"))
+        session.commit()
+        assert summary_cache.cached_response("other", "summary-2") is not None
+
+    def test_body_read_before_invalidation_is_not_cached(self, response_cache):
+        generation = summary_cache.cache_generation()
+        summary_cache.invalidate("src")
+        _, body = summary_cache.cache_response("src", "summary-1", b"body", generation)
+        assert body == b"body"
+        assert summary_cache.cached_response("src", "summary-1") is None
+
+
+class TestVersioning:
+    """Test that entries are versioned by summary id."""
+
+    def test_same_summary_id_is_a_hit(self, response_cache):
+        etag, _ = _cache("src", "summary-1")
+        assert summary_cache.cached_response("src", "summary-1") == (etag, b"body")
+        assert response_cache.stats()["hits"] == 1
+
+    def test_other_summary_id_is_stale(self, response_cache):
+        # e.g. a rebuild committed by another process
+        _cache("src", "summary-1")
+        assert summary_cache.cached_response("src", "summary-2") is None
+        assert summary_cache.cached_response("src", "summary-1") is None
+        assert response_cache.stats()["stale"] == 1
+
+    def test_etag_follows_the_body(self, response_cache):
+        first, _ = _cache("a", "summary-1", b"body")
+        same, _ = _cache("b", "summary-2", b"body")
+        other, _ = _cache("c", "summary-3", b"other body")
+        assert first == same
+        assert first != other
+        assert first.startswith('"') and first.endswith('"')
+
+    def test_expired_entry_is_a_miss(self):
+        cache = SummaryResponseCache(max_entries=4, ttl=-1)
+        cache.put("src", "summary-1", b"body", cache.generation())
+        assert cache.get("src", "summary-1") is None
+
+    def test_lru_eviction(self):
+        cache = SummaryResponseCache(max_entries=2, ttl=60)
+        for source_id in ("a", "b", "c"):
+            cache.put(source_id, "summary", b"body", cache.generation())
+        assert cache.get("a", "summary") is None
+        assert cache.get("c", "summary") is not None
@@ -0,0 +1,109 @@
+"""
+Summary Persistence Tests
+
+Run with: pytest backend/tests/test_summary_store.py -v
+
+These tests verify:
+1. replace_summary/load_summary round-trip (ordering, citations, empty summaries)
+2. A replacement deletes the whole previous tree and gets a new summary id
+3. Committing a replacement invalidates the cached response
+
+The SQLAlchemy models are needed, so these skip where `models` is not importable.
+"""
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+models = pytest.importorskip("models")
+
+from services import summary_cache, summary_store  # noqa: E402
+from services.summary_cache import SummaryResponseCache  # noqa: E402
+
+
+SENTENCES = [
+    {
+        "order_index": 1,
+        "sentence_text": "Chloroplasts capture light.",
+        "support_status": "supported",
+        "citations": [
+            {"chunk_id": "c2", "start_char": 0, "end_char": 10, "score": 0.4},
+            {"chunk_id": "c3", "start_char": 5, "end_char": 20, "score": 0.9, "preview_text": "light"},
+        ],
+    },
+    {
+        "order_index": 0,
+        "sentence_text": "Mitochondria produce ATP.",
+        "support_status": "supported",
+        "citations": [{"chunk_id": "c1", "start_char": 3, "end_char": 30, "score": 0.8}],
+    },
+    {"order_index": 2, "sentence_text": "Unsupported claim.", "support_status": "unsupported", "citations": []},
+]
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    cache = SummaryResponseCache(max_entries=4, ttl=60)
+    monkeypatch.setattr(summary_cache, "_response_cache", cache)
+    return cache
+
+
+class TestRoundTrip:
+    """Test writing and reading a summary tree."""
+
+    def test_load_returns_what_was_written(self, session, response_cache):
+        summary_id = summary_store.replace_summary(session, "src", SENTENCES, text="summary")
+        session.commit()
+
+        summary = summary_store.load_summary(session, "src")
+        assert summary["summary_id"] == summary_id
+        assert [s["sentence_text"] for s in summary["sentences"]] == [
+            "Mitochondria produce ATP.", "Chloroplasts capture light.", "Unsupported claim."
+        ]
+        # Citations by score, missing preview_text as None
+        chloroplasts = summary["sentences"][1]
+        assert [c["chunk_id"] for c in chloroplasts["citations"]] == ["c3", "c2"]
+        assert [c["preview_text"] for c in chloroplasts["citations"]] == ["light", None]
+        assert summary["sentences"][2]["citations"] == []
+
+    def test_replacement_removes_the_old_tree(self, session, response_cache):
+        first_id = summary_store.replace_summary(session, "src", SENTENCES)
+        session.commit()
+        second_id = summary_store.replace_summary(session, "src", SENTENCES[:1])
+        session.commit()
+
+        assert second_id != first_id
+        assert summary_store.current_summary_id(session, "src") == second_id
+        assert len(summary_store.load_summary(session, "src")["sentences"]) == 1
+        assert session.scalar(select(func.count()).select_from(models.Summary)) == 1
+        assert session.scalar(select(func.count()).select_from(models.SummarySentence)) == 1
+        assert session.scalar(select(func.count()).select_from(models.SummarySentenceCitation)) == 2
+
+    def test_summary_without_sentences(self, session, response_cache):
+        summary_id = summary_store.replace_summary(session, "src", [])
+        session.commit()
+        assert summary_store.load_summary(session, "src") == {
+            "summary_id": summary_id, "source_id": "src", "sentences": []
+        }
+
+    def test_missing_summary(self, session):
+        assert summary_store.load_summary(session, "missing") is None
+        assert summary_store.current_summary_id(session, "missing") is None
+
+    def test_commit_invalidates_cached_response(self, session, response_cache):
+        summary_id = summary_store.replace_summary(session, "src", SENTENCES)
+        session.commit()
+        summary_cache.cache_response("src", summary_id, b"old", summary_cache.cache_generation())
+
+        summary_store.replace_summary(session, "src", SENTENCES[:1])
+        session.commit()
+        assert summary_cache.cached_response("src", summary_id) is None
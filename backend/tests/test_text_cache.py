@@ -0,0 +1,97 @@
+"""
+Extracted-Text Cache Tests
+
+Run with: pytest backend/tests/test_text_cache.py -v
+
+These tests verify:
+1. Concurrent requests for one content hash share a single extraction
+2. Per-hash locks are dropped once no extraction is pending
+3. The source -> content hash memo is bounded (LRU)
+"""
+
+import threading
+import time
+
+import pytest
+
+from pdf_processor import PdfText
+from services import text_cache
+from services.text_cache import TextCache
+
+
+@pytest.fixture
+def sources(monkeypatch, tmp_path):
+    """Every source is a PDF whose content hash is `hash-<source id>`, unless mapped in the returned dict."""
+    hashes = {}
+    extractions = []
+
+    def get_pdf_hash(source_id, file_path=None):
+        return hashes.get(source_id, f"hash-{source_id}")
+
+    def extract_pdf_text(file_path):
+        extractions.append(file_path)
+        time.sleep(0.05)
+        return PdfText(f"text of {file_path}", 1, 1, False)
+
+    monkeypatch.setattr(text_cache, "UPLOAD_DIR", tmp_path)
+    monkeypatch.setattr(text_cache.content_index, "get_pdf_hash", get_pdf_hash)
+    monkeypatch.setattr(text_cache, "extract_pdf_text", extract_pdf_text)
+    return hashes, extractions
+
+
+def _upload(tmp_path, *source_ids):
+    for source_id in source_ids:
+        (tmp_path / f"{source_id}.pdf").write_bytes(b"%PDF")
+
+
+class TestSingleFlight:
+    """Test one extraction per content hash."""
+
+    def test_concurrent_gets_extract_once(self, sources, tmp_path):
+        hashes, extractions = sources
+        _upload(tmp_path, "a", "b")
+        hashes.update({"a": "same", "b": "same"})
+        cache = TextCache(artifact_dir=tmp_path / "text")
+
+        results = []
+        threads = [threading.Thread(target=lambda s=s: results.append(cache.get(s))) for s in ["a", "b"] * 4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(extractions) == 1
+        assert len(set(results)) == 1
+
+    def test_key_locks_are_released(self, sources, tmp_path):
+        _upload(tmp_path, *[f"s{i}" for i in range(20)])
+        cache = TextCache(artifact_dir=tmp_path / "text")
+
+        for i in range(20):
+            cache.get(f"s{i}")
+
+        assert cache._key_locks == {}
+        assert cache._pending == {}
+
+
+class TestSourceHashes:
+    """Test the bounded source -> content hash memo."""
+
+    def test_memo_is_bounded(self, sources, tmp_path):
+        cache = TextCache(artifact_dir=tmp_path / "text", max_sources=3)
+
+        for i in range(10):
+            assert cache.resolve_hash(f"s{i}") == f"hash-s{i}"
+
+        assert list(cache._source_hashes) == ["s7", "s8", "s9"]
+        assert cache.stats()["sources"] == 3
+
+    def test_recently_used_sources_are_kept(self, sources, tmp_path):
+        cache = TextCache(artifact_dir=tmp_path / "text", max_sources=2)
+
+        cache.resolve_hash("old")
+        cache.resolve_hash("other")
+        cache.resolve_hash("old")
+        cache.resolve_hash("new")
+
+        assert list(cache._source_hashes) == ["old", "new"]
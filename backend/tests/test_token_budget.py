@@ -0,0 +1,144 @@
+"""
+Token Budgeting Tests
+
+Run with: pytest backend/tests/test_token_budget.py -v
+
+These tests verify, without a tokenizer download:
+1. Counting falls back to estimates when tiktoken is missing or offline
+2. truncate_to_tokens and fit_text stay within budget on estimates
+3. The count cache is keyed by model and fingerprint
+"""
+
+import pytest
+
+from services import token_budget
+from services.token_budget import TokenCountCache
+
+
+TEXT = (
+    "Mitochondria produce ATP through cellular respiration. "
+    "def f(x):\n    return x ** 2 + 1  # 12345678\n"
+    "Die Zellatmung läuft in den Mitochondrien ab. 光合作用发生在叶绿体中。"
+)
+
+
+class _OfflineTiktoken:
+    """Stands in for tiktoken on a host that cannot download encodings."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encoding_for_model(self, model):
+        self.calls += 1
+        raise OSError("network unreachable")
+
+    def get_encoding(self, name):
+        raise OSError("network unreachable")
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(token_budget, "_encodings", {})
+    monkeypatch.setattr(token_budget, "_count_cache", TokenCountCache(max_entries=4))
+
+
+class TestFallback:
+    """Test counting without a usable tokenizer."""
+
+    def test_without_tiktoken_counts_are_estimates(self, monkeypatch):
+        monkeypatch.setattr(token_budget, "tiktoken", None)
+        assert not token_budget.tokenizer_available()
+        assert token_budget.count_tokens(TEXT) == token_budget.estimate_tokens(TEXT)
+
+    def test_offline_encoding_falls_back_once(self, monkeypatch):
+        offline = _OfflineTiktoken()
+        monkeypatch.setattr(token_budget, "tiktoken", offline)
+        assert token_budget.count_tokens(TEXT) == token_budget.estimate_tokens(TEXT)
+        assert token_budget.count_tokens("other text") == token_budget.estimate_tokens("other text")
+        assert not token_budget.tokenizer_available()
+        # The failure is remembered, not retried on every count
+        assert offline.calls == 1
+        assert token_budget._encodings[token_budget.DEFAULT_MODEL] is False
+
+    def test_tokenizer_disabled_by_config(self, monkeypatch):
+        monkeypatch.setattr(token_budget, "tiktoken", _OfflineTiktoken())
+        monkeypatch.setattr(token_budget, "TOKEN_BUDGET_USE_TOKENIZER", False)
+        assert not token_budget.tokenizer_available()
+        assert token_budget._encodings == {}
+
+
+class TestEstimate:
+    """Test the tokenizer-free estimate."""
+
+    def test_empty_text(self):
+        assert token_budget.estimate_tokens("") == 0
+        assert token_budget.count_tokens("") == 0
+        assert token_budget.count_tokens(None) == 0
+
+    def test_numbers_and_cjk_cost_more_than_words(self):
+        assert token_budget.estimate_tokens("123456789") == 3
+        assert token_budget.estimate_tokens("叶绿体") == 3
+        assert token_budget.estimate_tokens(" cell") == 1
+
+    def test_message_overhead(self, monkeypatch):
+        monkeypatch.setattr(token_budget, "tiktoken", None)
+        messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": TEXT}]
+        expected = (
+            token_budget.TOKENS_PER_REPLY
+            + 2 * token_budget.TOKENS_PER_MESSAGE
+            + token_budget.count_tokens("Be brief.")
+            + token_budget.count_tokens(TEXT)
+        )
+        assert token_budget.count_message_tokens(messages) == expected
+
+
+class TestTruncation:
+    """Test trimming text to a token budget on estimates."""
+
+    @pytest.fixture(autouse=True)
+    def no_tokenizer(self, monkeypatch):
+        monkeypatch.setattr(token_budget, "tiktoken", None)
+
+    def test_truncate_stays_within_budget(self):
+        total = token_budget.count_tokens(TEXT)
+        for budget in range(1, total + 1):
+            truncated = token_budget.truncate_to_tokens(TEXT, budget)
+            assert TEXT.startswith(truncated)
+            assert token_budget.count_tokens(truncated) <= budget
+        assert token_budget.truncate_to_tokens(TEXT, total) == TEXT
+
+    def test_truncate_cuts_at_whole_pieces(self):
+        assert token_budget.truncate_to_tokens("alpha beta gamma", 2) == "alpha beta"
+        assert token_budget.truncate_to_tokens("alpha beta", 0) == ""
+
+    def test_fit_text_fits_the_whole_prompt(self):
+        fixed = ["You write flashcards.", "Return JSON."]
+        for budget in (25, 40, 60):
+            text, prompt_tokens = token_budget.fit_text(TEXT, budget, fixed=fixed)
+            assert text and TEXT.startswith(text) and text != TEXT
+            assert prompt_tokens <= budget
+        assert token_budget.fit_text(TEXT, 1000, fixed=fixed)[0] == TEXT
+
+    def test_fit_text_with_no_room(self):
+        text, prompt_tokens = token_budget.fit_text(TEXT, 5, fixed=["A long system prompt that uses the budget."])
+        assert text == ""
+        assert prompt_tokens > 5
+
+
+class TestCountCache:
+    """Test the LRU of token counts."""
+
+    def test_repeated_count_is_a_hit(self, monkeypatch):
+        monkeypatch.setattr(token_budget, "tiktoken", None)
+        token_budget.count_tokens(TEXT)
+        token_budget.count_tokens(TEXT)
+        assert token_budget._count_cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+    def test_lru_eviction(self):
+        cache = TokenCountCache(max_entries=2)
+        cache.put(("m", 1, 1), 1)
+        cache.put(("m", 2, 2), 2)
+        assert cache.get(("m", 1, 1)) == 1
+        cache.put(("m", 3, 3), 3)
+        assert cache.get(("m", 2, 2)) is None
+        assert cache.get(("m", 1, 1)) == 1
@@ -3,7 +3,7 @@
 import { useState, useEffect } from 'react'
 import { motion } from 'framer-motion'
 import { Loader2, CheckCircle, AlertCircle } from 'lucide-react'
-import { apiGet } from '@/lib/apiClient'
+import { apiGet, apiEventSource } from '@/lib/apiClient'
 
 interface ProcessingStatusProps {
   pdfId: string
@@ -12,12 +12,36 @@ interface ProcessingStatusProps {
 }
 
 interface Status {
-  status: 'uploaded' | 'processing' | 'completed' | 'error' | 'quota_exceeded' | 'auth_error' | 'timeout' | 'service_error'
+  status: 'uploaded' | 'processing' | 'completed' | 'error' | 'quota_exceeded' | 'auth_error' | 'timeout' | 'service_error' | 'duplicate_cards'
   error_message?: string
 }
 
+// `event: stage` data from /status/{pdf_id}/stream; the final completed/error
+// event also carries the /status payload
+interface StageEvent extends Partial<Status> {
+  stage: string
+}
+
+// `event: card` data: a generated flashcard (draft cards may still be dropped)
+interface CardEvent {
+  card: { card_number: number; draft: boolean }
+}
+
+const ERROR_STATUSES = ['error', 'quota_exceeded', 'auth_error', 'timeout', 'service_error', 'duplicate_cards']
+
+const STAGE_MESSAGES: Record<string, string> = {
+  queued: 'Waiting for a free worker',
+  retrying: 'Something went wrong, retrying',
+  batched: 'Queued for bulk generation',
+  extracting: 'Reading your PDF',
+  generating: 'Generating flashcards with AI',
+  persisting: 'Saving your deck',
+}
+
 export default function ProcessingStatus({ pdfId, onComplete, onError }: ProcessingStatusProps) {
   const [status, setStatus] = useState<Status>({ status: 'processing' })
+  const [stage, setStage] = useState<string | null>(null)
+  const [cardCount, setCardCount] = useState(0)
   const [dots, setDots] = useState('')
 
   // Animate dots
@@ -28,28 +52,87 @@ export default function ProcessingStatus({ pdfId, onComplete, onError }: Process
     return () => clearInterval(interval)
   }, [])
 
-  // Poll for status updates
+  // Follow the progress stream; poll /status only when streaming is unavailable
   useEffect(() => {
+    let cancelled = false
+    let finished = false
+    let timer: ReturnType<typeof setTimeout> | undefined
+    let source: EventSource | null = null
+
+    // Returns whether the status is final
+    const handleStatus = (data: Status) => {
+      setStatus(data)
+      if (data.status === 'completed') {
+        finished = true
+        timer = setTimeout(onComplete, 1000)
+      } else if (ERROR_STATUSES.includes(data.status)) {
+        finished = true
+        timer = setTimeout(onError, 1000)
+      }
+      return finished
+    }
+
     const pollStatus = async () => {
       try {
         const data = await apiGet<Status>(`/status/${pdfId}`)
-        setStatus(data)
-
-        if (data.status === 'completed') {
-          setTimeout(onComplete, 1000)
-        } else if (['error', 'quota_exceeded', 'auth_error', 'timeout', 'service_error'].includes(data.status)) {
-          setTimeout(onError, 1000)
-        } else {
+        if (cancelled) return
+        if (!handleStatus(data)) {
           // Continue polling
-          setTimeout(pollStatus, 2000)
+          timer = setTimeout(pollStatus, 2000)
         }
       } catch (error) {
         console.error('Error polling status:', error)
-        setTimeout(pollStatus, 5000) // Retry after 5 seconds
+        if (!cancelled) {
+          timer = setTimeout(pollStatus, 5000) // Retry after 5 seconds
+        }
+      }
+    }
+
+    const fallBackToPolling = () => {
+      source?.close()
+      source = null
+      if (!cancelled && !finished) {
+        pollStatus()
       }
     }
 
-    pollStatus()
+    try {
+      source = apiEventSource(`/status/${pdfId}/stream`)
+    } catch (error) {
+      console.error('Error opening status stream:', error)
+      pollStatus()
+    }
+
+    source?.addEventListener('stage', (event) => {
+      const data: StageEvent = JSON.parse((event as MessageEvent).data)
+      // Terminal stages carry the /status payload; so does the single event sent
+      // for a PDF that never had a job (its stage is its status)
+      if ((data.stage === 'completed' || data.stage === 'error' || data.stage === data.status) && data.status) {
+        if (handleStatus(data as Status)) {
+          source?.close()
+        } else {
+          fallBackToPolling()
+        }
+        return
+      }
+      setStage(data.stage)
+    })
+
+    source?.addEventListener('card', (event) => {
+      const data: CardEvent = JSON.parse((event as MessageEvent).data)
+      if (!data.card.draft) {
+        setCardCount(count => Math.max(count, data.card.card_number))
+      }
+    })
+
+    // The stream closed or failed before a final status (EventSource would reconnect)
+    source?.addEventListener('error', fallBackToPolling)
+
+    return () => {
+      cancelled = true
+      source?.close()
+      clearTimeout(timer)
+    }
   }, [pdfId, onComplete, onError])
 
   const getStatusIcon = () => {
@@ -64,6 +147,8 @@ export default function ProcessingStatus({ pdfId, onComplete, onError }: Process
         return <AlertCircle className="w-16 h-16 text-orange-500" />
       case 'service_error':
         return <AlertCircle className="w-16 h-16 text-purple-500" />
+      case 'duplicate_cards':
+        return <AlertCircle className="w-16 h-16 text-yellow-500" />
       case 'error':
         return <AlertCircle className="w-16 h-16 text-red-500" />
       default:
@@ -83,10 +168,15 @@ export default function ProcessingStatus({ pdfId, onComplete, onError }: Process
         return status.error_message || 'AI service timeout, please try again later'
       case 'service_error':
         return status.error_message || 'AI service temporarily unavailable, please try again later'
+      case 'duplicate_cards':
+        return status.error_message || 'Every generated flashcard duplicates one in your other decks'
       case 'error':
         return status.error_message || 'Failed to generate flashcards, please try again later'
       default:
-        return `Generating flashcards with AI${dots}`
+        if (stage === 'generating' && cardCount > 0) {
+          return `Generated ${cardCount} flashcard${cardCount === 1 ? '' : 's'}${dots}`
+        }
+        return `${(stage && STAGE_MESSAGES[stage]) || 'Generating flashcards with AI'}${dots}`
     }
   }
 
@@ -102,6 +192,8 @@ export default function ProcessingStatus({ pdfId, onComplete, onError }: Process
         return 'bg-orange-50 border-orange-200'
       case 'service_error':
         return 'bg-purple-50 border-purple-200'
+      case 'duplicate_cards':
+        return 'bg-yellow-50 border-yellow-200'
       case 'error':
         return 'bg-red-50 border-red-200'
       default:
@@ -133,7 +225,7 @@ export default function ProcessingStatus({ pdfId, onComplete, onError }: Process
             className="text-2xl font-bold text-gray-900 mb-4"
           >
             {status.status === 'completed' ? 'Ready to Study!' : 
-             ['error', 'quota_exceeded', 'auth_error', 'timeout', 'service_error'].includes(status.status) ? 'Oops!' : 
+             ['error', 'quota_exceeded', 'auth_error', 'timeout', 'service_error', 'duplicate_cards'].includes(status.status) ? 'Oops!' : 
              'Processing Your PDF'}
           </motion.h2>
           
@@ -167,7 +259,7 @@ export default function ProcessingStatus({ pdfId, onComplete, onError }: Process
             </motion.div>
           )}
 
-          {['error', 'quota_exceeded', 'auth_error', 'timeout', 'service_error'].includes(status.status) && (
+          {['error', 'quota_exceeded', 'auth_error', 'timeout', 'service_error', 'duplicate_cards'].includes(status.status) && (
             <motion.button
               initial={{ opacity: 0, y: 20 }}
               animate={{ opacity: 1, y: 0 }}
@@ -58,6 +58,16 @@ function getApiUrl(path: string): string {
   return `${baseUrl}${normalizedPath}`;
 }
 
+/**
+ * Open a server-sent events stream on an API endpoint.
+ *
+ * EventSource cannot send the Authorization header, so this is only for
+ * endpoints that do not require auth (e.g. /status/{pdf_id}/stream).
+ */
+export function apiEventSource(path: string): EventSource {
+  return new EventSource(getApiUrl(path));
+}
+
 /**
  * Standard API error structure
  */